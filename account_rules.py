@@ -0,0 +1,141 @@
+"""
+Kontoregler - kompilerad matchning av kontoetiketter till roller och rapportgrupper
+"""
+import bisect
+import hashlib
+import json
+import os
+import re
+from collections import namedtuple
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'account_rules.json')
+
+# Kontonummer i början av etiketten, t.ex. "3010 Försäljning"
+ACCOUNT_NUMBER_PATTERN = re.compile(r'^\s*(\d{4})\b')
+
+AccountClass = namedtuple('AccountClass', ['role', 'group', 'account_number'])
+
+
+class AccountRules:
+    """
+    Regelmotor som kompileras en gång från regelfilen. Roller (SUMMA-rader,
+    resultatrad m.m.) matchas i filens ordning. Rapportgrupper matchas först
+    via BAS-kontonummer och annars via nyckelord, där längsta nyckelordet vinner.
+    Anges sidan (intäkter/kostnader) som raden står på matchas bara grupper
+    som hör till den sidan eller saknar sida.
+    Resultatet memoiseras per unik etikett och sida för alla flikar.
+    version ändras när regelfilens innehåll ändras.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.version = hashlib.sha1(json.dumps(rules, sort_keys=True).encode()).hexdigest()
+        self.roles = []
+        for rule in rules.get('roles', []):
+            patterns = [re.escape(keyword) for keyword in rule.get('keywords', [])] + rule.get('regex', [])
+            self.roles.append((rule['role'], re.compile('|'.join(patterns), re.IGNORECASE)))
+
+        # Ett enda uttryck för alla gruppnyckelord, längst först
+        self.keyword_groups = {}
+        self.regex_groups = []
+        for rule in rules.get('groups', []):
+            for keyword in rule.get('keywords', []):
+                self.keyword_groups.setdefault(keyword.casefold(), rule['group'])
+            for regex in rule.get('regex', []):
+                self.regex_groups.append((re.compile(regex, re.IGNORECASE), rule['group']))
+        keywords = sorted(self.keyword_groups, key=len, reverse=True)
+        self.keyword_pattern = re.compile('|'.join(map(re.escape, keywords)), re.IGNORECASE) if keywords else None
+
+        # BAS-intervall sorterade för binärsökning
+        ranges = sorted(
+            (low, high, rule['group'])
+            for rule in rules.get('groups', [])
+            for low, high in rule.get('accounts', [])
+        )
+        self.range_starts = [low for low, _, _ in ranges]
+        self.ranges = ranges
+
+        self.groups = list(dict.fromkeys(rule['group'] for rule in rules.get('groups', [])))
+        # Intäkts- eller kostnadssida per grupp, None för grupper som kan stå på båda
+        self.group_sides = {}
+        for rule in rules.get('groups', []):
+            self.group_sides.setdefault(rule['group'], rule.get('side'))
+        self._side_patterns = {}
+        self._cache = {}
+
+    def allows(self, group, side):
+        """True om gruppen får stå på sidan (None betyder okänd sida eller grupp)"""
+        return group is None or side is None or self.group_sides.get(group) in (None, side)
+
+    def _keyword_pattern(self, side):
+        """Nyckelordsuttryck för grupperna som får stå på sidan, längst först"""
+        if side is None:
+            return self.keyword_pattern
+        if side not in self._side_patterns:
+            keywords = sorted((keyword for keyword, group in self.keyword_groups.items()
+                               if self.allows(group, side)), key=len, reverse=True)
+            self._side_patterns[side] = (re.compile('|'.join(map(re.escape, keywords)), re.IGNORECASE)
+                                         if keywords else None)
+        return self._side_patterns[side]
+
+    def _group_for_number(self, number):
+        """Slår upp rapportgrupp för ett BAS-kontonummer"""
+        pos = bisect.bisect_right(self.range_starts, number) - 1
+        if pos >= 0 and self.ranges[pos][0] <= number <= self.ranges[pos][1]:
+            return self.ranges[pos][2]
+        return None
+
+    def _classify(self, label, side=None):
+        """Klassificerar en etikett utan cache"""
+        role = 'account'
+        for name, pattern in self.roles:
+            if pattern.search(label):
+                role = name
+                break
+
+        match = ACCOUNT_NUMBER_PATTERN.match(label)
+        number = int(match.group(1)) if match else None
+        group = self._group_for_number(number) if number is not None else None
+        if not self.allows(group, side):
+            group = None
+        if group is None:
+            for pattern, name in self.regex_groups:
+                if self.allows(name, side) and pattern.search(label):
+                    group = name
+                    break
+        keyword_pattern = self._keyword_pattern(side)
+        if group is None and keyword_pattern is not None:
+            keyword = keyword_pattern.search(label)
+            if keyword:
+                group = self.keyword_groups[keyword.group(0).casefold()]
+        return AccountClass(role, group, number)
+
+    def classify(self, label, side=None):
+        """Returnerar (roll, grupp, kontonummer) för en etikett på given sida - memoiserat"""
+        label = '' if label is None else str(label).strip()
+        result = self._cache.get((label, side))
+        if result is None:
+            result = self._cache[(label, side)] = self._classify(label, side)
+        return result
+
+    def role(self, label):
+        """Returnerar radens roll, t.ex. 'revenue_total', 'subtotal' eller 'account'"""
+        return self.classify(label).role
+
+    def group(self, label, side=None):
+        """Returnerar rapportgrupp, None om ingen regel matchar på sidan"""
+        return self.classify(label, side).group
+
+
+_loaded_rules = {}
+
+
+def get_account_rules(path=None):
+    """Läser och kompilerar regelfilen en gång per process och filversion (storlek och ändringstid)"""
+    path = os.path.abspath(path or DEFAULT_RULES_FILE)
+    stat = os.stat(path)
+    cache_key = (path, stat.st_size, stat.st_mtime_ns)
+    if cache_key not in _loaded_rules:
+        with open(path, encoding='utf-8') as f:
+            _loaded_rules[cache_key] = AccountRules(json.load(f))
+    return _loaded_rules[cache_key]
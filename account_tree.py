@@ -0,0 +1,185 @@
+"""
+Kontohierarki - bygger ett explicit kontoträd per flik med prefixsummor för snabba delsummor
+"""
+import numpy as np
+
+from account_rules import get_account_rules
+
+# Roller som stänger en grupp i kontoträdet
+CLOSING_ROLES = ('subtotal', 'revenue_total', 'expense_total')
+
+
+def _normalize(label):
+    """Normaliserar etikett för matchning mellan rubrik och SUMMA-rad"""
+    return ' '.join(str(label).split()).casefold()
+
+
+class AccountTree:
+    """
+    Kontoträd för en flik: rubriker blir grupper, detaljkonton blir löv och
+    SUMMA-rader stänger sin grupp. Lövens värden lagras som en tvådimensionell
+    prefixsumma (löv × månad) så att varje delträds summa för valfritt
+    månadsintervall kan läsas ut i O(1).
+    """
+
+    def __init__(self, labels, values, net_result_row=None, n_months=12, rules=None):
+        self.n_months = n_months
+        self.rules = rules or get_account_rules()
+        self.labels = []
+        self.rows = []
+        self.kinds = []
+        self.parents = []
+        self.depths = []
+        self.summa_rows = []
+        self.leaf_start = []
+        self.leaf_end = []
+        self.leaf_nodes = []
+
+        self._build(labels, values, net_result_row)
+
+        # Prefixsumma över löv (i DFS-ordning) och månader
+        leaf_values = np.zeros((len(self.leaf_nodes), n_months))
+        if self.leaf_nodes:
+            leaf_rows = [self.rows[node] for node in self.leaf_nodes]
+            leaf_values = np.nan_to_num(values[leaf_rows, :n_months])
+        self.leaf_values = leaf_values
+        self.prefix = np.zeros((len(self.leaf_nodes) + 1, n_months + 1))
+        self.prefix[1:, 1:] = leaf_values.cumsum(axis=0).cumsum(axis=1)
+
+        self.leaf_start = np.array(self.leaf_start, dtype=int)
+        self.leaf_end = np.array(self.leaf_end, dtype=int)
+        self.parents = np.array(self.parents, dtype=int)
+        self.depths = np.array(self.depths, dtype=int)
+
+    def _add_node(self, label, row, kind, parent):
+        """Lägger till en nod och returnerar dess index"""
+        self.labels.append(label)
+        self.rows.append(row)
+        self.kinds.append(kind)
+        self.parents.append(parent)
+        self.depths.append(self.depths[parent] + 1 if parent >= 0 else 0)
+        self.summa_rows.append(None)
+        self.leaf_start.append(len(self.leaf_nodes))
+        self.leaf_end.append(len(self.leaf_nodes))
+        return len(self.labels) - 1
+
+    def _close(self, node):
+        """Stänger en grupp - lövintervallet slutar vid nuvarande löv"""
+        self.leaf_end[node] = len(self.leaf_nodes)
+
+    def _build(self, labels, values, net_result_row):
+        """Tolkar radordningen: rubrik öppnar grupp, SUMMA-rad stänger, övriga rader är konton"""
+        root_label = labels[net_result_row] if net_result_row is not None else 'BERÄKNAT RESULTAT'
+        root = self._add_node(root_label, net_result_row, 'root', -1)
+        stack = [root]
+        has_values = ~np.isnan(values[:, :self.n_months + 1]).all(axis=1)
+
+        for row, label in enumerate(labels):
+            role = self.rules.role(label)
+            if not label or row == net_result_row or role == 'column_header':
+                continue
+
+            if not has_values[row]:
+                # Rubrikrad utan värden öppnar en ny grupp
+                stack.append(self._add_node(label, row, 'group', stack[-1]))
+                continue
+
+            if role in CLOSING_ROLES:
+                # SUMMA-raden stänger gruppen med samma namn, annars innersta gruppen
+                key = _normalize(label)
+                target = key[len('summa'):].strip() if key.startswith('summa') else key
+                match = next((i for i in range(len(stack) - 1, 0, -1)
+                              if _normalize(self.labels[stack[i]]) == target), None)
+                if match is None and len(stack) > 1:
+                    match = len(stack) - 1
+                if match is not None:
+                    while len(stack) > match + 1:
+                        self._close(stack.pop())
+                    node = stack.pop()
+                    self.summa_rows[node] = row
+                    self._close(node)
+                continue
+
+            node = self._add_node(label, row, 'account', stack[-1])
+            self.leaf_nodes.append(node)
+            self.leaf_end[node] = len(self.leaf_nodes)
+
+        while stack:
+            self._close(stack.pop())
+
+    def __len__(self):
+        return len(self.labels)
+
+    def children(self, node):
+        """Returnerar barnnoder i radordning"""
+        return np.flatnonzero(self.parents == node)
+
+    def subtree_leaf_mask(self, summa_row):
+        """Lövmask för gruppen som stängs av given SUMMA-rad (tom om raden saknas)"""
+        mask = np.zeros(len(self.leaf_nodes), dtype=bool)
+        if summa_row in self.summa_rows:
+            node = self.summa_rows.index(summa_row)
+            mask[self.leaf_start[node]:self.leaf_end[node]] = True
+        return mask
+
+    def node_sides(self, revenue_row=None, expense_row=None):
+        """
+        Sida per nod: 'revenue' i gruppen som stängs av intäktssummans rad,
+        'expense' i kostnadssummans grupp och None utanför båda
+        """
+        anchors = {}
+        for row, side in ((revenue_row, 'revenue'), (expense_row, 'expense')):
+            if row is not None and row in self.summa_rows:
+                anchors[self.summa_rows.index(row)] = side
+        sides = []
+        for node, parent in enumerate(self.parents):
+            sides.append(anchors.get(node, sides[parent] if parent >= 0 else None))
+        return sides
+
+    def total(self, node, start=0, end=None):
+        """Delträdets summa för månaderna [start, end) - O(1) via prefixsumman"""
+        end = self.n_months if end is None else end
+        s, e = self.leaf_start[node], self.leaf_end[node]
+        p = self.prefix
+        return p[e, end] - p[s, end] - p[e, start] + p[s, start]
+
+    def totals(self, start=0, end=None):
+        """Alla noders delträdssummor för månaderna [start, end) i en vektoriserad läsning"""
+        end = self.n_months if end is None else end
+        s, e = self.leaf_start, self.leaf_end
+        p = self.prefix
+        return p[e, end] - p[s, end] - p[e, start] + p[s, start]
+
+    def monthly_totals(self):
+        """Alla noders delträdssummor per månad (nod × månad)"""
+        p = self.prefix[:, 1:] - self.prefix[:, :-1]
+        return p[self.leaf_end] - p[self.leaf_start]
+
+    def to_plotly(self, start=0, end=None, max_nodes=None, min_value=0.0):
+        """Returnerar ids/labels/parents/values/customdata för treemap eller sunburst"""
+        totals = self.totals(start, end)
+        leaf_abs = np.zeros(len(self))
+        leaf_abs[self.leaf_nodes] = np.abs(totals[self.leaf_nodes])
+
+        # Hoppa över löv utan belopp - de tar ingen yta men kostar i webbläsaren
+        keep = np.ones(len(self), dtype=bool)
+        is_leaf = np.zeros(len(self), dtype=bool)
+        is_leaf[self.leaf_nodes] = True
+        keep[is_leaf] = leaf_abs[is_leaf] > min_value
+        if max_nodes is not None and keep[is_leaf].sum() > max_nodes:
+            threshold = np.sort(leaf_abs[is_leaf & keep])[-max_nodes]
+            keep[is_leaf] &= leaf_abs[is_leaf] >= threshold
+        # Grupper behålls bara om något löv i delträdet finns kvar
+        kept_leaves = np.concatenate([[0], np.cumsum(keep[self.leaf_nodes])])
+        groups = ~is_leaf
+        keep[groups] = kept_leaves[self.leaf_end[groups]] > kept_leaves[self.leaf_start[groups]]
+        keep[0] = True
+
+        nodes = np.flatnonzero(keep)
+        return {
+            'ids': [f'n{node}' for node in nodes],
+            'labels': [self.labels[node] for node in nodes],
+            'parents': ['' if self.parents[node] < 0 else f'n{self.parents[node]}' for node in nodes],
+            'values': leaf_abs[nodes],
+            'customdata': totals[nodes],
+        }
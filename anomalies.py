@@ -0,0 +1,135 @@
+"""
+Avvikelser - robusta z-värden (median/MAD) för varje konto och månad mot egen historik och jämförbara företag
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from financial_analyzer import MONTHS
+
+ANOMALY_COLUMNS = ['Flik', 'Företag', 'År', 'Konto', 'Månad', 'Belopp', 'Median', 'Avvikelse',
+                   'z historik', 'z jämförbara', 'Poäng', 'Rad']
+
+# Iglewicz-Hoaglin: 0,6745 gör MAD jämförbar med standardavvikelsen, 3,5 är gränsen för avvikelse
+MAD_SCALE = 0.6745
+MEAN_AD_SCALE = 1.253314
+DEFAULT_THRESHOLD = 3.5
+
+# Avvikelser mindre än så från kontots median (tSEK) är avrundningsbrus, och
+# spridningen räknas aldrig som mindre än så - annars ger konton som nästan alltid
+# är noll eller konstanta orimligt stora z-värden för varje bokning
+MIN_DEVIATION = 1.0
+
+# Minsta spridning vid jämförelse mellan företag, som andel av omsättningen
+MIN_PEER_SCALE = 0.001
+
+# Minsta antal företag med kontot samma månad för att jämförelsen ska räknas
+MIN_PEERS = 3
+
+
+def robust_z(values, axis, min_scale=0.0):
+    """
+    Robusta z-värden längs en axel med NaN för saknade värden. När MAD är noll
+    (mer än hälften av värdena lika) används medelabsolutavvikelsen i stället,
+    och spridningen golvas vid min_scale. Returnerar (z, median).
+    """
+    with warnings.catch_warnings():
+        # Helt tomma serier ger NaN, det är avsiktligt
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = np.nanmedian(values, axis=axis, keepdims=True)
+        deviation = values - median
+        mad = np.nanmedian(np.abs(deviation), axis=axis, keepdims=True)
+        mean_ad = np.nanmean(np.abs(deviation), axis=axis, keepdims=True)
+    scale = np.where(mad > 0, mad / MAD_SCALE, MEAN_AD_SCALE * np.nan_to_num(mean_ad))
+    scale = np.maximum(scale, min_scale)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(scale > 0, deviation / scale, 0.0)
+    return np.where(np.isnan(values), np.nan, z), median
+
+
+def _first_rows(row_accounts, n_accounts):
+    """Första raden i fliken för varje konto i kuben, -1 om kontot saknas"""
+    positions = np.asarray(row_accounts)
+    rows = np.flatnonzero(positions >= 0)
+    first = np.full(n_accounts, -1)
+    first[positions[rows[::-1]]] = rows[::-1]
+    return first
+
+
+def score_portfolio(analyzer, threshold=DEFAULT_THRESHOLD):
+    """
+    Poängsätter varje (företag, år, konto, månad) i ett vektoriserat pass över
+    portföljkuben. Bara bokförda månader och detaljkonton räknas; koncernflikar
+    är summor av andra flikar och ingår inte.
+
+    Egen historik: kontots alla bokförda månader för företaget, över alla år.
+    Jämförbara: övriga företag samma år och månad, med beloppen som andel av
+    respektive fliks omsättning så att företagens storlek inte avgör.
+
+    Returnerar celler med poäng (största |z|) minst threshold, högst poäng först.
+    """
+    from consolidation import consolidation_group
+
+    sheets = [sheet for sheet in analyzer.sheet_names
+              if consolidation_group(analyzer.consolidation, sheet) is None]
+    if not sheets:
+        return pd.DataFrame(columns=ANOMALY_COLUMNS)
+    positions = np.array([analyzer.sheet_positions[sheet] for sheet in sheets])
+    keys = [analyzer.sheet_index[position] for position in positions]
+    companies = list(dict.fromkeys(company for company, _ in keys))
+    years = sorted({year for _, year in keys}, key=lambda year: (pd.isna(year), 0 if pd.isna(year) else year))
+
+    # (företag, år) -> position i kuben, -1 där fliken saknas
+    grid = np.full((len(companies), len(years)), -1)
+    for position, (company, year) in zip(positions, keys):
+        grid[companies.index(company), years.index(year)] = position
+
+    n_months = len(MONTHS)
+    detail = np.array([analyzer.rules.role(label) == 'account' for label in analyzer.account_labels], dtype=bool)
+    booked = np.arange(n_months) < np.asarray(analyzer.closed_months)[:, None]
+    valid = np.asarray(analyzer.cube_mask)[:, :, None] & detail[None, :, None] & booked[:, None, :]
+    cells = np.where(valid, analyzer.cube[:, :, :n_months], np.nan)
+
+    # (företag, år, konto, månad)
+    present = grid >= 0
+    gathered = np.where(present[:, :, None, None], cells[np.maximum(grid, 0)], np.nan)
+    n_companies, n_years, n_accounts, _ = gathered.shape
+
+    # Egen historik: alla år och månader för samma företag och konto i en axel
+    history = gathered.transpose(0, 2, 1, 3).reshape(n_companies, n_accounts, n_years * n_months)
+    z_own, median_own = robust_z(history, axis=-1, min_scale=MIN_DEVIATION)
+    z_own = z_own.reshape(n_companies, n_accounts, n_years, n_months).transpose(0, 2, 1, 3)
+    median_own = np.broadcast_to(median_own[:, None, :, :], gathered.shape)
+
+    # Jämförbara: samma år, konto och månad över företagen, som andel av omsättningen
+    revenue = np.abs(np.asarray(analyzer.key_series[:, 0, -1]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = gathered / np.where(revenue > 0, revenue, np.nan)[np.maximum(grid, 0)][:, :, None, None]
+    z_peer, _ = robust_z(share, axis=0, min_scale=MIN_PEER_SCALE)
+    enough_peers = (~np.isnan(share)).sum(axis=0, keepdims=True) >= MIN_PEERS
+    z_peer = np.where(enough_peers, z_peer, np.nan)
+
+    score = np.fmax(np.abs(z_own), np.abs(z_peer))
+    deviation = gathered - median_own
+    flagged = (score >= threshold) & (np.abs(deviation) >= MIN_DEVIATION)
+
+    c, y, a, m = np.nonzero(flagged)
+    sheet_positions = grid[c, y]
+    first_rows = {position: _first_rows(analyzer.row_accounts[analyzer.sheet_names[position]], n_accounts)
+                  for position in np.unique(sheet_positions)}
+    result = pd.DataFrame({
+        'Flik': [analyzer.sheet_names[position] for position in sheet_positions],
+        'Företag': [companies[i] for i in c],
+        'År': pd.array([years[i] for i in y], dtype='Int64'),
+        'Konto': [analyzer.account_labels[i] for i in a],
+        'Månad': [MONTHS[i] for i in m],
+        'Belopp': gathered[c, y, a, m],
+        'Median': median_own[c, y, a, m],
+        'Avvikelse': deviation[c, y, a, m],
+        'z historik': z_own[c, y, a, m],
+        'z jämförbara': z_peer[c, y, a, m],
+        'Poäng': score[c, y, a, m],
+        'Rad': [int(first_rows[position][account]) for position, account in zip(sheet_positions, a)],
+    }, columns=ANOMALY_COLUMNS)
+    return result.sort_values('Poäng', ascending=False, kind='stable').reset_index(drop=True)
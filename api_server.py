@@ -0,0 +1,232 @@
+"""
+JSON-API - lokal HTTP-tjänst med samma siffror som dashboarden, utan Streamlit
+
+Endpoints:
+    GET /sheets                         flikar med företag, år och stängda månader
+    GET /sheets/<flik>/monthly          intäkter, kostnader och resultat per månad
+    GET /sheets/<flik>/yearly           helårsnyckeltal från nyckeltalstabellen
+    GET /sheets/<flik>/categories       rapportgrupper och konton med belopp
+    GET /yearly                         helårsnyckeltal för alla flikar
+
+Alla svar har en ETag från datasnapshotens version och byggs i förväg som
+färdiga JSON-bytes, så ett anrop är en uppslagning i en ordbok.
+"""
+import argparse
+import json
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from financial_analyzer import MONTHS, get_shared_analyzer
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8502
+
+
+def _clean(value):
+    """Gör om NumPy-typer, NaN och saknade värden (pd.NA) till JSON-kompatibla värden"""
+    if isinstance(value, dict):
+        return {str(key): _clean(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_clean(item) for item in value]
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return None if math.isnan(value) or math.isinf(value) else round(float(value), 4)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if value is pd.NA:
+        return None
+    return value
+
+
+def _encode(payload):
+    """Serialiserar ett svar till UTF-8-bytes"""
+    return json.dumps(_clean(payload), ensure_ascii=False, allow_nan=False).encode('utf-8')
+
+
+def sheet_path(sheet_name, resource):
+    """URL-sökväg för en fliks resurs, t.ex. /sheets/KLAB%202024/monthly"""
+    return f'/sheets/{quote(sheet_name, safe="")}/{resource}'
+
+
+def _yearly(analyzer, sheet_name):
+    """Helårsnyckeltal för en flik från den materialiserade nyckeltalstabellen"""
+    row = analyzer.get_kpis(sheet_name)
+    return {'sheet': sheet_name, **row.to_dict()}
+
+
+def _monthly(analyzer, sheet_name):
+    """Månadsserier för en flik från förberäknade nyckelserier"""
+    series = analyzer.get_key_series(sheet_name)
+    return {
+        'sheet': sheet_name,
+        'months': MONTHS,
+        'revenue': series[0, :len(MONTHS)],
+        'expenses': series[1, :len(MONTHS)],
+        'net_result': series[2, :len(MONTHS)],
+        'closed_months': analyzer.get_closed_months(sheet_name),
+    }
+
+
+def _categories(analyzer, sheet_name):
+    """Belopp per rapportgrupp och konto för intäkts- och kostnadssidan"""
+    tree = analyzer.get_account_tree(sheet_name)
+    if tree is None or not tree.leaf_nodes:
+        return {'sheet': sheet_name, 'groups': [], 'accounts': []}
+    key_rows = analyzer.key_rows.get(sheet_name, {})
+    row_groups = analyzer.get_row_groups(sheet_name)
+    sides = np.full(len(tree.leaf_nodes), 'Övrigt', dtype=object)
+    sides[tree.subtree_leaf_mask(key_rows.get('revenue'))] = 'Intäkter'
+    sides[tree.subtree_leaf_mask(key_rows.get('expenses'))] = 'Kostnader'
+    rule_sides = {'Intäkter': 'revenue', 'Kostnader': 'expense'}
+
+    groups, accounts = {}, []
+    for i, node in enumerate(tree.leaf_nodes):
+        group = row_groups[tree.rows[node]]
+        # En grupp som motsäger kontots sida i trädet redovisas inte under den sidan
+        if group is None or not analyzer.rules.allows(group, rule_sides.get(sides[i])):
+            group = 'Övrigt'
+        monthly = tree.leaf_values[i]
+        accounts.append({
+            'account': tree.labels[node],
+            'group': group,
+            'side': sides[i],
+            'total': monthly.sum(),
+        })
+        entry = groups.setdefault((sides[i], group), np.zeros(len(MONTHS)))
+        entry += monthly
+    return {
+        'sheet': sheet_name,
+        'months': MONTHS,
+        'groups': [{'side': side, 'group': group, 'total': monthly.sum(), 'monthly': monthly}
+                   for (side, group), monthly in groups.items()],
+        'accounts': accounts,
+    }
+
+
+def build_responses(analyzer):
+    """Förberäknar alla svar som {sökväg: JSON-bytes} för en datasnapshot"""
+    responses = {
+        '/sheets': _encode([
+            {
+                'sheet': sheet,
+                'company': company,
+                'year': year,
+                'closed_months': analyzer.get_closed_months(sheet),
+                'links': {resource: sheet_path(sheet, resource)
+                          for resource in ('monthly', 'yearly', 'categories')},
+            }
+            for sheet, (company, year) in zip(analyzer.sheet_names, analyzer.sheet_index)
+        ]),
+        '/yearly': _encode([_yearly(analyzer, sheet) for sheet in analyzer.sheet_names]),
+    }
+    for sheet in analyzer.sheet_names:
+        responses[sheet_path(sheet, 'monthly')] = _encode(_monthly(analyzer, sheet))
+        responses[sheet_path(sheet, 'yearly')] = _encode(_yearly(analyzer, sheet))
+        responses[sheet_path(sheet, 'categories')] = _encode(_categories(analyzer, sheet))
+    return responses
+
+
+class ResponseCache:
+    """
+    Färdiga svar för aktuell snapshot. Byggs om när den delade analysatorn byts
+    ut; läsare ser alltid en komplett (version, svar)-tupel.
+    """
+
+    def __init__(self, excel_file_path=None):
+        self.excel_file_path = excel_file_path
+        self._lock = threading.Lock()
+        self._state = (None, {})
+
+    def get(self):
+        """Returnerar (etag, svar) för aktuell snapshot"""
+        analyzer = get_shared_analyzer(self.excel_file_path)
+        version, responses = self._state
+        if version != analyzer.snapshot_version:
+            with self._lock:
+                version, responses = self._state
+                if version != analyzer.snapshot_version:
+                    responses = build_responses(analyzer)
+                    version = analyzer.snapshot_version
+                    self._state = (version, responses)
+        return f'"{version}"', responses
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """Besvarar GET med förberäknade JSON-svar och 304 vid oförändrad ETag"""
+
+    cache = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = urlsplit(self.path).path.rstrip('/') or '/'
+        # Normalisera kodningen av fliknamnet så att /sheets/KLAB 2024/... också matchar
+        parts = path.split('/')
+        if len(parts) == 4 and parts[1] == 'sheets':
+            path = sheet_path(unquote(parts[2]), parts[3])
+
+        try:
+            etag, responses = self.cache.get()
+        except Exception as e:
+            self._send(503, _encode({'error': f'Kunde inte ladda data: {e}'}))
+            return
+
+        body = responses.get(path)
+        if body is None:
+            self._send(404, _encode({'error': f'Okänd resurs: {path}'}))
+            return
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self._send(304, b'', etag)
+            return
+        self._send(200, body, etag)
+
+    def _send(self, status, body, etag=None):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if status != 304:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Tyst som standard - åtkomstloggning per anrop kostar under last
+        pass
+
+
+def create_server(host=DEFAULT_HOST, port=DEFAULT_PORT, excel_file_path=None):
+    """Skapar en trådad HTTP-server med uppvärmd svarscache"""
+    cache = ResponseCache(excel_file_path)
+    cache.get()
+    handler = type('BoundApiHandler', (ApiHandler,), {'cache': cache})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON-API för finansiell data')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--file', dest='excel_file_path', default=None,
+                        help='Excel-fil (letas upp automatiskt om den utelämnas)')
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.excel_file_path)
+    print(f"✅ API startat på http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 API stoppat")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Binär snapshot - talmatriser i en minnesmappad fil som flera processer delar via sidcachen
+
+En snapshot består av två filer per version i snapshotkatalogen:
+    <version>.bin   alla arrayer efter varandra, 64-bytesjusterade
+    <version>.json  etiketter, flikar och var i .bin varje array ligger
+Sidofilen skrivs sist, så en snapshot med sidofil är alltid komplett.
+"""
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+DEFAULT_SNAPSHOT_DIR = '.snapshots'
+
+ALIGNMENT = 64
+
+# Regeloberoende arrayer som sparas - nyckeltal och grupper räknas om vid anslutning
+SNAPSHOT_ARRAYS = ['values', 'row_accounts', 'cube', 'cube_mask', 'previous_sheet', 'yoy_delta', 'yoy_growth']
+
+
+def snapshot_paths(directory, version):
+    """Sökvägar (matrisfil, sidofil) för en version"""
+    return os.path.join(directory, f'{version}.bin'), os.path.join(directory, f'{version}.json')
+
+
+def _atomic_write(path, write):
+    """Skriver via temporärfil i samma katalog och byter namn, läsare ser aldrig halva filer"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_snapshot(analyzer, directory=DEFAULT_SNAPSHOT_DIR):
+    """
+    Skriver analysatorns talmatriser och etiketter som en versionerad snapshot.
+    Finns versionen redan skrivs den inte om. Returnerar sidofilens sökväg.
+    """
+    version = analyzer.snapshot_version
+    if not version:
+        raise ValueError("Analysatorn saknar snapshotversion")
+    os.makedirs(directory, exist_ok=True)
+    bin_path, meta_path = snapshot_paths(directory, version)
+    if os.path.exists(meta_path):
+        return meta_path
+
+    sheets = analyzer.sheet_names
+    row_counts = [len(analyzer.labels[sheet]) for sheet in sheets]
+    arrays = {
+        # Alla flikars rader staplade; sidofilen anger var varje flik börjar
+        'values': np.concatenate([analyzer.values[sheet] for sheet in sheets]) if sheets
+        else np.zeros((0, analyzer.cube.shape[-1])),
+        'row_accounts': np.concatenate([analyzer.row_accounts[sheet] for sheet in sheets]).astype(np.int64)
+        if sheets else np.zeros(0, dtype=np.int64),
+        'cube': analyzer.cube,
+        'cube_mask': analyzer.cube_mask,
+        'previous_sheet': analyzer.previous_sheet.astype(np.int64),
+        'yoy_delta': analyzer.yoy_delta,
+        'yoy_growth': analyzer.yoy_growth,
+    }
+
+    layout, offset = {}, 0
+    for name in SNAPSHOT_ARRAYS:
+        array = np.ascontiguousarray(arrays[name])
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        layout[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset += array.nbytes
+
+    def write_arrays(f):
+        for name in SNAPSHOT_ARRAYS:
+            f.seek(layout[name]['offset'])
+            f.write(np.ascontiguousarray(arrays[name]).tobytes())
+        f.truncate(max(offset, 1))
+
+    meta = {
+        'format': FORMAT_VERSION,
+        'snapshot_version': version,
+        'created_at': time.time(),
+        'excel_file_path': analyzer.excel_file_path,
+        'available_sheets': list(analyzer.available_sheets),
+        'sheets': list(sheets),
+        'row_offsets': np.concatenate([[0], np.cumsum(row_counts)]).astype(int).tolist(),
+        'labels': {sheet: list(analyzer.labels[sheet]) for sheet in sheets},
+        'account_labels': list(analyzer.account_labels),
+        'excel_row_offsets': {sheet: int(analyzer.excel_row_offsets.get(sheet, 2)) for sheet in sheets},
+        'arrays': layout,
+    }
+    _atomic_write(bin_path, write_arrays)
+    _atomic_write(meta_path, lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode('utf-8')))
+    return meta_path
+
+
+class BinarySnapshot:
+    """
+    Skrivskyddad anslutning till en snapshot. Arrayerna är np.memmap-vyer över
+    samma fil i alla processer, så talen finns en gång i sidcachen och ingen
+    process har en egen kopia. Flikarnas matriser är vyer i den staplade matrisen.
+    """
+
+    def __init__(self, meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('format') != FORMAT_VERSION:
+            raise ValueError(f"Okänt snapshotformat i {meta_path}")
+        self.version = self.meta['snapshot_version']
+        bin_path = os.path.splitext(meta_path)[0] + '.bin'
+        self.arrays = {}
+        for name, spec in self.meta['arrays'].items():
+            shape = tuple(spec['shape'])
+            if 0 in shape:
+                self.arrays[name] = np.zeros(shape, dtype=spec['dtype'])
+            else:
+                self.arrays[name] = np.memmap(bin_path, dtype=spec['dtype'], mode='r',
+                                              offset=spec['offset'], shape=shape)
+
+    @property
+    def sheets(self):
+        return self.meta['sheets']
+
+    @property
+    def labels(self):
+        return self.meta['labels']
+
+    @property
+    def values(self):
+        return self.sheet_rows('values')
+
+    def sheet_rows(self, name):
+        """{flik: vy} för en staplad array, t.ex. 'values' eller 'row_accounts'"""
+        offsets = self.meta['row_offsets']
+        array = self.arrays[name]
+        return {sheet: array[offsets[i]:offsets[i + 1]] for i, sheet in enumerate(self.sheets)}
+
+
+def list_snapshots(directory=DEFAULT_SNAPSHOT_DIR):
+    """
+    Alla kompletta snapshots, nyaste först, som dictar med version, tidpunkt,
+    källfil och antal flikar (läses från sidofilerna, matriserna öppnas inte)
+    """
+    if not os.path.isdir(directory):
+        return []
+    snapshots = []
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        meta_path = os.path.join(directory, name)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        snapshots.append({
+            'version': meta.get('snapshot_version'),
+            'created_at': meta.get('created_at', os.path.getmtime(meta_path)),
+            'excel_file_path': meta.get('excel_file_path'),
+            'n_sheets': len(meta.get('sheets', [])),
+        })
+    return sorted(snapshots, key=lambda snapshot: snapshot['created_at'], reverse=True)
+
+
+def find_snapshot(directory=DEFAULT_SNAPSHOT_DIR, version=None):
+    """
+    Sidofil för en version, eller den senast skrivna om version är None.
+    None om ingen komplett snapshot finns.
+    """
+    if not os.path.isdir(directory):
+        return None
+    if version is not None:
+        meta_path = snapshot_paths(directory, version)[1]
+        return meta_path if os.path.exists(meta_path) else None
+    candidates = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.json')]
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+
+def attach_snapshot(directory=DEFAULT_SNAPSHOT_DIR, version=None):
+    """Ansluter skrivskyddat till en snapshot, None om den saknas"""
+    meta_path = find_snapshot(directory, version)
+    return BinarySnapshot(meta_path) if meta_path else None
@@ -0,0 +1,220 @@
+"""
+Koncernkonsolidering - summerar företagsflikar till en koncernflik med elimineringar av koncerninterna konton
+"""
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from financial_analyzer import MONTHS, file_stat, parse_sheet_name, sheet_layout_rows
+
+DEFAULT_CONSOLIDATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'consolidation.json')
+
+SUMMARY_COLUMNS = ['Regel', 'Konton', 'Eliminerat', 'Intäkter', 'Kostnader']
+
+# Sidor i medlemmarnas kontoträd, se AccountTree.node_sides
+SIDES = ['revenue', 'expense', None]
+
+
+class EliminationRule:
+    """Elimineringsregel: nyckelord, reguljära uttryck och BAS-intervall som pekar ut koncerninterna konton"""
+
+    def __init__(self, rule):
+        self.name = rule['name']
+        patterns = [re.escape(keyword) for keyword in rule.get('keywords', [])] + rule.get('regex', [])
+        self.pattern = re.compile('|'.join(patterns), re.IGNORECASE) if patterns else None
+        self.ranges = [tuple(account_range) for account_range in rule.get('accounts', [])]
+
+    def matches(self, label, account_number=None):
+        """True om kontot ska elimineras enligt regeln"""
+        if account_number is not None and any(low <= account_number <= high for low, high in self.ranges):
+            return True
+        return self.pattern is not None and self.pattern.search(label) is not None
+
+
+class ConsolidationGroup:
+    """En koncern: namn (blir företagsnamnet i koncernflikarna), medlemsföretag och elimineringsregler"""
+
+    def __init__(self, group):
+        self.name = group['name']
+        self.companies = list(group.get('companies', []))
+        self.eliminations = [EliminationRule(rule) for rule in group.get('eliminations', [])]
+
+    def sheet_name(self, year):
+        return f'{self.name} {year}'
+
+
+class ConsolidationConfig:
+    """Kompilerad konsolideringsfil. version ändras när filens innehåll ändras."""
+
+    def __init__(self, config, version=None):
+        self.config = config
+        self.groups = [ConsolidationGroup(group) for group in config.get('groups', [])]
+        self.version = version or hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+    def group(self, name):
+        """Koncernen med givet namn, None om den saknas"""
+        for group in self.groups:
+            if group.name == name:
+                return group
+        return None
+
+
+_loaded_configs = {}
+
+
+def load_consolidation(path=None):
+    """Läser och kompilerar konsolideringsfilen en gång per process och filversion, None om filen saknas"""
+    path = os.path.abspath(path or DEFAULT_CONSOLIDATION_FILE)
+    cache_key = file_stat(path)
+    if cache_key not in _loaded_configs:
+        config = None
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                content = f.read()
+            config = ConsolidationConfig(json.loads(content), hashlib.sha1(content).hexdigest())
+        _loaded_configs[cache_key] = config
+    return _loaded_configs[cache_key]
+
+
+def elimination_owners(rules, account_labels, account_rules):
+    """Elimineringsregelns index per konto i kuben, -1 för konton som behålls. Första matchande regel vinner."""
+    owners = np.full(len(account_labels), -1)
+    for account, label in enumerate(account_labels):
+        number = account_rules.classify(label).account_number
+        for rule_idx, rule in enumerate(rules):
+            if rule.matches(label, number):
+                owners[account] = rule_idx
+                break
+    return owners
+
+
+def member_sheets(analyzer, group, year):
+    """Medlemsföretagens flikar för ett år i portföljens ordning"""
+    members = []
+    for sheet, (company, sheet_year) in zip(analyzer.sheet_names, analyzer.sheet_index):
+        if not pd.isna(sheet_year) and sheet_year == year and company != group.name and company in group.companies:
+            members.append(sheet)
+    return members
+
+
+class Consolidation:
+    """
+    Koncernflik för ett år. Medlemsflikarnas detaljkonton (kontoträdens löv)
+    summeras direkt i portföljkuben, där konton redan är justerade över flikar:
+    summan är en maskerad summa över (flik, konto, månad) och elimineringarna är
+    samma summa med regelmasken i stället för behållmasken. Inga DataFrames slås ihop.
+    """
+
+    def __init__(self, analyzer, group, year, members):
+        self.group = group
+        self.year = year
+        self.sheet_name = group.sheet_name(year)
+        self.members = list(members)
+
+        positions = np.array([analyzer.sheet_positions[sheet] for sheet in self.members], dtype=int)
+        n_accounts = len(analyzer.account_labels)
+
+        # Sida (intäkter/kostnader/ingen) per medlem och konto i kuben, från medlemmarnas
+        # kontoträd; -1 där kontot inte är ett detaljkonto (löv) hos medlemmen
+        member_sides = np.full((len(self.members), n_accounts), -1)
+        side_groups = {}
+        for member, sheet in enumerate(self.members):
+            tree = analyzer.account_trees[sheet]
+            groups = analyzer.row_groups[sheet]
+            key_rows = analyzer.key_rows.get(sheet, {})
+            sides = tree.node_sides(key_rows.get('revenue'), key_rows.get('expenses'))
+            accounts = np.asarray(analyzer.row_accounts[sheet])
+            for node in tree.leaf_nodes:
+                account = accounts[tree.rows[node]]
+                if account < 0:
+                    continue
+                side = SIDES.index(sides[node])
+                member_sides[member, account] = side
+                side_groups.setdefault((account, side), groups[tree.rows[node]])
+        leaf = (member_sides >= 0).any(axis=0)
+
+        owners = elimination_owners(group.eliminations, analyzer.account_labels, analyzer.rules)
+        keep = leaf & (owners < 0)
+        eliminated = leaf & (owners >= 0)
+
+        # (medlem, konto, månad) -> (konto, månad)
+        monthly = np.asarray(analyzer.cube[positions][:, :, :len(MONTHS)])
+        totals = monthly.sum(axis=0)
+
+        # Koncernfliken byggs per sida: ett konto som står på intäktssidan hos en medlem
+        # och på kostnadssidan hos en annan blir en rad på varje sida
+        self.account_labels, self.account_groups, self.account_sides, accounts = [], [], [], []
+        for side_idx, side in enumerate(SIDES):
+            on_side = member_sides == side_idx
+            side_totals = np.einsum('mat,ma->at', monthly, on_side.astype(float))
+            for account in np.flatnonzero(keep & on_side.any(axis=0)):
+                self.account_labels.append(analyzer.account_labels[account])
+                self.account_groups.append(side_groups[(account, side_idx)])
+                self.account_sides.append(side)
+                accounts.append(side_totals[account])
+        self.accounts = np.array(accounts).reshape(len(accounts), len(MONTHS))
+        labels, values = sheet_layout_rows(self.account_labels, self.accounts, analyzer.rules,
+                                           self.account_groups, self.account_sides)
+        # Avrundning tar bort flyttalsbrus från summeringen, inte decimaler från källan
+        self.values = values.round(6)
+        self.labels = ['' if pd.isna(label) else str(label) for label in labels]
+
+        # Eliminerade belopp per konto och medlem (helår)
+        removed = np.flatnonzero(eliminated)
+        yearly = monthly[:, removed].sum(axis=2).T
+        self.eliminations = pd.DataFrame(yearly, columns=self.members)
+        self.eliminations.insert(0, 'Konto', [analyzer.account_labels[account] for account in removed])
+        self.eliminations.insert(0, 'Regel', [group.eliminations[owners[account]].name for account in removed])
+        self.eliminations['Summa'] = yearly.sum(axis=1)
+        self.eliminations = self.eliminations[self.eliminations[self.members + ['Summa']].abs().sum(axis=1) > 0]
+        self.eliminated_monthly = totals[removed].sum(axis=0)
+
+    @property
+    def imbalance(self):
+        """
+        Eliminerat netto för året. Koncerninterna intäkter och kostnader tar ut
+        varandra när båda sidor är bokförda; annat än noll är en obalans som
+        påverkar koncernens resultat.
+        """
+        return float(self.eliminated_monthly.sum())
+
+    def summary(self):
+        """Eliminerade belopp per regel: antal konton, netto, intäktssida och kostnadssida"""
+        records = []
+        for rule in self.group.eliminations:
+            amounts = self.eliminations.loc[self.eliminations['Regel'] == rule.name, 'Summa']
+            records.append((rule.name, len(amounts), amounts.sum(),
+                            amounts[amounts > 0].sum(), amounts[amounts < 0].sum()))
+        return pd.DataFrame(records, columns=SUMMARY_COLUMNS)
+
+
+def consolidate(analyzer, group, year):
+    """Konsoliderar koncernens flikar för ett år, None om färre än två medlemsflikar finns"""
+    members = member_sheets(analyzer, group, year)
+    if len(members) < 2:
+        return None
+    return Consolidation(analyzer, group, year, members)
+
+
+def consolidate_all(analyzer, config):
+    """{fliknamn: Consolidation} för alla koncerner och år i portföljen"""
+    results = {}
+    for group in config.groups:
+        for year in analyzer.get_years():
+            result = consolidate(analyzer, group, year)
+            if result is not None:
+                results[result.sheet_name] = result
+    return results
+
+
+def consolidation_group(config, sheet_name):
+    """(koncern, år) om fliken är en koncernflik enligt konfigurationen, annars None"""
+    if config is None:
+        return None
+    company, year = parse_sheet_name(sheet_name)
+    group = config.group(company)
+    return (group, year) if group is not None and year is not None else None
@@ -16,6 +16,7 @@ except ImportError:
     
 import sys
 import os
+from datetime import datetime
 
 # Add current directory to Python path for deployment compatibility
 try:
@@ -28,7 +29,9 @@ except NameError:
 if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
-from financial_analyzer import FinancialAnalyzer
+from financial_analyzer import get_shared_analyzer, MONTHS, HEATMAP_METRICS, PERIOD_LEVELS
+from account_rules import get_account_rules
+from forecasting import FORECAST_METHODS
 
 # Konfiguration för professionell look
 st.set_page_config(
@@ -122,9 +125,9 @@ def check_password():
         return True
 
 def load_financial_data():
-    """Laddar finansiell data"""
+    """Laddar finansiell data - en delad instans per process och arbetsbok"""
     try:
-        analyzer = FinancialAnalyzer()
+        analyzer = get_shared_analyzer()
         return analyzer
     except Exception as e:
         st.error(f"Fel vid laddning av data: {e}")
@@ -149,91 +152,38 @@ def convert_excel_value(value):
         return 0
 
 def get_monthly_data(analyzer, sheet_name):
-    """Hämtar månadsdata DIREKT från SUMMA-raderna och BERÄKNAT RESULTAT från Excel"""
-    raw_data = analyzer.get_raw_data(sheet_name)
-    if raw_data is None:
+    """Hämtar månadsdata från SUMMA-raderna och BERÄKNAT RESULTAT - förberäknat vid inläsning"""
+    key_series = analyzer.get_key_series(sheet_name)
+    if key_series is None:
         return None, None, None
     
-    months = ['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dec']
-    monthly_revenue = []
-    monthly_expenses = []
-    monthly_net_result = []
-    
-    # Hitta relevanta rader
-    revenue_row = None
-    expense_row = None
-    net_result_row = None
-    
-    for idx, row in raw_data.iterrows():
-        category = str(row.iloc[0]) if not pd.isna(row.iloc[0]) else ""
-        
-        # Hitta intäktsraden - flexibel matchning
-        if any(keyword in category.upper() for keyword in ['SUMMA RÖRELSENS INTÄKTER', 'SUMMA NETTOOMSÄTTNING']):
-            revenue_row = row
-        elif 'SUMMA RÖRELSENS KOSTNADER' in category:
-            expense_row = row
-        elif 'BERÄKNAT RESULTAT' in category:
-            net_result_row = row
-    
-    # Läs månadsdata från raderna
-    for month in months:
-        # Hitta månadskolumn
-        month_col_idx = None
-        for col_idx, col_name in enumerate(raw_data.columns):
-            if str(col_name).strip() == month:
-                month_col_idx = col_idx
-                break
-        
-        if month_col_idx is not None:
-            # Läs från SUMMA RÖRELSENS INTÄKTER (alltid positivt)
-            if revenue_row is not None:
-                revenue_val = convert_excel_value(revenue_row.iloc[month_col_idx])
-                monthly_revenue.append(abs(revenue_val))
-            else:
-                monthly_revenue.append(0)
-            
-            # Läs från SUMMA RÖRELSENS KOSTNADER (behåll negativt tecken)
-            if expense_row is not None:
-                expense_val = convert_excel_value(expense_row.iloc[month_col_idx])
-                monthly_expenses.append(expense_val)
-            else:
-                monthly_expenses.append(0)
-            
-            # Läs från BERÄKNAT RESULTAT (direkt från Excel)
-            if net_result_row is not None:
-                net_val = convert_excel_value(net_result_row.iloc[month_col_idx])
-                monthly_net_result.append(net_val)
-        else:
-            monthly_net_result.append(0)
-    else:
-            monthly_revenue.append(0)
-            monthly_expenses.append(0)
-            monthly_net_result.append(0)
-    
+    # Intäkter (alltid positivt), kostnader (negativt tecken) och nettoresultat
+    monthly_revenue, monthly_expenses, monthly_net_result = key_series.tolist()
     return monthly_revenue, monthly_expenses, monthly_net_result
 
-def create_multi_company_comparison(analyzer, selected_sheets):
-    """Skapar jämförelsediagram för flera företag"""
+def create_multi_company_comparison(analyzer, selected_sheets, period_level='Månad'):
+    """Skapar jämförelsediagram för flera företag på vald periodnivå"""
     import plotly.graph_objects as go
     from plotly.subplots import make_subplots
     
     fig = go.Figure()
-    months = ['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dec']
+    periods = PERIOD_LEVELS[period_level]
     
     colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
     
     for i, sheet in enumerate(selected_sheets):
-        monthly_revenue, monthly_expenses, monthly_net_result = get_monthly_data(analyzer, sheet)
+        # Förberäknad periodnivå - ingen omaggregering per körning
+        series = analyzer.get_period_series(sheet, period_level)
         
-        if monthly_revenue is None:
+        if series is None:
             continue
             
         color = colors[i % len(colors)]
         
         # Lägg till nettoresultat för varje företag
         fig.add_trace(go.Scatter(
-            x=months,
-            y=monthly_net_result,
+            x=periods,
+            y=series[2],
             mode='lines+markers',
             name=f'{sheet} - Nettoresultat',
             line=dict(color=color, width=2),
@@ -243,7 +193,7 @@ def create_multi_company_comparison(analyzer, selected_sheets):
     
     fig.update_layout(
         title=dict(text=f'Nettoresultat Jämförelse - {len(selected_sheets)} Företag', font=dict(size=20, color='#1f4e79')),
-        xaxis_title='Månad',
+        xaxis_title=period_level,
         yaxis_title='Nettoresultat (tSEK)',
         hovermode='x unified',
         template='plotly_white',
@@ -261,38 +211,12 @@ def create_multi_company_comparison(analyzer, selected_sheets):
     return fig
 
 def get_yearly_totals_from_excel(analyzer, sheet_name):
-    """Hämtar årssummor DIREKT från Excel's SUMMA-kolumn - ENKEL och ROBUST"""
-    raw_data = analyzer.get_raw_data(sheet_name)
-    if raw_data is None:
+    """Hämtar årssummor från Excel's Totalt-kolumn via den materialiserade KPI-tabellen"""
+    kpis = analyzer.get_kpis(sheet_name)
+    if kpis is None:
         return 0, 0, 0
     
-    # Hitta Totalt-kolumnen
-    summa_col_idx = None
-    for col_idx, col_name in enumerate(raw_data.columns):
-        if str(col_name).strip() == 'Totalt':
-            summa_col_idx = col_idx
-            break
-    
-    if summa_col_idx is None:
-        summa_col_idx = len(raw_data.columns) - 1
-    
-    # Hitta rader med ENKEL matching
-    revenue_total = 0
-    expense_total = 0
-    net_result_total = 0
-    
-    for idx, row in raw_data.iterrows():
-        category = str(row.iloc[0]) if not pd.isna(row.iloc[0]) else ""
-        
-        # Flexibel matchning för intäkter - hitta rätt rad oberoende av format
-        if any(keyword in category.upper() for keyword in ['SUMMA RÖRELSENS INTÄKTER', 'SUMMA NETTOOMSÄTTNING']):
-            revenue_total = convert_excel_value(row.iloc[summa_col_idx])
-        elif 'SUMMA RÖRELSENS KOSTNADER' in category:
-            expense_total = convert_excel_value(row.iloc[summa_col_idx])
-        elif 'BERÄKNAT RESULTAT' in category:
-            net_result_total = convert_excel_value(row.iloc[summa_col_idx])
-    
-    return revenue_total, expense_total, net_result_total
+    return kpis['Intäkter'], kpis['Kostnader'], kpis['Nettoresultat']
 
 def create_multi_company_bar_chart(analyzer, selected_sheets):
     """Skapar stapeldiagram för flera företag"""
@@ -367,37 +291,41 @@ def display_multi_company_kpis(analyzer, selected_sheets):
     """Visar KPI-sammanfattning för flera företag"""
     st.markdown('<div class="section-header">📋 KPI Sammanfattning</div>', unsafe_allow_html=True)
     
-    company_data = []
-    
-    for sheet in selected_sheets:
-        # Läs DIREKT från Excel's SUMMA-kolumn
-        total_revenue, total_expenses, net_result = get_yearly_totals_from_excel(analyzer, sheet)
-        
-        # Inkludera alla företag, även de med 0-värden för att visa alla
-            
-        # Säkerställ rätt tecken
-        total_revenue = abs(total_revenue) if total_revenue else 0
-        total_expenses = total_expenses if total_expenses else 0  # Behåll negativt från Excel
-        net_result = net_result if net_result else 0
-        
-        profit_margin = (net_result / total_revenue * 100) if total_revenue > 0 else 0
-        
-        company_data.append({
-            'Företag/År': sheet,
-            'Totala Intäkter (tSEK)': f"{total_revenue:,.1f}",
-            'Totala Kostnader (tSEK)': f"{total_expenses:,.1f}",
-            'Nettoresultat (tSEK)': f"{net_result:,.1f}",
-            'Vinstmarginal (%)': f"{profit_margin:.1f}%"
-        })
+    kpi_table = analyzer.get_kpi_table()
+    sheets = [sheet for sheet in selected_sheets if sheet in kpi_table.index]
+    if not sheets:
+        return
     
-    if company_data:
-        df = pd.DataFrame(company_data)
-        st.dataframe(df, use_container_width=True)
+    kpis = kpi_table.loc[sheets]
+    df = pd.DataFrame({
+        'Företag/År': sheets,
+        'Totala Intäkter (tSEK)': kpis['Intäkter'].map("{:,.1f}".format).to_numpy(),
+        'Totala Kostnader (tSEK)': kpis['Kostnader'].map("{:,.1f}".format).to_numpy(),
+        'Nettoresultat (tSEK)': kpis['Nettoresultat'].map("{:,.1f}".format).to_numpy(),
+        'Vinstmarginal (%)': kpis['Vinstmarginal (%)'].map("{:.1f}%".format).to_numpy(),
+        'Resultat snitt/mån (tSEK)': kpis['Nettoresultat snitt/mån'].map("{:,.1f}".format).to_numpy(),
+        'Intäktstillväxt (%)': kpis['Intäkter tillväxt (%)'].map(lambda val: "-" if pd.isna(val) else f"{val:.1f}%").to_numpy()
+    })
+    
+    # Egna nyckeltal för helår
+    definitions = get_kpi_definitions(analyzer)
+    custom = analyzer.get_custom_kpis(sheets, definitions)
+    for definition in definitions:
+        df[definition.name] = [format_kpi_value(value, definition.unit) for value in custom[definition.name]]
+    st.dataframe(df, use_container_width=True)
 
-def create_monthly_line_chart(monthly_revenue, monthly_expenses, monthly_net_result):
-    """Skapar månadsvis linjediagram"""
+def create_monthly_line_chart(monthly_revenue, monthly_expenses, monthly_net_result, forecast=None, closed_months=12):
+    """Skapar månadsvis linjediagram, med prognos som streckad förlängning om den finns"""
     months = ['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dec']
     
+    # Med prognos visas utfallet bara för stängda månader
+    if forecast is not None and 0 < closed_months < 12:
+        monthly_revenue = list(monthly_revenue[:closed_months]) + [None] * (12 - closed_months)
+        monthly_expenses = list(monthly_expenses[:closed_months]) + [None] * (12 - closed_months)
+        monthly_net_result = list(monthly_net_result[:closed_months]) + [None] * (12 - closed_months)
+    else:
+        forecast = None
+    
     fig = go.Figure()
     
     # Intäkter
@@ -433,6 +361,21 @@ def create_monthly_line_chart(monthly_revenue, monthly_expenses, monthly_net_res
         hovertemplate='<b>%{x}</b><br>Nettoresultat: %{y:,.1f} tSEK<extra></extra>'
     ))
     
+    # Prognos som streckad förlängning från sista stängda månaden
+    if forecast is not None:
+        actuals = [monthly_revenue, monthly_expenses, monthly_net_result]
+        for name, color, actual, values in zip(['Intäkter', 'Kostnader', 'Nettoresultat'],
+                                               ['#28a745', '#dc3545', '#007bff'], actuals, forecast):
+            fig.add_trace(go.Scatter(
+                x=months[closed_months - 1:],
+                y=[actual[closed_months - 1]] + list(values[closed_months:]),
+                mode='lines+markers',
+                name=f'{name} (prognos)',
+                line=dict(color=color, width=2, dash='dash'),
+                marker=dict(size=6, symbol='circle-open'),
+                hovertemplate=f'<b>%{{x}}</b><br>{name} (prognos): %{{y:,.1f}} tSEK<extra></extra>'
+            ))
+    
     fig.update_layout(
         title=dict(text='Månadsvis Finansiell Utveckling', font=dict(size=20, color='#1f4e79')),
         xaxis_title='Månad',
@@ -451,11 +394,11 @@ def create_monthly_line_chart(monthly_revenue, monthly_expenses, monthly_net_res
     
     return fig
 
-def create_monthly_bar_chart(monthly_revenue, monthly_expenses, monthly_net_result):
-    """Skapar stapeldiagram för månadsöversikt"""
+def create_monthly_bar_chart(monthly_revenue, monthly_expenses, monthly_net_result, period_level='Månad'):
+    """Skapar stapeldiagram för månadsöversikt, eller per kvartal/tertial/halvår/år"""
     import plotly.graph_objects as go
     
-    months = ['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dec']
+    months = PERIOD_LEVELS[period_level]
     
     fig = go.Figure()
     
@@ -487,8 +430,9 @@ def create_monthly_bar_chart(monthly_revenue, monthly_expenses, monthly_net_resu
     ))
     
     fig.update_layout(
-        title=dict(text='Månadsvis Finansiell Översikt', font=dict(size=20, color='#1f4e79')),
-        xaxis_title='Månad',
+        title=dict(text='Månadsvis Finansiell Översikt' if period_level == 'Månad'
+                   else f'Finansiell Översikt per {period_level.lower()}', font=dict(size=20, color='#1f4e79')),
+        xaxis_title=period_level,
         yaxis_title='Belopp (tSEK)',
         barmode='group',
         template='plotly_white',
@@ -521,17 +465,19 @@ def create_revenue_detail_chart(analyzer, sheet_name):
     
     # Innan SUMMA RÖRELSENS INTÄKTER = intäkter, efter = kostnader
     found_revenue_summa = False
+    rules = get_account_rules()
     
     for idx, row in raw_data.iterrows():
         category = str(row.iloc[0]) if not pd.isna(row.iloc[0]) else ""
+        role = rules.role(category)
         
-        # Kolla om vi hittat intäktsraden (flexibel matchning)
-        if any(keyword in category.upper() for keyword in ['SUMMA RÖRELSENS INTÄKTER', 'SUMMA NETTOOMSÄTTNING']):
+        # Kolla om vi hittat intäktsraden
+        if role == 'revenue_total':
             found_revenue_summa = True
             continue
             
-        # Skippa SUMMA-rader och tomma kategorier
-        if 'SUMMA' in category.upper() or 'BERÄKNAT' in category.upper() or category.strip() == "":
+        # Skippa SUMMA-rader, resultatrader och tomma kategorier
+        if role != 'account' or category.strip() == "":
             continue
             
         # Läs värdet från SUMMA-kolumnen
@@ -590,22 +536,24 @@ def create_expense_detail_chart(analyzer, sheet_name):
     # Efter SUMMA RÖRELSENS INTÄKTER och innan BERÄKNAT RESULTAT = kostnader
     found_revenue_summa = False
     found_result = False
+    rules = get_account_rules()
     
     for idx, row in raw_data.iterrows():
         category = str(row.iloc[0]) if not pd.isna(row.iloc[0]) else ""
+        role = rules.role(category)
         
-        # Kolla om vi hittat intäktsraden (flexibel matchning)
-        if any(keyword in category.upper() for keyword in ['SUMMA RÖRELSENS INTÄKTER', 'SUMMA NETTOOMSÄTTNING']):
+        # Kolla om vi hittat intäktsraden
+        if role == 'revenue_total':
             found_revenue_summa = True
             continue
         
         # Kolla om vi hittat BERÄKNAT RESULTAT (slutar kostnader)
-        if 'BERÄKNAT RESULTAT' in category.upper():
+        if role == 'net_result':
             found_result = True
             continue
             
         # Skippa SUMMA-rader och tomma kategorier
-        if 'SUMMA' in category.upper() or category.strip() == "":
+        if role != 'account' or category.strip() == "":
             continue
         
         # Läs värdet från SUMMA-kolumnen
@@ -646,6 +594,291 @@ def create_expense_detail_chart(analyzer, sheet_name):
     
     return fig
 
+def create_account_tree_chart(analyzer, sheet_name, start_month=0, end_month=12, chart_type='Treemap', max_accounts=400):
+    """Skapar drilldown-diagram (treemap/sunburst) från kontoträdets prefixsummor"""
+    tree = analyzer.get_account_tree(sheet_name)
+    if tree is None or not tree.leaf_nodes:
+        return None
+    
+    # Ytan visar beloppets storlek, hover visar delsumman med tecken
+    nodes = tree.to_plotly(start_month, end_month, max_nodes=max_accounts)
+    trace_type = go.Sunburst if chart_type == 'Sunburst' else go.Treemap
+    
+    fig = go.Figure(trace_type(
+        ids=nodes['ids'],
+        labels=nodes['labels'],
+        parents=nodes['parents'],
+        values=nodes['values'],
+        customdata=nodes['customdata'],
+        branchvalues='remainder',
+        maxdepth=3,
+        hovertemplate='<b>%{label}</b><br>Delsumma: %{customdata:,.1f} tSEK<extra></extra>'
+    ))
+    
+    period = MONTHS[start_month] if end_month - start_month == 1 else f'{MONTHS[start_month]}–{MONTHS[end_month - 1]}'
+    fig.update_layout(
+        title=dict(text=f'Kontohierarki {period}', font=dict(size=20, color='#1f4e79')),
+        height=600,
+        margin=dict(t=60, l=10, r=10, b=10)
+    )
+    
+    return fig
+
+@st.fragment
+def display_account_drilldown(analyzer, sheet_name):
+    """Visar drilldown i kontohierarkin för valt månadsintervall"""
+    st.markdown('<div class="section-header">🌳 Kontohierarki</div>', unsafe_allow_html=True)
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        start_label, end_label = st.select_slider(
+            "Månader:",
+            options=MONTHS,
+            value=(MONTHS[0], MONTHS[-1]),
+            key=f"tree_months_{sheet_name}"
+        )
+    with col2:
+        chart_type = st.radio("Visa som:", ["Treemap", "Sunburst"], horizontal=True, key=f"tree_type_{sheet_name}")
+    
+    tree_chart = create_account_tree_chart(
+        analyzer, sheet_name,
+        start_month=MONTHS.index(start_label),
+        end_month=MONTHS.index(end_label) + 1,
+        chart_type=chart_type
+    )
+    if tree_chart:
+        st.plotly_chart(tree_chart, use_container_width=True)
+    else:
+        st.info("Ingen kontohierarki hittades för vald flik.")
+
+def create_scenario_chart(summary):
+    """Skapar stapeldiagram som jämför scenarier sida vid sida"""
+    fig = go.Figure()
+    
+    for column, color in [('Intäkter', '#28a745'), ('Kostnader', '#dc3545'), ('Nettoresultat', '#007bff')]:
+        fig.add_trace(go.Bar(
+            x=summary.index.tolist(),
+            y=summary[column].to_numpy(),
+            name=column,
+            marker_color=color,
+            hovertemplate=f'<b>%{{x}}</b><br>{column}: %{{y:,.1f}} tSEK<extra></extra>'
+        ))
+    
+    fig.update_layout(
+        title=dict(text='Scenariojämförelse - Helår', font=dict(size=20, color='#1f4e79')),
+        xaxis_title='Scenario',
+        yaxis_title='Belopp (tSEK)',
+        barmode='group',
+        template='plotly_white',
+        height=450,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        )
+    )
+    
+    return fig
+
+def create_scenario_monthly_chart(monthly):
+    """Skapar linjediagram med nettoresultat per månad för varje scenario"""
+    fig = go.Figure()
+    
+    colors = ['#1f4e79', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+    
+    for i, (scenario, row) in enumerate(monthly.iterrows()):
+        fig.add_trace(go.Scatter(
+            x=MONTHS,
+            y=row.to_numpy(),
+            mode='lines+markers',
+            name=scenario,
+            line=dict(color=colors[i % len(colors)], width=3 if i == 0 else 2, dash='solid' if i == 0 else 'dash'),
+            hovertemplate=f'<b>{scenario}</b><br>%{{x}}: %{{y:,.1f}} tSEK<extra></extra>'
+        ))
+    
+    fig.update_layout(
+        title=dict(text='Nettoresultat per Månad och Scenario', font=dict(size=20, color='#1f4e79')),
+        xaxis_title='Månad',
+        yaxis_title='Nettoresultat (tSEK)',
+        template='plotly_white',
+        height=450,
+        hovermode='x unified'
+    )
+    
+    return fig
+
+@st.fragment
+def display_scenarios(analyzer, sheet_name):
+    """Visar what-if-scenarier sida vid sida för en flik"""
+    from scenarios import ADJUSTMENT_TYPES
+    
+    st.markdown(f'<div class="section-header">🧪 Scenarioanalys - {sheet_name}</div>', unsafe_allow_html=True)
+    
+    targets = analyzer.get_adjustment_targets(sheet_name)
+    if not targets:
+        st.info("Inga konton att justera för vald flik.")
+        return
+    
+    st.markdown("Ange justeringar per scenario. Rader med samma scenarionamn räknas ihop. "
+                "Belopp anges i kontots riktning, dvs. positivt = mer intäkt respektive mer kostnad.")
+    
+    defaults = []
+    if 'Grupp: Lokalkostnader' in targets:
+        defaults.append({'Scenario': 'Hyra +10%', 'Mål': 'Grupp: Lokalkostnader', 'Typ': '%', 'Värde': 10.0})
+    if 'Grupp: Intäkter' in targets:
+        defaults.append({'Scenario': 'Intäkter -5%', 'Mål': 'Grupp: Intäkter', 'Typ': '%', 'Värde': -5.0})
+    if len(defaults) == 2:
+        defaults += [dict(row, Scenario='Hyra +10% & Intäkter -5%') for row in defaults]
+    
+    adjustments = st.data_editor(
+        pd.DataFrame(defaults, columns=['Scenario', 'Mål', 'Typ', 'Värde']),
+        column_config={
+            'Scenario': st.column_config.TextColumn('Scenario', required=True),
+            'Mål': st.column_config.SelectboxColumn('Mål', options=targets, required=True),
+            'Typ': st.column_config.SelectboxColumn('Typ', options=ADJUSTMENT_TYPES, required=True, default='%'),
+            'Värde': st.column_config.NumberColumn('Värde', format="%.1f", default=0.0),
+        },
+        num_rows="dynamic",
+        use_container_width=True,
+        key=f"scenario_editor_{sheet_name}"
+    )
+    
+    # Gruppera justeringar per scenario i inmatningsordning
+    scenarios = {}
+    for row in adjustments.dropna(subset=['Scenario', 'Mål']).itertuples(index=False):
+        scenarios.setdefault(row.Scenario, []).append((row.Mål, row.Typ, row.Värde))
+    
+    summary, monthly = analyzer.evaluate_scenarios(sheet_name, list(scenarios.items()))
+    if summary is None:
+        st.info("Kunde inte beräkna scenarier för vald flik.")
+        return
+    
+    st.dataframe(
+        summary.style.format({
+            'Intäkter': "{:,.1f}", 'Kostnader': "{:,.1f}", 'Nettoresultat': "{:,.1f}",
+            'Vinstmarginal (%)': "{:.1f}%", 'Förändring resultat': "{:+,.1f}"
+        }),
+        use_container_width=True
+    )
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(create_scenario_chart(summary), use_container_width=True)
+    with col2:
+        st.plotly_chart(create_scenario_monthly_chart(monthly), use_container_width=True)
+
+def create_simulation_fan_chart(result):
+    """Skapar solfjäderdiagram över ackumulerat resultat från Monte Carlo-simuleringen"""
+    fan = result['fan']
+    fig = go.Figure()
+    
+    # Yttre band (P5-P95) och inre band (P25-P75) ritas som fyllda intervall
+    for lower, upper, color, name in [('P5', 'P95', 'rgba(31, 78, 121, 0.15)', 'P5-P95'),
+                                      ('P25', 'P75', 'rgba(31, 78, 121, 0.35)', 'P25-P75')]:
+        fig.add_trace(go.Scatter(
+            x=MONTHS, y=fan.loc[upper].to_numpy(),
+            mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'
+        ))
+        fig.add_trace(go.Scatter(
+            x=MONTHS, y=fan.loc[lower].to_numpy(),
+            mode='lines', line=dict(width=0), fill='tonexty', fillcolor=color,
+            name=name, hoverinfo='skip'
+        ))
+    
+    fig.add_trace(go.Scatter(
+        x=MONTHS, y=fan.loc['P50'].to_numpy(),
+        mode='lines+markers',
+        name='Median',
+        line=dict(color='#1f4e79', width=3),
+        hovertemplate='<b>Median</b><br>%{x}: %{y:,.1f} tSEK<extra></extra>'
+    ))
+    
+    if result['closed_months']:
+        fig.add_vline(x=result['closed_months'] - 1, line_dash='dot', line_color='gray')
+    
+    fig.update_layout(
+        title=dict(text='Ackumulerat Resultat - Simulering', font=dict(size=20, color='#1f4e79')),
+        xaxis_title='Månad',
+        yaxis_title='Ackumulerat resultat (tSEK)',
+        template='plotly_white',
+        height=450,
+        hovermode='x unified'
+    )
+    
+    return fig
+
+def create_simulation_histogram(result):
+    """Skapar histogram över simulerat helårsresultat"""
+    yearly = result['yearly_net']
+    fig = go.Figure()
+    
+    fig.add_trace(go.Histogram(
+        x=yearly,
+        nbinsx=60,
+        marker_color='#007bff',
+        hovertemplate='Resultat: %{x} tSEK<br>Antal: %{y}<extra></extra>'
+    ))
+    fig.add_vline(x=0, line_dash='dash', line_color='#dc3545')
+    
+    fig.update_layout(
+        title=dict(text=f'Helårsresultat - {result["n_draws"]:,} dragningar', font=dict(size=20, color='#1f4e79')),
+        xaxis_title='Helårsresultat (tSEK)',
+        yaxis_title='Antal dragningar',
+        template='plotly_white',
+        height=450,
+        showlegend=False
+    )
+    
+    return fig
+
+@st.fragment
+def display_forecast_chart(analyzer, sheet_name, monthly_revenue, monthly_expenses, monthly_net_result):
+    """Linjediagram med prognos för månader som inte stängts - prognosvalet kör bara om detta fragment"""
+    closed_months = analyzer.get_closed_months(sheet_name)
+    forecast = None
+    if 0 < closed_months < 12:
+        forecast_method = st.radio(
+            "Prognos för återstående månader:",
+            ["Ingen"] + FORECAST_METHODS,
+            index=1,
+            horizontal=True,
+            key=f"forecast_method_{sheet_name}"
+        )
+        if forecast_method != "Ingen":
+            forecast = analyzer.get_forecast(sheet_name, forecast_method)
+    line_chart = create_monthly_line_chart(monthly_revenue, monthly_expenses, monthly_net_result,
+                                           forecast=forecast, closed_months=closed_months)
+    st.plotly_chart(line_chart, use_container_width=True)
+
+def display_simulation(analyzer, sheet_name):
+    """Visar Monte Carlo-simulering av årets resultat bredvid månadsdiagrammen"""
+    result = analyzer.get_simulation(sheet_name)
+    if result is None:
+        return
+    
+    yearly = result['yearly_net']
+    if result['closed_months']:
+        caption = f"{result['closed_months']} stängda månader behåller utfallet, resten simuleras"
+    else:
+        caption = "Helåret simuleras utifrån företagets historik"
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Sannolikhet för förlust", f"{result['loss_probability'] * 100:.1f}%", help=caption)
+    with col2:
+        st.metric("Median helårsresultat", f"{np.median(yearly):,.1f} tSEK")
+    with col3:
+        p5, p95 = np.percentile(yearly, [5, 95])
+        st.metric("90% intervall", f"{p5:,.0f} – {p95:,.0f} tSEK")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(create_simulation_fan_chart(result), use_container_width=True)
+    with col2:
+        st.plotly_chart(create_simulation_histogram(result), use_container_width=True)
+
 def create_category_pie_chart(analyzer, sheet_name):
     """Skapar cirkeldiagram för kategorier"""
     raw_data = analyzer.get_raw_data(sheet_name)
@@ -655,7 +888,7 @@ def create_category_pie_chart(analyzer, sheet_name):
     categories = []
     values = []
     
-    revenue_keywords = ['Nettoomsättning', 'Försäljning', 'Membership', 'Intäkter']
+    rules = get_account_rules()
     
     for idx, row in raw_data.iterrows():
         if idx == 0:
@@ -670,8 +903,9 @@ def create_category_pie_chart(analyzer, sheet_name):
                 total_value = convert_excel_value(row.iloc[col_idx])
                 break
         
-        # Bara visa intäktskategorier med värde > 0
-        is_revenue = any(keyword.lower() in category.lower() for keyword in revenue_keywords)
+        # Bara visa intäktskonton med värde > 0 (SUMMA-rader räknas inte dubbelt)
+        classification = rules.classify(category)
+        is_revenue = classification.role == 'account' and classification.group == 'Intäkter'
         if is_revenue and total_value > 0:
             categories.append(category)
             values.append(total_value)
@@ -700,11 +934,11 @@ def create_heatmap(monthly_revenue, monthly_expenses):
     """Skapar heatmap för aktivitet"""
     months = ['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dec']
     
-    # Skapa data för heatmap
+    # Skapa data för heatmap (kostnaderna är redan negativa)
     data = [
         monthly_revenue,
         monthly_expenses,
-        [rev - exp for rev, exp in zip(monthly_revenue, monthly_expenses)]
+        [rev + exp for rev, exp in zip(monthly_revenue, monthly_expenses)]
     ]
     
     fig = go.Figure(data=go.Heatmap(
@@ -712,10 +946,10 @@ def create_heatmap(monthly_revenue, monthly_expenses):
         x=months,
         y=['Intäkter', 'Kostnader', 'Nettoresultat'],
         colorscale='RdYlGn',
-        text=[[f'{val:,.0f}' for val in row] for row in data],
-        texttemplate='%{text} SEK',
+        text=[[f'{val:,.1f}' for val in row] for row in data],
+        texttemplate='%{text} tSEK',
         textfont={"size": 12},
-        hovertemplate='<b>%{y}</b><br>%{x}: %{z:,.0f} SEK<extra></extra>'
+        hovertemplate='<b>%{y}</b><br>%{x}: %{z:,.1f} tSEK<extra></extra>'
     ))
     
     fig.update_layout(
@@ -725,15 +959,141 @@ def create_heatmap(monthly_revenue, monthly_expenses):
     
     return fig
 
-def display_kpi_cards(analyzer, sheet_name):
-    """Visar KPI-kort - läser direkt från Excel's SUMMA-kolumn"""
-    # Läs DIREKT från Excel's SUMMA-kolumn
-    total_revenue, total_expenses, net_result = get_yearly_totals_from_excel(analyzer, sheet_name)
+def create_portfolio_heatmap(analyzer, selected_sheets, metric='Nettoresultat', max_rows=60, definitions=None):
+    """Skapar portföljheatmap (företag × månad) som ett enda spår"""
+    heatmap = analyzer.get_portfolio_heatmap(metric, selected_sheets, max_rows=max_rows, definitions=definitions)
+    if heatmap.empty:
+        return None
     
-    if total_revenue is None:
-        total_revenue, total_expenses, net_result = 0, 0, 0
+    unit = '%' if metric == 'Vinstmarginal (%)' else 'tSEK'
+    custom = {definition.name: definition for definition in definitions or []}
+    if metric in custom:
+        unit = custom[metric].unit
+    show_text = len(heatmap) <= 30
     
-    profit_margin = (net_result / total_revenue * 100) if total_revenue > 0 else 0
+    fig = go.Figure(data=go.Heatmap(
+        z=heatmap.to_numpy(),
+        x=MONTHS,
+        y=heatmap.index.tolist(),
+        colorscale='RdYlGn',
+        zmid=0 if metric in ('Nettoresultat', 'Vinstmarginal (%)') or unit == '%' else None,
+        texttemplate='%{z:,.1f}' if show_text else None,
+        textfont={"size": 11},
+        hovertemplate=f'<b>%{{y}}</b><br>%{{x}}: %{{z:,.1f}} {unit}<extra></extra>',
+        colorbar=dict(title=unit)
+    ))
+    
+    fig.update_layout(
+        title=dict(text=f'Portföljöversikt - {metric}', font=dict(size=20, color='#1f4e79')),
+        xaxis_title='Månad',
+        template='plotly_white',
+        height=max(400, min(24 * len(heatmap) + 150, 1600)),
+        yaxis=dict(autorange='reversed')
+    )
+    
+    return fig
+
+@st.fragment
+def display_portfolio_heatmap(analyzer, selected_sheets):
+    """Portföljheatmap med måttväljare - byte av mått kör bara om detta fragment"""
+    st.markdown('<div class="section-header">🗺️ Portföljöversikt</div>', unsafe_allow_html=True)
+    definitions = get_kpi_definitions(analyzer)
+    metrics = HEATMAP_METRICS + [definition.name for definition in definitions]
+    heatmap_metric = st.selectbox("Välj mått:", metrics, index=2, key="portfolio_heatmap_metric")
+    portfolio_heatmap = create_portfolio_heatmap(analyzer, selected_sheets, heatmap_metric, definitions=definitions)
+    if portfolio_heatmap:
+        st.plotly_chart(portfolio_heatmap, use_container_width=True)
+
+def create_yoy_chart(yoy_values, account_label):
+    """Skapar linjediagram med ett spår per år för ett konto"""
+    fig = go.Figure()
+    
+    colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+    
+    for i, (year, row) in enumerate(yoy_values.iterrows()):
+        fig.add_trace(go.Scatter(
+            x=MONTHS,
+            y=row[MONTHS].to_numpy(),
+            mode='lines+markers',
+            name=str(year),
+            line=dict(color=colors[i % len(colors)], width=3),
+            marker=dict(size=8),
+            hovertemplate=f'<b>{year}</b><br>%{{x}}: %{{y:,.1f}} tSEK<extra></extra>'
+        ))
+    
+    fig.update_layout(
+        title=dict(text=f'{account_label} - År för år', font=dict(size=20, color='#1f4e79')),
+        xaxis_title='Månad',
+        yaxis_title='Belopp (tSEK)',
+        template='plotly_white',
+        height=450,
+        hovermode='x unified',
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        )
+    )
+    
+    return fig
+
+@st.fragment
+def display_yoy_comparison(analyzer, company):
+    """Visar årsjämförelse för ett företag - skivor av förberäknade arrayer"""
+    st.markdown(f'<div class="section-header">📅 Årsjämförelse - {company}</div>', unsafe_allow_html=True)
+    
+    accounts = analyzer.get_company_accounts(company)
+    if not accounts:
+        st.info("Inga konton hittades för valt företag.")
+        return
+    
+    default_account = 'BERÄKNAT RESULTAT' if 'BERÄKNAT RESULTAT' in accounts else accounts[0]
+    account_label = st.selectbox("Välj konto:", accounts, index=accounts.index(default_account), key=f"yoy_account_{company}")
+    
+    yoy = analyzer.get_yoy_frame(company, account_label)
+    if yoy is None:
+        st.info("Ingen data för valt konto.")
+        return
+    
+    st.plotly_chart(create_yoy_chart(yoy['Värde'], account_label), use_container_width=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("**Förändring mot föregående år (tSEK)**")
+        st.dataframe(yoy['Förändring'].dropna(how='all').style.format("{:,.1f}", na_rep="-"), use_container_width=True)
+    with col2:
+        st.markdown("**Tillväxt mot föregående år (%)**")
+        st.dataframe(yoy['Tillväxt (%)'].dropna(how='all').style.format("{:,.1f}%", na_rep="-"), use_container_width=True)
+    
+    # Största förändringar per konto för valt år
+    comparable = {year: idx for year, idx in analyzer.get_company_positions(company) if analyzer.previous_sheet[idx] >= 0}
+    if comparable:
+        st.markdown('<div class="section-header">📋 Förändring per Konto</div>', unsafe_allow_html=True)
+        years = list(comparable)
+        year = st.selectbox("Jämför år:", years, index=len(years) - 1, key=f"yoy_year_{company}")
+        accounts_frame = analyzer.get_yoy_accounts(analyzer.sheet_names[comparable[year]])
+        accounts_frame = accounts_frame.reindex(accounts_frame['Förändring'].abs().sort_values(ascending=False).index)
+        st.dataframe(
+            accounts_frame.style.format({
+                'I år': "{:,.1f}", 'Föregående år': "{:,.1f}",
+                'Förändring': "{:,.1f}", 'Tillväxt (%)': "{:,.1f}%"
+            }, na_rep="-"),
+            use_container_width=True,
+            hide_index=True
+        )
+
+def display_kpi_cards(analyzer, sheet_name):
+    """Visar KPI-kort - slår upp värden i den materialiserade KPI-tabellen"""
+    kpis = analyzer.get_kpis(sheet_name)
+    if kpis is None:
+        total_revenue, total_expenses, net_result, profit_margin = 0, 0, 0, 0
+    else:
+        total_revenue = kpis['Intäkter']
+        total_expenses = kpis['Kostnader']
+        net_result = kpis['Nettoresultat']
+        profit_margin = kpis['Vinstmarginal (%)']
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -770,6 +1130,106 @@ def display_kpi_cards(analyzer, sheet_name):
         </div>
         """, unsafe_allow_html=True)
 
+def get_kpi_definitions(analyzer):
+    """Nyckeltal från definitionsfilen plus sessionens egna - sessionens går före vid samma namn"""
+    session_definitions = st.session_state.get('custom_kpi_definitions', [])
+    names = {definition.name for definition in session_definitions}
+    return [definition for definition in analyzer.get_kpi_definitions()
+            if definition.name not in names] + list(session_definitions)
+
+def add_custom_kpi(analyzer):
+    """Knappåteranrop: tolkar och validerar ett nytt nyckeltal innan det läggs till i sessionen"""
+    from kpi_expressions import KpiDefinition, KpiExpressionError
+    
+    try:
+        definition = KpiDefinition(st.session_state.get('new_kpi_name', ''),
+                                   st.session_state.get('new_kpi_expression', ''),
+                                   analyzer.rules.groups,
+                                   st.session_state.get('new_kpi_unit', ''))
+        # Räknas direkt för hela portföljen så att okända konton upptäcks här
+        analyzer.get_custom_kpi_values([definition])
+    except KpiExpressionError as e:
+        st.session_state['custom_kpi_error'] = str(e)
+        return
+    definitions = [existing for existing in st.session_state.get('custom_kpi_definitions', [])
+                   if existing.name != definition.name]
+    st.session_state['custom_kpi_definitions'] = definitions + [definition]
+    st.session_state['custom_kpi_error'] = None
+    st.session_state['new_kpi_name'] = ''
+    st.session_state['new_kpi_expression'] = ''
+
+def format_kpi_value(value, unit):
+    """Formaterar ett nyckeltalsvärde efter enhet, '-' för odefinierade värden"""
+    if pd.isna(value):
+        return "-"
+    if unit == '%':
+        return f"{value:.1f}%"
+    if unit == 'tSEK':
+        return f"{value:,.1f} tSEK"
+    return f"{value:,.2f} {unit}".strip()
+
+def create_custom_kpi_chart(values, definition, period_level='Månad'):
+    """Linjediagram för ett eget nyckeltal över perioderna på vald nivå"""
+    fig = go.Figure(go.Scatter(
+        x=PERIOD_LEVELS[period_level],
+        y=values,
+        mode='lines+markers',
+        name=definition.name,
+        line=dict(color='#1f4e79', width=3),
+        hovertemplate=f'%{{x}}: %{{y:,.2f}} {definition.unit}<extra></extra>'
+    ))
+    fig.update_layout(
+        title=dict(text=definition.name, font=dict(size=20, color='#1f4e79')),
+        xaxis_title=period_level,
+        yaxis_title=definition.unit or None,
+        template='plotly_white',
+        height=400
+    )
+    return fig
+
+@st.fragment
+def display_custom_kpis(analyzer, sheet_name, period_level='Månad'):
+    """Egna nyckeltal för fliken på vald periodnivå, med formulär för nya uttryck"""
+    from kpi_expressions import available_names
+    
+    st.markdown('<div class="section-header">📐 Egna Nyckeltal</div>', unsafe_allow_html=True)
+    definitions = get_kpi_definitions(analyzer)
+    
+    if definitions:
+        periods = analyzer.get_custom_kpi_periods(sheet_name, period_level, definitions)
+        units = [definition.unit for definition in definitions]
+        table = pd.DataFrame(
+            [[format_kpi_value(value, unit) for value in row] for row, unit in zip(periods.to_numpy(), units)],
+            index=periods.index, columns=periods.columns
+        )
+        st.dataframe(table, use_container_width=True)
+        
+        names = [definition.name for definition in definitions]
+        chart_name = st.selectbox("Visa nyckeltal i diagram:", names, key="custom_kpi_chart")
+        position = names.index(chart_name)
+        st.plotly_chart(create_custom_kpi_chart(periods.iloc[position].to_numpy(), definitions[position], period_level),
+                        use_container_width=True)
+    
+    with st.expander("➕ Definiera nyckeltal"):
+        st.caption("Uttryck med + - * / ** och parenteser över namnen "
+                   f"{', '.join(available_names(analyzer.rules.groups))}. "
+                   "Funktioner: abs(x), min(a, b), max(a, b), föregående(x) för samma period "
+                   "föregående år, grupp(\"namn\") och konto(\"etikett\"). Kostnader har negativt tecken, "
+                   "t.ex. -Personalkostnader / Intäkter * 100.")
+        col1, col2, col3 = st.columns([2, 4, 1])
+        with col1:
+            st.text_input("Namn", key="new_kpi_name")
+        with col2:
+            st.text_input("Uttryck", key="new_kpi_expression")
+        with col3:
+            st.text_input("Enhet", key="new_kpi_unit")
+        st.button("Lägg till", key="add_custom_kpi", on_click=add_custom_kpi, args=(analyzer,))
+        if st.session_state.get('custom_kpi_error'):
+            st.error(f"❌ {st.session_state['custom_kpi_error']}")
+        if st.session_state.get('custom_kpi_definitions'):
+            st.button("Ta bort sessionens nyckeltal", key="clear_custom_kpis",
+                      on_click=lambda: st.session_state.update(custom_kpi_definitions=[]))
+
 def display_raw_data_editor(analyzer, sheet_name):
     """Visar rådata från Excel med redigeringsmöjligheter"""
     st.markdown('<div class="section-header">📊 Rådata Viewer & Editor</div>', unsafe_allow_html=True)
@@ -781,17 +1241,11 @@ def display_raw_data_editor(analyzer, sheet_name):
     
     st.markdown(f"**Visar data för:** {sheet_name}")
     
-    # Skapa en kopia av data för redigering
-    if f'edited_data_{sheet_name}' not in st.session_state:
-        st.session_state[f'edited_data_{sheet_name}'] = raw_data.copy()
-        # Lägg till kolumner för redigering
-        st.session_state[f'edited_data_{sheet_name}']['Typ'] = 'Auto'
-        st.session_state[f'edited_data_{sheet_name}']['Exkludera'] = False
-        
-        # Automatisk kategorisering baserat på Excel-struktur
-        auto_categorize_rows(st.session_state[f'edited_data_{sheet_name}'])
+    # Sessionen lagrar bara ändrade celler, basramen delas via analysatorn
+    if f'edits_{sheet_name}' not in st.session_state:
+        st.session_state[f'edits_{sheet_name}'] = {}
     
-    edited_data = st.session_state[f'edited_data_{sheet_name}']
+    overlay = analyzer.get_edit_overlay(sheet_name, st.session_state[f'edits_{sheet_name}'])
     
     # Filter och kontroller
     col1, col2, col3 = st.columns([2, 2, 2])
@@ -808,33 +1262,35 @@ def display_raw_data_editor(analyzer, sheet_name):
     
     with col3:
         if st.button("🔄 Återställ ändringar", key=f"reset_{sheet_name}"):
-            st.session_state[f'edited_data_{sheet_name}'] = raw_data.copy()
-            st.session_state[f'edited_data_{sheet_name}']['Typ'] = 'Auto'
-            st.session_state[f'edited_data_{sheet_name}']['Exkludera'] = False
-            # Automatisk kategorisering baserat på Excel-struktur
-            auto_categorize_rows(st.session_state[f'edited_data_{sheet_name}'])
-            st.rerun()
+            overlay.reset()
+            st.rerun(scope="fragment")
+    
+    # Filtrera fram rader utan att kopiera hela fliken
+    mask = np.ones(len(overlay.base), dtype=bool)
     
-    # Filtrera data baserat på val
-    display_data = edited_data.copy()
+    # Genväg från Avvikelser: visa bara den avvikande raden tills fokus tas bort
+    focus = st.session_state.get('editor_focus')
+    if focus and focus['sheet'] == sheet_name and 0 <= focus['row'] < len(mask):
+        st.info(f"🎯 Avvikelse: **{focus['account']}** i {focus['month']} (poäng {focus['score']:.1f})")
+        st.button("✖ Visa hela fliken", key=f"clear_focus_{sheet_name}",
+                  on_click=lambda: st.session_state.pop('editor_focus', None))
+        mask[:] = False
+        mask[focus['row']] = True
     
     if not show_all:
         # Visa endast rader med numeriska värden i månaderna
-        months = ['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dec']
-        mask = False
-        for month in months:
-            if month in display_data.columns:
-                mask |= (pd.to_numeric(display_data[month], errors='coerce').fillna(0) != 0)
-        display_data = display_data[mask]
+        mask &= (np.nan_to_num(overlay.month_values()) != 0).any(axis=1)
     
     if filter_type == "Intäkt":
-        display_data = display_data[display_data['Typ'] == 'Intäkt']
+        mask &= (overlay.column('Typ') == 'Intäkt').to_numpy()
     elif filter_type == "Kostnad":
-        display_data = display_data[display_data['Typ'] == 'Kostnad']
+        mask &= (overlay.column('Typ') == 'Kostnad').to_numpy()
     elif filter_type == "Exkluderade":
-        display_data = display_data[display_data['Exkludera'] == True]
+        mask &= (overlay.column('Exkludera') == True).to_numpy()
+    
+    display_data = overlay.view(overlay.base.index[mask])
     
-    st.markdown(f"**Visar {len(display_data)} av {len(edited_data)} rader**")
+    st.markdown(f"**Visar {len(display_data)} av {len(overlay.base)} rader** ({len(overlay)} ändrade celler)")
     
     # Visa data med redigeringsmöjligheter
     if len(display_data) > 0:
@@ -865,20 +1321,18 @@ def display_raw_data_editor(analyzer, sheet_name):
                     help=f"Värde för {month} (exakt som i Excel)",
                 )
         
-        # Data editor
+        # Data editor - fasta rader, överlägget sparar bara ändrade celler i basens rader
         edited_df = st.data_editor(
             display_data,
             column_config=column_config,
             use_container_width=True,
-            num_rows="dynamic",
+            num_rows="fixed",
             disabled=["Kategori"] if "Kategori" in display_data.columns else [],
             key=f"data_editor_{sheet_name}"
         )
         
-        # Uppdatera session state med ändringar
-        for idx in edited_df.index:
-            if idx in st.session_state[f'edited_data_{sheet_name}'].index:
-                st.session_state[f'edited_data_{sheet_name}'].loc[idx] = edited_df.loc[idx]
+        # Spara endast cellerna som skiljer sig från basen
+        overlay.apply(edited_df)
         
         # Visa sammanfattning av ändringar
         st.markdown('<div class="section-header">📋 Ändringar Sammanfattning</div>', unsafe_allow_html=True)
@@ -905,75 +1359,265 @@ def display_raw_data_editor(analyzer, sheet_name):
     else:
         st.info("Inga rader att visa med aktuella filter.")
 
-def auto_categorize_rows(data):
-    """Automatisk kategorisering av rader baserat på Excel-struktur"""
-    found_revenue_summa = False
-    found_result = False
+def display_updated_analysis(analyzer, sheet_name):
+    """Visar diagram och månadsdata räknade på sessionens redigerade data"""
+    if f'edits_{sheet_name}' in st.session_state:
+        editable_summary = get_editable_data_summary(analyzer, sheet_name)
+        if editable_summary:
+            monthly_revenue, monthly_expenses = editable_summary
+            monthly_net_result = [rev + exp for rev, exp in zip(monthly_revenue, monthly_expenses)]  # exp är redan negativ
+            
+            st.markdown('<div class="section-header">📊 Uppdaterad Analys (Baserat på Dina Ändringar)</div>', unsafe_allow_html=True)
+            
+            # Visa uppdaterade diagram
+            updated_line_chart = create_monthly_line_chart(monthly_revenue, monthly_expenses, monthly_net_result)
+            st.plotly_chart(updated_line_chart, use_container_width=True)
+            
+            # Visa uppdaterad datatabell
+            st.markdown('<div class="section-header">📋 Uppdaterad Månadsdata</div>', unsafe_allow_html=True)
+            months = ['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dec']
+            
+            updated_data_table = pd.DataFrame({
+                'Månad': months,
+                'Intäkter': [f"{val:,.1f} tSEK" for val in monthly_revenue],
+                'Kostnader': [f"{val:,.1f} tSEK" for val in monthly_expenses],
+                'Nettoresultat': [f"{net:,.1f} tSEK" for net in monthly_net_result]
+            })
+            
+            st.dataframe(updated_data_table, use_container_width=True)
+
+@st.fragment
+def display_editor_section(analyzer, sheet_name):
+    """Editor och analysen av ändringarna - cellredigering kör bara om detta fragment"""
+    display_raw_data_editor(analyzer, sheet_name)
     
-    for idx, row in data.iterrows():
-        category = str(row.iloc[0]) if not pd.isna(row.iloc[0]) else ""
-        
-        # Kolla om vi hittat intäktsraden (flexibel matchning)
-        if any(keyword in category.upper() for keyword in ['SUMMA RÖRELSENS INTÄKTER', 'SUMMA NETTOOMSÄTTNING']):
-            found_revenue_summa = True
-            data.loc[idx, 'Typ'] = 'Auto'
-            continue
-        
-        # Kolla om vi hittat BERÄKNAT RESULTAT (slutar kostnader)
-        if 'BERÄKNAT RESULTAT' in category.upper():
-            found_result = True
-            data.loc[idx, 'Typ'] = 'Auto'
-            continue
-        
-        # Skippa SUMMA-rader och tomma kategorier
-        if 'SUMMA' in category.upper() or category.strip() == "":
-            data.loc[idx, 'Typ'] = 'Auto'
-            continue
-        
-        # Automatisk kategorisering
-        if not found_revenue_summa:
-            # Innan intäktsumman = intäkter
-            data.loc[idx, 'Typ'] = 'Intäkt'
-        elif found_revenue_summa and not found_result:
-            # Efter intäktsumman och innan resultat = kostnader
-            data.loc[idx, 'Typ'] = 'Kostnad'
-        else:
-            # Efter resultat
-            data.loc[idx, 'Typ'] = 'Auto'
+    # Visa även uppdaterad analys baserat på ändringar
+    display_updated_analysis(analyzer, sheet_name)
+
+def display_account_search(analyzer, query, limit=100):
+    """Visar konton som matchar sökningen i alla flikar med månadsvärden"""
+    results = analyzer.search_accounts(query, limit=limit)
+    
+    with st.expander(f"🔎 Sökresultat för '{query}' ({len(results)} rader)", expanded=True):
+        if len(results) == 0:
+            st.info("Inga konton matchade sökningen.")
+            return
+        if len(results) == limit:
+            st.caption(f"Visar de {limit} bästa träffarna - förfina sökningen för att se fler.")
+        st.dataframe(
+            results.style.format({column: "{:,.1f}" for column in MONTHS + ['Totalt']}, na_rep=""),
+            use_container_width=True,
+            hide_index=True
+        )
+
+def display_snapshot_diff(analyzer, previous_version):
+    """Visar vad som ändrats i arbetsboken sedan en tidigare inläst version"""
+    st.markdown('<div class="section-header">🔁 Förändringar sedan tidigare version</div>', unsafe_allow_html=True)
+    
+    if previous_version is None:
+        st.info("Det finns ingen tidigare version att jämföra med. När en ny arbetsbok läses in "
+                "visas här vad som ändrats jämfört med den nuvarande.")
+        return
+    
+    diff = analyzer.get_snapshot_diff(previous_version)
+    if diff is None:
+        st.error("❌ Kunde inte läsa den tidigare versionen.")
+        return
+    
+    counts = diff.counts()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Ändrade flikar", len(diff.changed_sheets))
+    with col2:
+        st.metric("Ändrade värden", counts.get('Ändrat värde', 0))
+    with col3:
+        st.metric("Nya konton", counts.get('Nytt konto', 0))
+    with col4:
+        st.metric("Borttagna konton", counts.get('Borttaget konto', 0))
+    
+    if not diff.changed_sheets:
+        st.success("✅ Inga skillnader - alla flikar har samma innehåll som den tidigare versionen.")
+        return
+    
+    summary = diff.summary[diff.summary['Status'] != 'Oförändrad']
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+    
+    sheet_filter = st.selectbox("Visa ändringar för:", ["Alla flikar"] + diff.changed_sheets, key="diff_sheet")
+    changes = diff.changes if sheet_filter == "Alla flikar" else diff.for_sheet(sheet_filter)
+    st.dataframe(
+        changes.style.format({'Tidigare': "{:,.1f}", 'Nu': "{:,.1f}", 'Differens': "{:+,.1f}"}, na_rep="-"),
+        use_container_width=True,
+        hide_index=True
+    )
+
+def display_consolidation(analyzer, sheet_name):
+    """Visar medlemmar och koncernelimineringar för en koncernflik"""
+    consolidation = analyzer.get_consolidation(sheet_name)
+    if consolidation is None:
+        return
+    
+    st.markdown('<div class="section-header">🔗 Koncernelimineringar</div>', unsafe_allow_html=True)
+    st.caption(f"{sheet_name} summerar {', '.join(consolidation.members)} med koncerninterna konton eliminerade.")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Medlemsflikar", len(consolidation.members))
+    with col2:
+        st.metric("Eliminerade konton", len(consolidation.eliminations))
+    with col3:
+        st.metric("Elimineringsdifferens", f"{consolidation.imbalance:,.1f} tSEK",
+                  help="Eliminerat netto - noll när koncerninterna intäkter och kostnader tar ut varandra")
+    
+    st.dataframe(
+        consolidation.summary().style.format({'Eliminerat': "{:,.1f}", 'Intäkter': "{:,.1f}", 'Kostnader': "{:,.1f}"}),
+        use_container_width=True,
+        hide_index=True
+    )
+    with st.expander("Eliminerade konton per företag"):
+        amounts = consolidation.members + ['Summa']
+        st.dataframe(
+            consolidation.eliminations.style.format({column: "{:,.1f}" for column in amounts}),
+            use_container_width=True,
+            hide_index=True
+        )
+
+def open_anomaly_in_editor(anomaly):
+    """Knappåteranrop: byter till Rådata & Redigering med fokus på avvikelsens rad"""
+    st.session_state['analysis_type'] = "Rådata & Redigering"
+    st.session_state['edit_sheet'] = anomaly['Flik']
+    st.session_state['editor_focus'] = {
+        'sheet': anomaly['Flik'],
+        'row': int(anomaly['Rad']),
+        'account': anomaly['Konto'],
+        'month': anomaly['Månad'],
+        'score': float(anomaly['Poäng']),
+    }
+
+def display_anomalies(analyzer, threshold, sheets, limit=500):
+    """Visar rangordnade avvikelser med genväg till raden i rådataeditorn"""
+    st.markdown('<div class="section-header">🚨 Avvikelser</div>', unsafe_allow_html=True)
+    st.caption("Varje konto och bokförd månad jämförs med kontots egen historik och med övriga företag "
+               "samma månad (robusta z-värden, median/MAD). Poäng är den största avvikelsen av de två.")
+    
+    anomalies = analyzer.get_anomalies(threshold, sheets)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Avvikelser", len(anomalies))
+    with col2:
+        st.metric("Flikar", anomalies['Flik'].nunique())
+    with col3:
+        st.metric("Högsta poäng", f"{anomalies['Poäng'].max():.1f}" if len(anomalies) else "-")
+    
+    if len(anomalies) == 0:
+        st.success("✅ Inga avvikelser över vald gräns.")
+        return
+    
+    if len(anomalies) > limit:
+        st.caption(f"Visar de {limit} högsta poängen - höj gränsen för att se färre.")
+    st.dataframe(
+        anomalies.head(limit).drop(columns=['Rad']).style.format({
+            'Belopp': "{:,.1f}", 'Median': "{:,.1f}", 'Avvikelse': "{:+,.1f}",
+            'z historik': "{:+.1f}", 'z jämförbara': "{:+.1f}", 'Poäng': "{:.1f}"
+        }, na_rep="-"),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    # Genväg till raden i editorn
+    top = anomalies.head(limit)
+    choice = st.selectbox(
+        "Granska avvikelse:",
+        range(len(top)),
+        format_func=lambda i: f"{i + 1}. {top.iloc[i]['Flik']} · {top.iloc[i]['Konto']} · "
+                              f"{top.iloc[i]['Månad']} (poäng {top.iloc[i]['Poäng']:.1f})",
+        key="anomaly_choice"
+    )
+    st.button("🔎 Öppna i rådataeditorn", key="open_anomaly", on_click=open_anomaly_in_editor,
+              args=(top.iloc[choice].to_dict(),))
+
+def display_reconciliation(analyzer, sheet_name):
+    """Visar avstämningsavvikelser med cellkoordinater för en flik"""
+    st.markdown('<div class="section-header">🔎 Avstämning</div>', unsafe_allow_html=True)
+    
+    mismatches = analyzer.get_reconciliation(sheet_name)
+    if mismatches is None or len(mismatches) == 0:
+        st.success("✅ Totalt-kolumn, SUMMA-rader och beräknat resultat stämmer för denna flik.")
+        return
+    
+    st.warning(f"⚠️ {len(mismatches)} avvikelser utöver avrundning hittades i {sheet_name}.")
+    st.dataframe(
+        mismatches.drop(columns=['Flik']).style.format({
+            'Förväntat': "{:,.1f}", 'Faktiskt': "{:,.1f}", 'Differens': "{:,.1f}"
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
 
 def get_editable_data_summary(analyzer, sheet_name):
     """Hämtar sammanfattning av redigerad data"""
-    if f'edited_data_{sheet_name}' not in st.session_state:
+    if f'edits_{sheet_name}' not in st.session_state:
         return None
     
-    edited_data = st.session_state[f'edited_data_{sheet_name}']
-    
-    # Filtrera bort exkluderade rader
-    active_data = edited_data[edited_data['Exkludera'] == False]
+    overlay = analyzer.get_edit_overlay(sheet_name, st.session_state[f'edits_{sheet_name}'])
+    if overlay is None:
+        return None
     
-    # Räkna intäkter och kostnader baserat på användarens markeringar
-    revenue_data = active_data[active_data['Typ'] == 'Intäkt']
-    expense_data = active_data[active_data['Typ'] == 'Kostnad']
+    # Filtrera bort exkluderade rader och räkna efter användarens markeringar
+    types = overlay.column('Typ').to_numpy()
+    active = ~overlay.column('Exkludera').to_numpy(dtype=bool)
+    values = np.nan_to_num(overlay.month_values())
     
-    months = ['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dec']
+    monthly_revenue = np.abs(values[active & (types == 'Intäkt')].sum(axis=0))
+    monthly_expenses = values[active & (types == 'Kostnad')].sum(axis=0)
     
-    monthly_revenue = []
-    monthly_expenses = []
+    return monthly_revenue.tolist(), monthly_expenses.tolist()
+
+@st.fragment
+def select_compare_sheets(analyzer):
+    """
+    Val av företag/år att jämföra med ett fast antal widgets oavsett antal flikar:
+    sök, företag (alla deras år), år (över valda företag) och enskilda flikar.
+    Ändringar kör bara om detta fragment; jämförelsen ritas om först när valet
+    bekräftas, så varje ändring inte bygger om alla diagram.
+    """
+    st.markdown("**Välj företag och år att jämföra:**")
+    
+    query = st.text_input("Sök företag:", key="compare_query", placeholder="t.ex. KLAB")
+    # Redan valda företag måste finnas kvar bland alternativen när sökningen ändras
+    chosen = st.session_state.get("compare_companies", [])
+    matching = set(analyzer.find_companies(query)) | set(chosen)
+    company_options = [company for company in analyzer.get_companies() if company in matching]
+    
+    companies = st.multiselect(
+        "Företag (alla år):",
+        company_options,
+        key="compare_companies",
+        help="Välj ett företag för att ta med alla dess år"
+    )
+    years = st.multiselect(
+        "År:",
+        analyzer.get_years(),
+        key="compare_years",
+        help="Begränsar urvalet till valda år - utan valda företag väljs året för alla sökträffar"
+    )
+    selected = analyzer.select_sheets(companies, years, query)
+    extra = st.multiselect(
+        "Lägg till enskilda flikar:",
+        analyzer.available_sheets,
+        key="compare_extra"
+    )
+    chosen_sheets = set(selected) | set(extra)
+    ticked = [sheet for sheet in analyzer.available_sheets if sheet in chosen_sheets]
     
-    for month in months:
-        if month in active_data.columns:
-            # Summera intäkter
-            month_revenue = revenue_data[month].apply(convert_excel_value).sum()
-            monthly_revenue.append(abs(month_revenue))
-            
-            # Summera kostnader
-            month_expense = expense_data[month].apply(convert_excel_value).sum()
-            monthly_expenses.append(month_expense)
-        else:
-            monthly_revenue.append(0)
-            monthly_expenses.append(0)
+    if len(ticked) < 2:
+        st.warning("⚠️ Välj minst 2 företag/år för jämförelse")
+        return
     
-    return monthly_revenue, monthly_expenses
+    st.caption(f"{len(ticked)} flikar valda: {', '.join(ticked[:6])}{' …' if len(ticked) > 6 else ''}")
+    if ticked != st.session_state.get('compare_sheets'):
+        if st.button("📊 Visa jämförelse", key="compare_apply", type="primary"):
+            st.session_state['compare_sheets'] = ticked
+            st.rerun()
 
 def main():
     """Huvudfunktion för business dashboard"""
@@ -998,10 +1642,19 @@ def main():
     st.sidebar.markdown("## 🧭 Navigation")
     st.sidebar.markdown("### 📈 Välj Analystyp")
     
+    # Kontosökning över alla flikar
+    search_query = st.sidebar.text_input(
+        "🔎 Sök konto i alla flikar:",
+        key="account_search",
+        help="Prefix och felstavningar fungerar, t.ex. 'hyra', 'lokalk' eller 'arbetsgivaravgfter'"
+    )
+    
     # Analys typ
     analysis_type = st.sidebar.radio(
         "Välj analystyp:",
-        ["Enskilt företag", "Jämför företag", "Alla företag", "Rådata & Redigering"]
+        ["Enskilt företag", "Jämför företag", "Årsjämförelse", "Scenarier", "Alla företag", "Rådata & Redigering",
+         "Förändringar", "Avvikelser"],
+        key="analysis_type"
     )
     
     if analysis_type == "Enskilt företag":
@@ -1013,30 +1666,97 @@ def main():
         selected_sheets = [selected_sheet]
         
     elif analysis_type == "Jämför företag":
-        st.sidebar.markdown("**Välj företag och år att jämföra:**")
-        selected_sheets = []
-        
-        # Skapa checkboxes för varje företag/år
-        for sheet in analyzer.available_sheets:
-            if st.sidebar.checkbox(sheet, key=f"compare_{sheet}"):
-                selected_sheets.append(sheet)
-        
+        with st.sidebar:
+            select_compare_sheets(analyzer)
+        selected_sheets = [sheet for sheet in st.session_state.get('compare_sheets', [])
+                           if sheet in analyzer.available_sheets]
         if len(selected_sheets) < 2:
-            st.sidebar.warning("⚠️ Välj minst 2 företag/år för jämförelse")
             selected_sheets = []
     
+    elif analysis_type == "Årsjämförelse":
+        selected_company = st.sidebar.selectbox(
+            "Välj företag:",
+            analyzer.get_companies(),
+            help="Välj vilket företag du vill jämföra år för år"
+        )
+        selected_sheets = analyzer.get_sheet_catalog().loc[selected_company, 'Flik'].tolist() if selected_company else []
+    
+    elif analysis_type == "Scenarier":
+        selected_sheet = st.sidebar.selectbox(
+            "Välj företag/år för scenarier:",
+            analyzer.available_sheets,
+            help="Välj vilket företag och år du vill räkna what-if-scenarier för"
+        )
+        selected_sheets = [selected_sheet]
+    
     elif analysis_type == "Rådata & Redigering":
         selected_sheet = st.sidebar.selectbox(
             "Välj företag/år för redigering:",
             analyzer.available_sheets,
+            key="edit_sheet",
             help="Välj vilket företag och år du vill se och redigera rådata för"
         )
         selected_sheets = [selected_sheet]
+    
+    elif analysis_type == "Förändringar":
+        previous_snapshots = analyzer.get_previous_snapshots()
+        previous_version = None
+        if previous_snapshots:
+            labels = {
+                snapshot['version']: f"{datetime.fromtimestamp(snapshot['created_at']):%Y-%m-%d %H:%M} "
+                                     f"({snapshot['version'][:8]}, {snapshot['n_sheets']} flikar)"
+                for snapshot in previous_snapshots
+            }
+            previous_version = st.sidebar.selectbox(
+                "Jämför med tidigare version:",
+                list(labels),
+                format_func=labels.get,
+                help="Tidigare inlästa versioner av arbetsboken"
+            )
+        else:
+            st.sidebar.info("Ingen tidigare version av arbetsboken har lästs in ännu")
+        selected_sheets = analyzer.available_sheets
+    
+    elif analysis_type == "Avvikelser":
+        anomaly_threshold = st.sidebar.slider(
+            "Poänggräns:", min_value=3.5, max_value=20.0, value=5.0, step=0.5,
+            key="anomaly_threshold",
+            help="Robust z-värde: 3,5 är en vanlig gräns för avvikelse, högre ger färre och tydligare träffar"
+        )
+        anomaly_companies = st.sidebar.multiselect(
+            "Företag:",
+            analyzer.get_companies(),
+            key="anomaly_companies",
+            placeholder="Alla företag"
+        )
+        selected_sheets = (analyzer.select_sheets(anomaly_companies) if anomaly_companies
+                           else analyzer.available_sheets)
             
     else:  # Alla företag
         selected_sheets = analyzer.available_sheets
         st.sidebar.info(f"📊 Visar alla {len(selected_sheets)} företag/år")
     
+    # Periodnivå för stapeldiagram, tabeller och jämförelser - väljer en förberäknad nivå
+    period_level = 'Månad'
+    if analysis_type in ("Enskilt företag", "Jämför företag", "Alla företag"):
+        period_level = st.sidebar.radio(
+            "Periodnivå:",
+            list(PERIOD_LEVELS),
+            horizontal=True,
+            key="period_level",
+            help="Kvartal, tertial, halvår och år är förberäknade från månaderna vid inläsning"
+        )
+    
+    # Avstämningsstatus för hela portföljen
+    mismatches = analyzer.get_reconciliation()
+    if mismatches is not None and len(mismatches):
+        st.sidebar.warning(f"⚠️ Avstämning: {len(mismatches)} avvikelser i {mismatches['Flik'].nunique()} flikar (se Rådata & Redigering)")
+    else:
+        st.sidebar.success("✅ Avstämning: alla flikar stämmer")
+    
+    if search_query.strip():
+        display_account_search(analyzer, search_query)
+    
     # Kontrollera att vi har data att visa
     if not selected_sheets:
         st.info("👈 Välj företag och år i sidomenyn för att se analys")
@@ -1053,15 +1773,24 @@ def main():
         # KPI Cards
         display_kpi_cards(analyzer, selected_sheets[0])
         
+        # Elimineringar om fliken är en koncernflik
+        display_consolidation(analyzer, selected_sheets[0])
+        
+        # Egna nyckeltal på vald periodnivå
+        display_custom_kpis(analyzer, selected_sheets[0], period_level)
+        
         # Diagram i kolumner
         st.markdown('<div class="section-header">📊 Finansiella Diagram</div>', unsafe_allow_html=True)
         
-        # Linjediagram (full bredd)
-        line_chart = create_monthly_line_chart(monthly_revenue, monthly_expenses, monthly_net_result)
-        st.plotly_chart(line_chart, use_container_width=True)
+        # Linjediagram (full bredd), med prognos för månader som inte stängts
+        display_forecast_chart(analyzer, selected_sheets[0], monthly_revenue, monthly_expenses, monthly_net_result)
+        
+        # Monte Carlo-fördelning av årets resultat
+        display_simulation(analyzer, selected_sheets[0])
         
-        # Stapeldiagram för översikt
-        bar_chart = create_monthly_bar_chart(monthly_revenue, monthly_expenses, monthly_net_result)
+        # Stapeldiagram för översikt på vald periodnivå
+        period_revenue, period_expenses, period_net_result = analyzer.get_period_series(selected_sheets[0], period_level)
+        bar_chart = create_monthly_bar_chart(period_revenue, period_expenses, period_net_result, period_level)
         st.plotly_chart(bar_chart, use_container_width=True)
         
         # Detaljerade intäkter och utgifter
@@ -1077,75 +1806,71 @@ def main():
             if expense_detail_chart:
                 st.plotly_chart(expense_detail_chart, use_container_width=True)
         
-        # Datatabell
-        st.markdown('<div class="section-header">📋 Månadsdata</div>', unsafe_allow_html=True)
-        
-        months = ['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dec']
-        
-        # Säkerställ att alla listor har samma längd (12 månader)
-        while len(monthly_revenue) < 12:
-            monthly_revenue.append(0)
-        while len(monthly_expenses) < 12:
-            monthly_expenses.append(0)
-        while len(monthly_net_result) < 12:
-            monthly_net_result.append(0)
+        # Drilldown i kontohierarkin
+        display_account_drilldown(analyzer, selected_sheets[0])
         
-        # Trimma till 12 månader om de är längre
-        monthly_revenue = monthly_revenue[:12]
-        monthly_expenses = monthly_expenses[:12]
-        monthly_net_result = monthly_net_result[:12]
+        # Datatabell på vald periodnivå
+        table_title = 'Månadsdata' if period_level == 'Månad' else f'Data per {period_level.lower()}'
+        st.markdown(f'<div class="section-header">📋 {table_title}</div>', unsafe_allow_html=True)
         
         data_table = pd.DataFrame({
-            'Månad': months,
-            'Intäkter': [f"{val:,.1f} tSEK" for val in monthly_revenue],
-            'Kostnader': [f"{val:,.1f} tSEK" for val in monthly_expenses],
-            'Nettoresultat': [f"{net:,.1f} tSEK" for net in monthly_net_result]
+            period_level: PERIOD_LEVELS[period_level],
+            'Intäkter': [f"{val:,.1f} tSEK" for val in period_revenue],
+            'Kostnader': [f"{val:,.1f} tSEK" for val in period_expenses],
+            'Nettoresultat': [f"{net:,.1f} tSEK" for net in period_net_result]
         })
         
         st.dataframe(data_table, use_container_width=True)
     
+    elif analysis_type == "Årsjämförelse":
+        display_yoy_comparison(analyzer, selected_company)
+    
+    elif analysis_type == "Scenarier":
+        display_scenarios(analyzer, selected_sheets[0])
+    
+    elif analysis_type == "Förändringar":
+        display_snapshot_diff(analyzer, previous_version)
+    
+    elif analysis_type == "Avvikelser":
+        display_anomalies(analyzer, anomaly_threshold, selected_sheets)
+    
     elif analysis_type == "Rådata & Redigering":
-        # Rådata viewer och editor
-        display_raw_data_editor(analyzer, selected_sheets[0])
+        # Rådata viewer och editor med uppdaterad analys - ett fragment, redigering kör inte om resten
+        display_editor_section(analyzer, selected_sheets[0])
         
-        # Visa även uppdaterad analys baserat på ändringar
-        if f'edited_data_{selected_sheets[0]}' in st.session_state:
-            editable_summary = get_editable_data_summary(analyzer, selected_sheets[0])
-            if editable_summary:
-                monthly_revenue, monthly_expenses = editable_summary
-                monthly_net_result = [rev + exp for rev, exp in zip(monthly_revenue, monthly_expenses)]  # exp är redan negativ
-                
-                st.markdown('<div class="section-header">📊 Uppdaterad Analys (Baserat på Dina Ändringar)</div>', unsafe_allow_html=True)
-                
-                # Visa uppdaterade diagram
-                updated_line_chart = create_monthly_line_chart(monthly_revenue, monthly_expenses, monthly_net_result)
-                st.plotly_chart(updated_line_chart, use_container_width=True)
-                
-                # Visa uppdaterad datatabell
-                st.markdown('<div class="section-header">📋 Uppdaterad Månadsdata</div>', unsafe_allow_html=True)
-                months = ['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dec']
-                
-                updated_data_table = pd.DataFrame({
-                    'Månad': months,
-                    'Intäkter': [f"{val:,.1f} tSEK" for val in monthly_revenue],
-                    'Kostnader': [f"{val:,.1f} tSEK" for val in monthly_expenses],
-                    'Nettoresultat': [f"{net:,.1f} tSEK" for net in monthly_net_result]
-                })
-                
-                st.dataframe(updated_data_table, use_container_width=True)
+        # Avstämning av Excel-summorna
+        display_reconciliation(analyzer, selected_sheets[0])
     
     else:
         # Multi-företag analys
         st.markdown('<div class="section-header">📊 Jämförelse av Företag</div>', unsafe_allow_html=True)
         
         # Skapa jämförelsediagram
-        comparison_chart = create_multi_company_comparison(analyzer, selected_sheets)
+        comparison_chart = create_multi_company_comparison(analyzer, selected_sheets, period_level)
         if comparison_chart:
             st.plotly_chart(comparison_chart, use_container_width=True)
         
         # KPI sammanfattning för alla företag
         display_multi_company_kpis(analyzer, selected_sheets)
         
+        # Förlustsannolikhet per företag från Monte Carlo-simuleringen
+        simulation_summary = analyzer.get_simulation_summary()
+        if len(simulation_summary):
+            selected_companies = {analyzer.sheet_index[analyzer.get_sheet_position(sheet)][0] for sheet in selected_sheets}
+            simulation_summary = simulation_summary[simulation_summary['Företag'].isin(selected_companies)]
+        if len(simulation_summary):
+            st.markdown('<div class="section-header">🎲 Simulerat Helårsresultat</div>', unsafe_allow_html=True)
+            st.dataframe(
+                simulation_summary.style.format({
+                    'P(förlust) (%)': "{:.1f}%", 'P5': "{:,.1f}", 'Median': "{:,.1f}", 'P95': "{:,.1f}"
+                }),
+                use_container_width=True,
+                hide_index=True
+            )
+        
+        # Portföljheatmap - ett spår för alla valda företag
+        display_portfolio_heatmap(analyzer, selected_sheets)
+        
         # Diagram för multi-företag
         st.markdown('<div class="section-header">📊 Finansiella Diagram</div>', unsafe_allow_html=True)
         
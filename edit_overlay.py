@@ -0,0 +1,114 @@
+"""
+Redigeringslager - glesa ändringar per session ovanpå en delad, oförändrad basram
+"""
+import numpy as np
+import pandas as pd
+
+from financial_analyzer import MONTHS, to_number_matrix
+
+
+def _same(a, b):
+    """Jämför cellvärden elementvis, två tomma celler räknas som lika"""
+    a = np.asarray(a, dtype=object)
+    b = np.asarray(b, dtype=object)
+    missing_a, missing_b = pd.isna(a), pd.isna(b)
+    # pd.NA går inte att jämföra med ==, så bara celler med värden på båda sidor jämförs
+    both = ~missing_a & ~missing_b
+    equal = np.zeros(a.shape, dtype=bool)
+    equal[both] = a[both] == b[both]
+    return equal | (missing_a & missing_b)
+
+
+def _with_values(series, values):
+    """Ny Series med värden {rad: värde} insatta, byter till object om typen inte räcker"""
+    series = series.copy()
+    try:
+        series.loc[list(values)] = list(values.values())
+    except (TypeError, ValueError):
+        series = series.astype(object)
+        series.loc[list(values)] = list(values.values())
+    return series
+
+
+class EditOverlay:
+    """
+    Copy-on-write-vy över en flik. Basramen och dess numeriska matris delas
+    mellan alla sessioner och ändras aldrig; sessionen äger bara en gles ordbok
+    {rad: {kolumn: värde}} med de celler som skiljer sig från basen. Vyer
+    materialiseras först när de behövs och bara för de rader som visas.
+    """
+
+    def __init__(self, base, edits=None, numbers=None):
+        self.base = base
+        self.edits = {} if edits is None else edits
+        self.numbers = numbers
+
+    def __len__(self):
+        """Antal ändrade celler"""
+        return sum(len(cols) for cols in self.edits.values())
+
+    def set(self, row, column, value):
+        """Sätter ett cellvärde - värden som är lika med basen tas bort ur lagret"""
+        if _same(value, self.base.at[row, column]):
+            cols = self.edits.get(row)
+            if cols is not None:
+                cols.pop(column, None)
+                if not cols:
+                    del self.edits[row]
+        else:
+            self.edits.setdefault(row, {})[column] = value
+
+    def apply(self, frame):
+        """Tar upp ändringar från en redigerad delmängd av basen (t.ex. st.data_editor)"""
+        rows = frame.index.intersection(self.base.index)
+        columns = [col for col in frame.columns if col in self.base.columns]
+        if not len(rows) or not columns:
+            return
+        new = frame.loc[rows, columns].to_numpy(dtype=object)
+        same = _same(new, self.base.loc[rows, columns].to_numpy(dtype=object))
+        # Bara celler som skiljer sig eller redan finns i lagret behöver röras
+        col_index = {col: j for j, col in enumerate(columns)}
+        touched = set(zip(*np.nonzero(~same)))
+        for i, row in enumerate(rows):
+            for col in self.edits.get(row, ()):
+                if col in col_index:
+                    touched.add((i, col_index[col]))
+        for i, j in touched:
+            self.set(rows[i], columns[j], new[i, j])
+
+    def reset(self):
+        """Tar bort alla ändringar"""
+        self.edits.clear()
+
+    def column(self, column):
+        """En kolumn med ändringar - kopieras bara om kolumnen har ändrats"""
+        series = self.base[column]
+        edited = {row: cols[column] for row, cols in self.edits.items() if column in cols}
+        return _with_values(series, edited) if edited else series
+
+    def view(self, rows=None):
+        """Materialiserar valda rader (alla om rows är None) med ändringarna applicerade"""
+        frame = (self.base if rows is None else self.base.loc[rows]).copy()
+        updates = {}
+        for row, cols in self.edits.items():
+            if row in frame.index:
+                for column, value in cols.items():
+                    updates.setdefault(column, {})[row] = value
+        for column, values in updates.items():
+            frame[column] = _with_values(frame[column], values)
+        return frame
+
+    def month_values(self):
+        """Numeriska månadsvärden (rad × månad) med ändrade celler omräknade"""
+        if self.numbers is not None:
+            values = self.numbers[:, :len(MONTHS)].copy()
+        else:
+            present = [j for j, month in enumerate(MONTHS) if month in self.base.columns]
+            values = np.full((len(self.base), len(MONTHS)), np.nan)
+            values[:, present] = to_number_matrix(self.base[[MONTHS[j] for j in present]])
+        positions = self.base.index.get_indexer(list(self.edits))
+        for pos, cols in zip(positions, self.edits.values()):
+            for column, value in cols.items():
+                if column in MONTHS:
+                    values[pos, MONTHS.index(column)] = to_number_matrix(pd.DataFrame([[value]]))[0, 0]
+        return values
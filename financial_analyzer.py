@@ -2,23 +2,280 @@
 Finansiell Analyzer - CLEAN VERSION - Endast dataläsning från Excel
 """
 import pandas as pd
+import numpy as np
 import os
+import re
+import hashlib
+import threading
+
+from account_rules import get_account_rules
+from account_tree import AccountTree
+from forecasting import forecast, closed_month_counts
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dec']
+VALUE_COLUMNS = MONTHS + ['Totalt']
+KEY_ROWS = ['revenue', 'expenses', 'net_result']
+
+# Periodpyramid: nivå -> periodetiketter, varje period är lika många på varandra följande månader
+PERIOD_LEVELS = {
+    'Månad': MONTHS,
+    'Kvartal': ['Q1', 'Q2', 'Q3', 'Q4'],
+    'Tertial': ['T1', 'T2', 'T3'],
+    'Halvår': ['H1', 'H2'],
+    'År': ['Helår'],
+}
+
+# Mått i portföljens heatmap
+HEATMAP_METRICS = ['Intäkter', 'Kostnader', 'Nettoresultat', 'Vinstmarginal (%)']
+
+# Regelroller som motsvarar nyckelraderna
+KEY_ROLES = {'revenue_total': 'revenue', 'expense_total': 'expenses', 'net_result': 'net_result'}
+
+# Filer som letas upp automatiskt, i prioritetsordning
+FINANCIAL_FILES = ['Finansiell Data.xlsx', 'finansiell_data.xlsx', 'data.xlsx']
+
+# Fliknamn som "KLAB 2024" -> ("KLAB", 2024)
+SHEET_NAME_PATTERN = re.compile(r'^\s*(.*?)[\s_-]*((?:19|20)\d{2})\s*$')
+
+
+def parse_sheet_name(sheet_name):
+    """Delar upp fliknamn i (företag, år) - år blir None om det saknas"""
+    match = SHEET_NAME_PATTERN.match(str(sheet_name))
+    if match and match.group(1):
+        return match.group(1), int(match.group(2))
+    return str(sheet_name).strip(), None
+
+
+def sheet_multi_index(sheets):
+    """
+    (företag, år)-index för flikarna. År är nullbart heltal (Int64) så att en
+    flik utan år ger <NA> i stället för att göra alla år till flyttal.
+    """
+    keys = [parse_sheet_name(sheet) for sheet in sheets]
+    return pd.MultiIndex.from_arrays(
+        [[company for company, _ in keys], pd.array([year for _, year in keys], dtype='Int64')],
+        names=['Företag', 'År']
+    )
+
+
+def period_matrix():
+    """
+    Aggregeringsmatris (månad × alla perioder i pyramiden) med ettor där månaden
+    ingår i perioden, och kolumnintervallet för varje nivå. Månader @ matris ger
+    alla nivåer på en gång.
+    """
+    n_periods = sum(len(labels) for labels in PERIOD_LEVELS.values())
+    matrix = np.zeros((len(MONTHS), n_periods))
+    slices = {}
+    start = 0
+    for level, labels in PERIOD_LEVELS.items():
+        length = len(MONTHS) // len(labels)
+        for period in range(len(labels)):
+            matrix[period * length:(period + 1) * length, start + period] = 1.0
+        slices[level] = slice(start, start + len(labels))
+        start += len(labels)
+    return matrix, slices
+
+
+def find_financial_file():
+    """Hittar Excel-fil automatiskt, None om ingen finns"""
+    for filename in FINANCIAL_FILES:
+        if os.path.exists(filename):
+            return filename
+    return None
+
+
+def file_sha1(path):
+    """SHA1 av filens innehåll - används som datasnapshotens version"""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def normalize_label(label):
+    """Normaliserar kontoetikett för matchning mellan flikar"""
+    return ' '.join(str(label).split()).casefold()
+
+
+def to_number_matrix(frame):
+    """Konverterar svenska talformat ('1 234,5') till en float-matris, NaN för tomma celler"""
+    text = frame.astype(str)
+    text = text.apply(lambda col: col.str.replace('\xa0', '', regex=False)
+                                     .str.replace(' ', '', regex=False)
+                                     .str.replace(',', '.', regex=False))
+    return text.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+
+
+def sheet_layout_rows(labels, matrix, rules=None, groups=None, sides=None):
+    """
+    Ordnar konton × månader (tSEK, intäkter positiva och kostnader negativa) i
+    arbetsbokens layout: rubrik och SUMMA-rad per rapportgrupp, intäkter före
+    SUMMA RÖRELSENS INTÄKTER, övriga grupper under rörelsens kostnader i
+    BAS-ordning och bokfört årets resultat sist före BERÄKNAT RESULTAT.
+    Rapportgrupp tas från groups (en per konto) om den anges, annars från
+    reglerna. Med sides (en sida per konto, 'revenue', 'expense' eller None)
+    hamnar konton på intäktssidan alltid under rörelsens intäkter och övriga
+    konton bara i grupper som får stå på deras sida. Konton utan rapportgrupp
+    (t.ex. balanskonton) tas inte med.
+    Returnerar (etiketter, matris med Jan..Dec + Totalt), NaN-etikett för tomrader.
+    """
+    rules = rules or get_account_rules()
+    matrix = np.asarray(matrix, dtype=float).reshape(len(labels), len(MONTHS))
+    revenue_group = 'Intäkter'
+    result_group = 'Årets resultat'
+    by_group = {}
+    for row, label in enumerate(labels):
+        side = sides[row] if sides is not None else None
+        group = groups[row] if groups is not None else rules.group(label, side)
+        if side == 'revenue':
+            group = revenue_group
+        elif not rules.allows(group, side):
+            group = None
+        if group is not None:
+            by_group.setdefault(group, []).append(row)
+
+    rows = [('KONTO/BESKRIVNING', None)]
+
+    def add_group(group):
+        members = sorted(by_group.get(group, []), key=lambda row: str(labels[row]))
+        if not members:
+            return np.zeros(len(MONTHS))
+        rows.append((group, None))
+        rows.extend((str(labels[row]), matrix[row]) for row in members)
+        total = matrix[members].sum(axis=0)
+        rows.append((f'Summa {group.casefold()}', total))
+        rows.append((np.nan, None))
+        return total
+
+    rows.append(('RÖRELSENS INTÄKTER', None))
+    revenue = add_group(revenue_group)
+    rows.append(('SUMMA RÖRELSENS INTÄKTER', revenue))
+    rows.append((np.nan, None))
+
+    rows.append(('RÖRELSENS KOSTNADER', None))
+    expenses = np.zeros(len(MONTHS))
+    # Kostnadsgrupperna i BAS-ordning (lägsta kontonummer i gruppens intervall)
+    first_account = {}
+    for low, _, group in rules.ranges:
+        first_account.setdefault(group, low)
+    for group in sorted(rules.groups, key=lambda group: first_account.get(group, float('inf'))):
+        if group not in (revenue_group, result_group):
+            expenses = expenses + add_group(group)
+    rows.append(('SUMMA RÖRELSENS KOSTNADER', expenses))
+    rows.append((np.nan, None))
+
+    booked_result = add_group(result_group)
+    rows.append(('BERÄKNAT RESULTAT', revenue + expenses + booked_result))
+
+    values = np.full((len(rows), len(VALUE_COLUMNS)), np.nan)
+    for i, (_, monthly) in enumerate(rows):
+        if monthly is not None:
+            values[i, :len(MONTHS)] = monthly
+            values[i, -1] = monthly.sum()
+    return [label for label, _ in rows], values
+
+
+def build_sheet_layout(labels, matrix, rules=None, groups=None, sides=None):
+    """Bygger en flik (DataFrame) i arbetsbokens layout, se sheet_layout_rows"""
+    layout_labels, values = sheet_layout_rows(labels, matrix, rules, groups, sides)
+    frame = pd.DataFrame(values.round(1), columns=VALUE_COLUMNS)
+    frame = frame.astype(object)
+    frame.iloc[0] = VALUE_COLUMNS
+    frame.insert(0, 'Kategori', layout_labels)
+    return frame
+
 
 class FinancialAnalyzer:
-    def __init__(self, excel_file_path=None, data_type='financial'):
+    def __init__(self, excel_file_path=None, data_type='financial', rules_path=None, snapshot=None,
+                 consolidation_path=None):
         """
-        Initialiserar analysatorn med Excel-fil
+        Initialiserar analysatorn med Excel-fil, eller från en binär snapshot
+        (binary_snapshot.BinarySnapshot) utan att läsa Excel
         """
+        from consolidation import load_consolidation
+        
         self.data_type = data_type
+        self.rules = get_account_rules(rules_path)
+        self.consolidation = load_consolidation(consolidation_path)
         self.excel_file_path = excel_file_path
         self.data = {}
         self.processed_data = {}
         self.available_sheets = []
         
+        # Numeriska matriser per flik (rader × Jan..Dec + Totalt)
+        self.labels = {}
+        self.values = {}
+        
+        # Portföljkub: (flik, konto, månad) med (företag, år) som MultiIndex
+        self.sheet_index = None
+        self.sheet_names = []
+        self.sheet_positions = {}
+        self.row_accounts = {}
+        self.account_labels = []
+        self.account_positions = {}
+        self.cube = None
+        self.cube_mask = None
+        self.previous_sheet = None
+        self.yoy_delta = None
+        self.yoy_growth = None
+        
+        # Materialiserade nyckeltal, byggs om endast när datasnapshoten ändras
+        self.snapshot_version = None
+        self.key_rows = {}
+        self.key_series = None
+        self.active_months = None
+        self.kpi_table = None
+        
+        # Periodpyramid (månad, kvartal, tertial, halvår, år) för kub och nyckelrader
+        self.period_slices = {}
+        self.period_cube = None
+        self.period_key_series = None
+        
+        # Prognoser per metod, beräknas vid första användning för snapshoten
+        self.closed_months = None
+        self.forecasts = {}
+        
+        # Monte Carlo-simuleringar per (snapshot, flik, dragningar, seed)
+        self.simulations = {}
+        
+        # Explicit kontohierarki och rapportgrupp per rad
+        self.account_trees = {}
+        self.row_groups = {}
+        
+        # Avstämning av Totalt, SUMMA-rader och resultat
+        self.excel_row_offsets = {}
+        self.reconciliation = None
+        
+        # Delade basramar för rådataredigering (sessioner lagrar bara sina ändringar)
+        self.editable_bases = {}
+        
+        # Sökindex över kontoetiketter i alla flikar
+        self.search_index = None
+        
+        # Jämförelser mot tidigare snapshots: (version, tidigare version) -> SnapshotDiff
+        self.snapshot_diffs = {}
+        
+        # Koncernflikar som räknats fram ur medlemsflikarna: fliknamn -> Consolidation
+        self.consolidations = {}
+        
+        # Rangordnade avvikelser, beräknas vid första användning för snapshoten
+        self.anomalies = None
+        
+        # Egna nyckeltal: uttryckstext -> (flik, period) över hela periodpyramiden
+        self.kpi_inputs = None
+        self.custom_kpis = {}
+        
+        # Sätts av freeze() när instansen delas mellan sessioner
+        self.frozen = False
+        
         # Ingen kategoridatabas behövs för denna enkla version
         
-        # Ladda data från Excel
-        if self.excel_file_path:
+        # Ladda data från snapshot eller Excel
+        if snapshot is not None:
+            self.attach_snapshot(snapshot)
+        elif self.excel_file_path:
             self.load_data()
         else:
             # Try to find financial file automatically
@@ -29,18 +286,10 @@ class FinancialAnalyzer:
 
     def _find_financial_file(self):
         """Hittar Excel-fil automatiskt"""
-        possible_files = [
-            'Finansiell Data.xlsx',
-            'finansiell_data.xlsx', 
-            'data.xlsx'
-        ]
-        
-        for filename in possible_files:
-            if os.path.exists(filename):
-                print(f"✅ Hittade Excel-fil: {filename}")
-                return filename
-
-        return None
+        filename = find_financial_file()
+        if filename:
+            print(f"✅ Hittade Excel-fil: {filename}")
+        return filename
 
     def load_data(self):
         """Läser in alla flikar från Excel-filen"""
@@ -48,6 +297,8 @@ class FinancialAnalyzer:
             raise Exception(f"Excel-fil hittades inte: {self.excel_file_path}")
         
         try:
+            self.snapshot_version = data_version(file_sha1(self.excel_file_path), self.consolidation, self.rules)
+            
             excel_file = pd.ExcelFile(self.excel_file_path)
             self.available_sheets = excel_file.sheet_names
             
@@ -64,6 +315,8 @@ class FinancialAnalyzer:
                 if header_row is not None:
                     # Läs data med rätt header
                     df = pd.read_excel(self.excel_file_path, sheet_name=sheet_name, header=header_row)
+                    # Rad 0 i df ligger på Excel-rad header_row + 2
+                    self.excel_row_offsets[sheet_name] = header_row + 2
                     # Sätt korrekta kolumnnamn
                     expected_months = ['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun', 
                                      'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dec', 'Totalt']
@@ -80,15 +333,62 @@ class FinancialAnalyzer:
                 else:
                     # Fallback till standardformat
                     df = pd.read_excel(self.excel_file_path, sheet_name=sheet_name)
+                    self.excel_row_offsets[sheet_name] = 2
                 
                 self.data[sheet_name] = df
                 
-            self.clean_and_standardize_data()
+            self.build_derived()
             print(f"✅ Laddade data från {len(self.available_sheets)} flikar: {self.available_sheets}")
             
         except Exception as e:
             raise Exception(f"Fel vid inläsning av Excel-fil: {str(e)}")
 
+    def build_derived(self):
+        """Bygger alla härledda strukturer från self.data och tömmer cachar"""
+        self.clean_and_standardize_data()
+        self.build_matrices()
+        self.build_portfolio()
+        self.build_kpi_table()
+        self.build_account_trees()
+        if self.build_consolidations():
+            # Koncernflikarna ingår i kub, nyckeltal och kontoträd som vanliga flikar
+            self.build_portfolio()
+            self.build_kpi_table()
+            self.build_account_trees()
+        self.build_period_pyramid()
+        self.run_reconciliation()
+        self.build_search_index()
+        self.forecasts = {}
+        self.simulations = {}
+        self.anomalies = None
+        self.kpi_inputs = None
+        self.custom_kpis = {}
+        self.editable_bases = {}
+
+    def register_sheets(self, frames):
+        """
+        Registrerar flikar i samma layout som Excel-filen ({fliknamn: DataFrame})
+        från andra källor, t.ex. SIE- eller huvudboksimport. Befintliga flikar med
+        samma namn ersätts och snapshotversionen räknas om.
+        """
+        if self.frozen:
+            raise Exception("Delad analysator är skrivskyddad - registrera flikar i en egen instans")
+        sha1 = hashlib.sha1((self.snapshot_version or '').encode())
+        for sheet_name, frame in frames.items():
+            self.data[sheet_name] = frame
+            self.excel_row_offsets.setdefault(sheet_name, 2)
+            if sheet_name not in self.available_sheets:
+                self.available_sheets.append(sheet_name)
+            sha1.update(sheet_name.encode())
+            sha1.update(pd.util.hash_pandas_object(frame.astype(str), index=False).to_numpy().tobytes())
+        self.snapshot_version = sha1.hexdigest()
+        self.build_derived()
+        print(f"✅ Registrerade {len(frames)} flikar: {list(frames)}")
+
+    def register_account_matrix(self, sheet_name, labels, matrix):
+        """Registrerar en flik från konton × månader (tSEK, intäkter positiva)"""
+        self.register_sheets({sheet_name: build_sheet_layout(labels, matrix, self.rules)})
+
     def clean_and_standardize_data(self):
         """Rengör och standardiserar dataformatet"""
         for sheet_name, df in self.data.items():
@@ -117,18 +417,717 @@ class FinancialAnalyzer:
                 print(f"  ⚠️ Kunde inte bearbeta {sheet_name}: {e}")
                 continue
             
+    def build_matrices(self):
+        """Bygger etiketter och numeriska matriser (rader × Jan..Dec + Totalt) per flik"""
+        for sheet_name, df in self.data.items():
+            labels = df.iloc[:, 0].where(df.iloc[:, 0].notna(), '').astype(str).str.strip()
+            matrix = np.full((len(df), len(VALUE_COLUMNS)), np.nan)
+            numeric = to_number_matrix(df.iloc[:, 1:len(VALUE_COLUMNS) + 1])
+            matrix[:, :numeric.shape[1]] = numeric
+            if numeric.shape[1] < len(VALUE_COLUMNS):
+                # Saknas Totalt räknar vi fram den från månaderna
+                matrix[:, -1] = np.nansum(matrix[:, :len(MONTHS)], axis=1)
+            self.labels[sheet_name] = labels.tolist()
+            self.values[sheet_name] = matrix
+
+    def build_consolidations(self):
+        """
+        Räknar fram koncernflikar enligt konsolideringsfilen ur medlemsflikarna i
+        portföljkuben och lägger till dem som flikar. Returnerar antal koncernflikar.
+        """
+        for sheet_name in self.consolidations:
+            for store in (self.labels, self.values, self.data, self.excel_row_offsets):
+                store.pop(sheet_name, None)
+            if sheet_name in self.available_sheets:
+                self.available_sheets.remove(sheet_name)
+        self.consolidations = {}
+        if self.consolidation is None:
+            return 0
+        from consolidation import consolidate_all
+        
+        self.consolidations = consolidate_all(self, self.consolidation)
+        for sheet_name, result in self.consolidations.items():
+            self.labels[sheet_name] = result.labels
+            self.values[sheet_name] = result.values
+            self.available_sheets.append(sheet_name)
+        return len(self.consolidations)
+
+    def get_consolidation(self, sheet_name):
+        """
+        Konsolidering bakom en koncernflik (se consolidation.Consolidation), None
+        för vanliga flikar. Efter anslutning till en snapshot räknas den fram vid behov.
+        """
+        if sheet_name not in self.consolidations:
+            from consolidation import consolidate, consolidation_group
+            
+            target = consolidation_group(self.consolidation, sheet_name)
+            if target is None or sheet_name not in self.sheet_positions:
+                return None
+            self.consolidations[sheet_name] = consolidate(self, *target)
+        return self.consolidations[sheet_name]
+
+    def build_portfolio(self):
+        """Bygger (företag, år)-index, kontokub och förberäknade årsförändringar"""
+        sheets = [sheet for sheet in self.available_sheets if sheet in self.values]
+        self.sheet_index = sheet_multi_index(sheets)
+        self.sheet_names = sheets
+        self.sheet_positions = {sheet: idx for idx, sheet in enumerate(sheets)}
+        
+        # Konton identifieras via normaliserad etikett över alla flikar
+        self.account_labels = []
+        self.account_positions = {}
+        row_accounts = {}
+        for sheet in sheets:
+            matrix = self.values[sheet]
+            has_values = ~np.isnan(matrix).all(axis=1)
+            positions = np.full(len(matrix), -1)
+            for row, label in enumerate(self.labels[sheet]):
+                if not label or not has_values[row]:
+                    continue
+                key = normalize_label(label)
+                if key not in self.account_positions:
+                    self.account_positions[key] = len(self.account_labels)
+                    self.account_labels.append(label)
+                positions[row] = self.account_positions[key]
+            row_accounts[sheet] = positions
+        self.row_accounts = row_accounts
+        
+        self.cube = np.zeros((len(sheets), len(self.account_labels), len(VALUE_COLUMNS)))
+        self.cube_mask = np.zeros((len(sheets), len(self.account_labels)), dtype=bool)
+        for sheet_idx, sheet in enumerate(sheets):
+            positions = row_accounts[sheet]
+            valid = positions >= 0
+            # Dubbletter av samma etikett i en flik summeras
+            np.add.at(self.cube[sheet_idx], positions[valid], np.nan_to_num(self.values[sheet][valid]))
+            self.cube_mask[sheet_idx, positions[valid]] = True
+        
+        # Föregående års flik för samma företag (-1 om den saknas)
+        lookup = {key: idx for idx, key in enumerate(self.sheet_index)}
+        self.previous_sheet = np.array([
+            lookup.get((company, year - 1), -1) if not pd.isna(year) else -1
+            for company, year in self.sheet_index
+        ], dtype=int)
+        
+        has_previous = self.previous_sheet >= 0
+        previous = self.cube[np.where(has_previous, self.previous_sheet, 0)]
+        both = self.cube_mask & self.cube_mask[np.where(has_previous, self.previous_sheet, 0)] & has_previous[:, None]
+        self.yoy_delta = np.where(both[:, :, None], self.cube - previous, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.yoy_growth = np.where(both[:, :, None] & (previous != 0),
+                                       self.yoy_delta / np.abs(previous) * 100, np.nan)
+
+    def find_key_rows(self, sheet_name):
+        """Hittar radpositioner för intäkts-, kostnads- och resultatraderna i en flik"""
+        key_rows = {}
+        for row, category in enumerate(self.labels[sheet_name]):
+            # Sista träffen gäller, t.ex. SUMMA RÖRELSENS INTÄKTER efter Summa nettoomsättning
+            key = KEY_ROLES.get(self.rules.role(category))
+            if key is not None:
+                key_rows[key] = row
+        return key_rows
+
+    def build_kpi_table(self):
+        """Materialiserar nyckeltal (en rad per flik) för aktuell datasnapshot"""
+        n_sheets = len(self.sheet_names)
+        # (flik, nyckelrad, Jan..Dec + Totalt)
+        series = np.zeros((n_sheets, len(KEY_ROWS), len(VALUE_COLUMNS)))
+        for sheet_idx, sheet in enumerate(self.sheet_names):
+            self.key_rows[sheet] = self.find_key_rows(sheet)
+            for key_idx, key in enumerate(KEY_ROWS):
+                row = self.key_rows[sheet].get(key)
+                if row is not None:
+                    series[sheet_idx, key_idx] = np.nan_to_num(self.values[sheet][row])
+        # Intäkter visas alltid som positiva, kostnader behåller sitt tecken
+        series[:, 0] = np.abs(series[:, 0])
+        self.key_series = series
+        
+        monthly = series[:, :, :len(MONTHS)]
+        # Månader utan intäkter och kostnader räknas som ej bokförda
+        self.active_months = (monthly[:, 0] != 0) | (monthly[:, 1] != 0)
+        self.closed_months = closed_month_counts(self.active_months)
+        active = np.broadcast_to(self.active_months[:, None, :], monthly.shape)
+        any_active = self.active_months.any(axis=1)[:, None]
+        month_min = np.where(any_active, np.min(np.where(active, monthly, np.inf), axis=2), 0)
+        month_max = np.where(any_active, np.max(np.where(active, monthly, -np.inf), axis=2), 0)
+        month_mean = np.where(active, monthly, 0).sum(axis=2) / np.maximum(self.active_months.sum(axis=1), 1)[:, None]
+        
+        revenue, expenses, net_result = series[:, 0, -1], series[:, 1, -1], series[:, 2, -1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            margin = np.where(revenue > 0, net_result / revenue * 100, 0)
+            has_previous = self.previous_sheet >= 0
+            previous = series[np.where(has_previous, self.previous_sheet, 0), :, -1]
+            growth = np.where(has_previous[:, None] & (previous != 0),
+                              (series[:, :, -1] - previous) / np.abs(previous) * 100, np.nan)
+        
+        table = pd.DataFrame({
+            'Företag': self.sheet_index.get_level_values('Företag'),
+            'År': self.sheet_index.get_level_values('År'),
+            'Intäkter': revenue,
+            'Kostnader': expenses,
+            'Nettoresultat': net_result,
+            'Vinstmarginal (%)': margin,
+        }, index=pd.Index(self.sheet_names, name='Flik'))
+        for key_idx, name in enumerate(['Intäkter', 'Kostnader', 'Nettoresultat']):
+            table[f'{name} min/mån'] = month_min[:, key_idx]
+            table[f'{name} max/mån'] = month_max[:, key_idx]
+            table[f'{name} snitt/mån'] = month_mean[:, key_idx]
+            table[f'{name} tillväxt (%)'] = growth[:, key_idx]
+        table['Bokförda månader'] = self.active_months.sum(axis=1)
+        self.kpi_table = table
+
+    def get_kpi_table(self):
+        """Returnerar den materialiserade nyckeltalstabellen"""
+        return self.kpi_table
+
+    def get_kpis(self, sheet_name):
+        """Returnerar nyckeltal för en flik, None om fliken saknas"""
+        if self.kpi_table is None or sheet_name not in self.kpi_table.index:
+            return None
+        return self.kpi_table.loc[sheet_name]
+
+    def build_period_pyramid(self):
+        """
+        Förberäknar alla periodnivåer för varje konto och flik samt nyckelraderna:
+        en matrismultiplikation över månadsaxeln per array
+        """
+        matrix, self.period_slices = period_matrix()
+        self.period_cube = np.asarray(self.cube[:, :, :len(MONTHS)]) @ matrix
+        self.period_key_series = np.nan_to_num(self.key_series[:, :, :len(MONTHS)]) @ matrix
+
+    def get_period_series(self, sheet_name, level='Månad'):
+        """Intäkter, kostnader och nettoresultat per period på vald nivå (3 × perioder)"""
+        if sheet_name not in self.sheet_positions:
+            return None
+        return self.period_key_series[self.sheet_positions[sheet_name], :, self.period_slices[level]]
+
+    def get_period_accounts(self, sheet_name, level='Månad'):
+        """Flikens konton × perioder på vald nivå som DataFrame"""
+        if sheet_name not in self.sheet_positions:
+            return None
+        idx = self.sheet_positions[sheet_name]
+        accounts = np.flatnonzero(self.cube_mask[idx])
+        return pd.DataFrame(
+            self.period_cube[idx, accounts, self.period_slices[level]],
+            index=[self.account_labels[account] for account in accounts],
+            columns=PERIOD_LEVELS[level]
+        )
+
+    def get_key_series(self, sheet_name):
+        """Returnerar månadsvärden (intäkter, kostnader, nettoresultat) för en flik"""
+        if sheet_name not in self.sheet_positions:
+            return None
+        return self.key_series[self.sheet_positions[sheet_name], :, :len(MONTHS)]
+
+    def build_account_trees(self):
+        """Bygger kontoträd med prefixsummor och rapportgrupper för varje flik"""
+        for sheet in self.sheet_names:
+            tree = AccountTree(
+                self.labels[sheet], self.values[sheet],
+                net_result_row=self.key_rows[sheet].get('net_result'),
+                n_months=len(MONTHS),
+                rules=self.rules
+            )
+            self.account_trees[sheet] = tree
+            
+            # Konton utan kontonummer hör till närmaste rubriks grupp; egna nyckelord
+            # gäller bara utan grupprubrik och bara för grupper på radens sida
+            key_rows = self.key_rows.get(sheet, {})
+            sides = tree.node_sides(key_rows.get('revenue'), key_rows.get('expenses'))
+            node_groups = []
+            for node, label in enumerate(tree.labels):
+                parent = tree.parents[node]
+                inherited = node_groups[parent] if parent >= 0 else None
+                classification = self.rules.classify(label, sides[node])
+                if tree.kinds[node] == 'account' and classification.account_number is None and inherited is not None:
+                    group = inherited
+                else:
+                    group = classification.group or inherited
+                node_groups.append(group)
+            
+            # Kontroll: inget löv under intäktssumman får en kostnadsgrupp och omvänt.
+            # Ärvda grupper kan korsa sidgränsen när rubriker ligger utanför summagrupperna.
+            for node in tree.leaf_nodes:
+                if not self.rules.allows(node_groups[node], sides[node]):
+                    node_groups[node] = None
+            groups = [self.rules.group(label) for label in self.labels[sheet]]
+            for node, row in enumerate(tree.rows):
+                if row is not None:
+                    groups[row] = node_groups[node]
+            self.row_groups[sheet] = groups
+
+    def get_account_tree(self, sheet_name):
+        """Returnerar kontoträdet för en flik"""
+        return self.account_trees.get(sheet_name)
+
+    def run_reconciliation(self, tolerance=None):
+        """Stämmer av alla flikar och sparar avvikelserna"""
+        from reconciliation import reconcile
+        
+        self.reconciliation = reconcile(self, tolerance)
+        if len(self.reconciliation):
+            print(f"  ⚠️ Avstämning: {len(self.reconciliation)} avvikelser i {self.reconciliation['Flik'].nunique()} flikar")
+        else:
+            print("  ✅ Avstämning: inga avvikelser")
+        return self.reconciliation
+
+    def get_reconciliation(self, sheet_name=None):
+        """Returnerar avstämningsavvikelser, för alla flikar eller en specifik flik"""
+        if self.reconciliation is None or sheet_name is None:
+            return self.reconciliation
+        return self.reconciliation[self.reconciliation['Flik'] == sheet_name]
+
+    def build_search_index(self):
+        """Bygger sökindex över normaliserade kontoetiketter i alla flikar"""
+        from search_index import AccountSearchIndex
+        
+        self.search_index = AccountSearchIndex(self)
+        return self.search_index
+
+    def search_accounts(self, query, limit=50, fuzzy=True):
+        """Söker konton i alla flikar, se search_index.AccountSearchIndex.search"""
+        if self.search_index is None:
+            self.build_search_index()
+        return self.search_index.search(query, limit, fuzzy)
+
+    def get_row_groups(self, sheet_name):
+        """Returnerar rapportgrupp per rad i en flik"""
+        return self.row_groups.get(sheet_name)
+
+    def get_portfolio_heatmap(self, metric='Nettoresultat', sheets=None, max_rows=60, definitions=None):
+        """
+        Returnerar företag × månad för valt mått direkt från förberäknade nyckelserier,
+        eller för ett eget nyckeltal (se get_custom_kpi_values) med samma namn.
+        Fler rader än max_rows aggregeras per företag (snitt per år) och därefter
+        till de största företagen plus en rad för övriga.
+        """
+        sheets = self.sheet_names if sheets is None else [s for s in sheets if s in self.sheet_positions]
+        idx = np.array([self.sheet_positions[sheet] for sheet in sheets], dtype=int)
+        series = self.key_series[idx, :, :len(MONTHS)]
+        labels = list(sheets)
+        
+        if metric not in HEATMAP_METRICS:
+            definitions = self.get_kpi_definitions() if definitions is None else definitions
+            definition = next((definition for definition in definitions if definition.name == metric), None)
+            if definition is None:
+                raise ValueError(f"Okänt mått: {metric}")
+            custom = self.get_custom_kpi_values([definition])[0][idx, self.period_slices['Månad']]
+            # Nyckeltalet läggs sist bland nyckelserierna och aggregeras med dem
+            series = np.concatenate([series, custom[:, None]], axis=1)
+        
+        if len(labels) > max_rows:
+            companies = self.sheet_index.get_level_values('Företag')[idx]
+            group_ids, names = pd.factorize(np.asarray(companies, dtype=str))
+            # Odefinierade nyckeltalsvärden (NaN) räknas inte in i snittet
+            defined = ~np.isnan(series)
+            sums = np.zeros((len(names),) + series.shape[1:])
+            np.add.at(sums, group_ids, np.where(defined, series, 0))
+            defined_counts = np.zeros(sums.shape)
+            np.add.at(defined_counts, group_ids, defined)
+            counts = np.bincount(group_ids, minlength=len(names))
+            series = np.where(defined_counts > 0, sums / np.maximum(defined_counts, 1), np.nan)
+            labels = [f'{name} (snitt {count} år)' if count > 1 else str(name)
+                      for name, count in zip(names, counts)]
+        
+        if len(labels) > max_rows:
+            # Största företagen efter omsättning, resten slås ihop
+            order = np.argsort(-np.abs(series[:, 0]).sum(axis=1))
+            top, rest = order[:max_rows - 1], order[max_rows - 1:]
+            series = np.concatenate([series[top], series[rest].mean(axis=0, keepdims=True)])
+            labels = [labels[i] for i in top] + [f'Övriga ({len(rest)} st, snitt)']
+        
+        if metric not in HEATMAP_METRICS:
+            matrix = series[:, len(KEY_ROWS)]
+        elif metric == 'Vinstmarginal (%)':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                matrix = np.where(series[:, 0] > 0, series[:, 2] / series[:, 0] * 100, np.nan)
+        else:
+            matrix = series[:, ['Intäkter', 'Kostnader', 'Nettoresultat'].index(metric)]
+        return pd.DataFrame(matrix, index=labels, columns=MONTHS)
+
+    def _previous_year_values(self, array):
+        """Föregående års värden för varje flik, NaN där föregående år saknas"""
+        has_previous = self.previous_sheet >= 0
+        previous = array[np.where(has_previous, self.previous_sheet, 0)].astype(float)
+        previous[~has_previous] = np.nan
+        return previous
+
+    def get_forecasts(self, method='Säsongsnaiv', scope='key'):
+        """
+        Prognos för ej stängda månader i alla flikar, NaN för stängda månader.
+        scope='key' ger (flik, intäkter/kostnader/resultat, månad), scope='accounts'
+        ger (flik, konto, månad) för hela portföljkuben.
+        """
+        cache_key = (method, scope)
+        if cache_key not in self.forecasts:
+            if scope == 'accounts':
+                values = self.cube[:, :, :len(MONTHS)]
+                previous = self._previous_year_values(values)
+                previous[~self._previous_year_values(self.cube_mask).astype(bool)] = np.nan
+                result = forecast(values, self.closed_months, method, previous)
+            else:
+                values = self.key_series[:, :, :len(MONTHS)]
+                result = forecast(values, self.closed_months, method, self._previous_year_values(values))
+                # Resultatet följer av intäkter + kostnader så att prognosen hänger ihop
+                result[:, 2] = result[:, 0] + result[:, 1]
+            # Cachen delas mellan sessioner och får inte ändras av anropare
+            result.setflags(write=False)
+            self.forecasts[cache_key] = result
+        return self.forecasts[cache_key]
+
+    def get_closed_months(self, sheet_name):
+        """Antal stängda månader för en flik (12 för avslutade år)"""
+        if sheet_name not in self.sheet_positions:
+            return 0
+        return int(self.closed_months[self.sheet_positions[sheet_name]])
+
+    def get_forecast(self, sheet_name, method='Säsongsnaiv'):
+        """Returnerar prognos (intäkter, kostnader, resultat × månad) för en flik"""
+        if sheet_name not in self.sheet_positions:
+            return None
+        return self.get_forecasts(method)[self.sheet_positions[sheet_name]]
+
+    def get_simulation(self, sheet_name, n_draws=10000, seed=42):
+        """Monte Carlo-fördelning av årets resultat för en flik, se simulation.simulate_sheet"""
+        from simulation import simulate_sheet
+        
+        cache_key = (self.snapshot_version, sheet_name, n_draws, seed)
+        if cache_key not in self.simulations:
+            self.simulations[cache_key] = simulate_sheet(self, sheet_name, n_draws, seed)
+        return self.simulations[cache_key]
+
+    def get_simulation_summary(self, n_draws=10000, seed=42):
+        """Förlustsannolikhet och resultatintervall per företag (senaste flik)"""
+        from simulation import simulate_portfolio
+        
+        return simulate_portfolio(self, n_draws, seed)
+
+    def get_adjustment_targets(self, sheet_name):
+        """Returnerar möjliga scenariomål för en flik: rapportgrupper och konton"""
+        tree = self.get_account_tree(sheet_name)
+        if tree is None:
+            return []
+        row_groups = self.get_row_groups(sheet_name)
+        groups = dict.fromkeys(row_groups[tree.rows[node]] for node in tree.leaf_nodes)
+        accounts = dict.fromkeys(tree.labels[node] for node in tree.leaf_nodes)
+        return [f'Grupp: {group}' for group in groups if group] + [f'Konto: {label}' for label in accounts]
+
+    def evaluate_scenarios(self, sheet_name, scenarios):
+        """Utvärderar what-if-scenarier för en flik, se scenarios.evaluate_scenarios"""
+        from scenarios import evaluate_scenarios
+        
+        return evaluate_scenarios(self, sheet_name, scenarios)
+
+    def get_anomalies(self, threshold=None, sheets=None):
+        """
+        Rangordnade avvikelser (se anomalies.score_portfolio), filtrerade på
+        poänggräns och flikar. Poängen räknas en gång per datasnapshot.
+        """
+        from anomalies import DEFAULT_THRESHOLD, score_portfolio
+        
+        if self.anomalies is None:
+            self.anomalies = score_portfolio(self, DEFAULT_THRESHOLD)
+        anomalies = self.anomalies
+        if threshold is not None and threshold > DEFAULT_THRESHOLD:
+            anomalies = anomalies[anomalies['Poäng'] >= threshold]
+        if sheets is not None:
+            anomalies = anomalies[anomalies['Flik'].isin(list(sheets))]
+        return anomalies
+
+    def get_kpi_definitions(self, path=None):
+        """Nyckeltalen i definitionsfilen, tolkade mot regelfilens rapportgrupper (se kpi_expressions)"""
+        from kpi_expressions import load_kpi_definitions
+        
+        return load_kpi_definitions(self.rules.groups, path)
+
+    def get_custom_kpi_values(self, definitions=None):
+        """
+        Egna nyckeltal som (nyckeltal, flik, period) över hela periodpyramiden.
+        Uttryck som inte räknats för datasnapshoten räknas tillsammans i ett
+        pass och cachas per uttryckstext, så delade definitioner räknas en gång.
+        """
+        from kpi_expressions import KpiInputs, evaluate_kpis
+        
+        definitions = self.get_kpi_definitions() if definitions is None else definitions
+        missing = list({definition.text: definition.expression for definition in definitions
+                        if definition.text not in self.custom_kpis}.values())
+        if missing:
+            if self.kpi_inputs is None:
+                self.kpi_inputs = KpiInputs(self)
+            for expression in missing:
+                self.kpi_inputs.check(expression)
+            for expression, values in zip(missing, evaluate_kpis(self.kpi_inputs, missing)):
+                # Cachen delas mellan sessioner och får inte ändras av anropare
+                values.setflags(write=False)
+                self.custom_kpis[expression.text] = values
+        if not definitions:
+            return np.empty((0, len(self.sheet_names), self.period_cube.shape[2]))
+        return np.stack([self.custom_kpis[definition.text] for definition in definitions])
+
+    def get_custom_kpis(self, sheets=None, definitions=None):
+        """Egna nyckeltal för helår, en rad per flik och en kolumn per nyckeltal"""
+        definitions = self.get_kpi_definitions() if definitions is None else definitions
+        sheets = self.sheet_names if sheets is None else [s for s in sheets if s in self.sheet_positions]
+        idx = np.array([self.sheet_positions[sheet] for sheet in sheets], dtype=int)
+        values = self.get_custom_kpi_values(definitions)[:, idx, self.period_slices['År'].start]
+        return pd.DataFrame(values.T, index=pd.Index(sheets, name='Flik'),
+                            columns=[definition.name for definition in definitions])
+
+    def get_custom_kpi_periods(self, sheet_name, level='Månad', definitions=None):
+        """Egna nyckeltal × perioder på vald nivå för en flik, None om fliken saknas"""
+        if sheet_name not in self.sheet_positions:
+            return None
+        definitions = self.get_kpi_definitions() if definitions is None else definitions
+        values = self.get_custom_kpi_values(definitions)[:, self.sheet_positions[sheet_name],
+                                                         self.period_slices[level]]
+        return pd.DataFrame(values, index=[definition.name for definition in definitions],
+                            columns=PERIOD_LEVELS[level])
+
+    def get_sheet_catalog(self):
+        """Returnerar katalog över flikar med (företag, år) som MultiIndex"""
+        return pd.DataFrame({'Flik': self.sheet_names}, index=self.sheet_index)
+
+    def get_companies(self):
+        """Returnerar alla företag i ordning"""
+        if self.sheet_index is None:
+            return []
+        return list(dict.fromkeys(self.sheet_index.get_level_values('Företag')))
+
+    def get_years(self):
+        """Returnerar alla år i portföljen sorterade"""
+        if self.sheet_index is None:
+            return []
+        return sorted({int(year) for year in self.sheet_index.get_level_values('År') if not pd.isna(year)})
+
+    def find_companies(self, query):
+        """Företag vars namn innehåller söktexten (skiftläges- och accentokänsligt)"""
+        from search_index import swedish_fold
+        
+        query = swedish_fold(query).strip()
+        return [company for company in self.get_companies() if query in swedish_fold(company)]
+
+    def select_sheets(self, companies=None, years=None, query=None):
+        """
+        Flikar i arbetsbokens ordning för valda företag och år. Utan valda år tas
+        alla företagets år med, utan valda företag alla företag som matchar
+        söktexten. Inga företag, inget år och ingen söktext ger ett tomt urval.
+        """
+        if not companies and not years and not (query or '').strip():
+            return []
+        if not companies:
+            companies = self.find_companies(query or '')
+        company_level = self.sheet_index.get_level_values('Företag')
+        mask = np.asarray(company_level.isin(list(companies)))
+        if years:
+            mask &= np.asarray(self.sheet_index.get_level_values('År').isin(list(years)))
+        return [sheet for sheet, keep in zip(self.sheet_names, mask) if keep]
+
+    def get_sheet_position(self, sheet_name):
+        """Returnerar fliken position i portföljkuben"""
+        return self.sheet_positions[sheet_name]
+
+    def get_company_positions(self, company):
+        """Returnerar (år, position) för ett företags flikar sorterade på år"""
+        positions = [
+            (year, idx) for idx, (name, year) in enumerate(self.sheet_index)
+            if name == company
+        ]
+        return sorted(positions, key=lambda item: (pd.isna(item[0]), 0 if pd.isna(item[0]) else item[0]))
+
+    def find_account(self, label):
+        """Returnerar kontots position i portföljkuben, None om det saknas"""
+        return self.account_positions.get(normalize_label(label))
+
+    def get_company_accounts(self, company):
+        """Returnerar konton som förekommer i något av företagets år"""
+        positions = [idx for _, idx in self.get_company_positions(company)]
+        present = self.cube_mask[positions].any(axis=0)
+        return [self.account_labels[i] for i in np.flatnonzero(present)]
+
+    def get_yoy_frame(self, company, account_label):
+        """Returnerar värden, förändring och tillväxt per år och månad för ett konto"""
+        account = self.find_account(account_label)
+        positions = self.get_company_positions(company)
+        if account is None or not positions:
+            return None
+        years = [year for year, _ in positions]
+        idx = [pos for _, pos in positions]
+        present = self.cube_mask[idx, account]
+        values = np.where(present[:, None], self.cube[idx, account], np.nan)
+        return {
+            'Värde': pd.DataFrame(values, index=years, columns=VALUE_COLUMNS),
+            'Förändring': pd.DataFrame(self.yoy_delta[idx, account], index=years, columns=VALUE_COLUMNS),
+            'Tillväxt (%)': pd.DataFrame(self.yoy_growth[idx, account], index=years, columns=VALUE_COLUMNS),
+        }
+
+    def get_yoy_accounts(self, sheet_name, column='Totalt'):
+        """Returnerar årsförändring per konto för en flik jämfört med föregående år"""
+        sheet_idx = self.get_sheet_position(sheet_name)
+        previous = self.previous_sheet[sheet_idx]
+        if previous < 0:
+            return None
+        col = VALUE_COLUMNS.index(column)
+        accounts = np.flatnonzero(self.cube_mask[sheet_idx] | self.cube_mask[previous])
+        return pd.DataFrame({
+            'Konto': [self.account_labels[i] for i in accounts],
+            'I år': self.cube[sheet_idx, accounts, col],
+            'Föregående år': self.cube[previous, accounts, col],
+            'Förändring': self.yoy_delta[sheet_idx, accounts, col],
+            'Tillväxt (%)': self.yoy_growth[sheet_idx, accounts, col],
+        })
+
     def get_raw_data(self, sheet_name):
         """Returnerar rå data från Excel för en specifik flik"""
+        if sheet_name not in self.data and sheet_name in self.values:
+            # Ansluten snapshot: rådata återskapas från etiketter och matris vid behov,
+            # med svenska decimaltecken som i arbetsboken
+            numbers = pd.DataFrame(self.values[sheet_name], columns=VALUE_COLUMNS)
+            frame = numbers.astype(str).apply(lambda col: col.str.replace('.', ',', regex=False))
+            frame = frame.where(numbers.notna())
+            frame.insert(0, 'Kategori', [label or np.nan for label in self.labels[sheet_name]])
+            self.data[sheet_name] = frame
         if sheet_name in self.data:
             return self.data[sheet_name]
         return None
 
+    def get_default_row_types(self, sheet_name):
+        """
+        Standardtyp per rad för redigering: konton före intäktssumman är intäkter,
+        konton mellan intäktssumman och BERÄKNAT RESULTAT är kostnader, övriga Auto
+        """
+        types = []
+        found_revenue_summa = False
+        found_result = False
+        for label in self.labels.get(sheet_name, []):
+            role = self.rules.role(label)
+            if role == 'revenue_total':
+                found_revenue_summa = True
+            elif role == 'net_result':
+                found_result = True
+            if role != 'account' or not label:
+                types.append('Auto')
+            elif not found_revenue_summa:
+                types.append('Intäkt')
+            elif not found_result:
+                types.append('Kostnad')
+            else:
+                types.append('Auto')
+        return types
+
+    def get_editable_base(self, sheet_name):
+        """
+        Delad basram för redigering: rådata plus Typ och Exkludera. Byggs en gång
+        per flik och får inte ändras - ändringar läggs i ett EditOverlay.
+        """
+        if sheet_name not in self.editable_bases:
+            raw_data = self.get_raw_data(sheet_name)
+            if raw_data is None:
+                return None
+            base = raw_data.copy()
+            base['Typ'] = self.get_default_row_types(sheet_name)
+            base['Exkludera'] = False
+            self.editable_bases[sheet_name] = base
+        return self.editable_bases[sheet_name]
+
+    def get_edit_overlay(self, sheet_name, edits=None):
+        """Returnerar ett redigeringslager över flikens delade basram"""
+        from edit_overlay import EditOverlay
+        
+        base = self.get_editable_base(sheet_name)
+        if base is None:
+            return None
+        return EditOverlay(base, edits, self.values.get(sheet_name))
+
     def get_processed_data(self, sheet_name):
         """Returnerar bearbetad data för en specifik flik"""
         if sheet_name in self.processed_data:
             return self.processed_data[sheet_name]
         return None
 
+    def write_snapshot(self, directory=None):
+        """Skriver talmatriserna som binär snapshot, se binary_snapshot.write_snapshot"""
+        from binary_snapshot import DEFAULT_SNAPSHOT_DIR, write_snapshot
+        
+        return write_snapshot(self, directory or DEFAULT_SNAPSHOT_DIR)
+
+    def attach_snapshot(self, snapshot):
+        """
+        Ansluter till en binär snapshot i stället för att läsa Excel. Matriser och
+        kontokub är skrivskyddade minnesmappade vyer; bara regelberoende delar
+        (nyckeltal, kontoträd, avstämning) räknas om. Sökindex byggs vid första sökning.
+        """
+        meta = snapshot.meta
+        self.snapshot_version = snapshot.version
+        self.excel_file_path = meta['excel_file_path']
+        self.available_sheets = list(meta['available_sheets'])
+        self.excel_row_offsets = dict(meta['excel_row_offsets'])
+        self.labels = {sheet: list(labels) for sheet, labels in meta['labels'].items()}
+        self.values = snapshot.sheet_rows('values')
+        self.row_accounts = snapshot.sheet_rows('row_accounts')
+        
+        sheets = list(meta['sheets'])
+        self.sheet_index = sheet_multi_index(sheets)
+        self.sheet_names = sheets
+        self.sheet_positions = {sheet: idx for idx, sheet in enumerate(sheets)}
+        self.account_labels = list(meta['account_labels'])
+        self.account_positions = {normalize_label(label): idx for idx, label in enumerate(self.account_labels)}
+        for name in ('cube', 'cube_mask', 'previous_sheet', 'yoy_delta', 'yoy_growth'):
+            setattr(self, name, snapshot.arrays[name])
+        
+        self.build_kpi_table()
+        self.build_account_trees()
+        self.build_period_pyramid()
+        self.run_reconciliation()
+        self.consolidations = {}
+        self.search_index = None
+        self.forecasts = {}
+        self.simulations = {}
+        self.anomalies = None
+        self.kpi_inputs = None
+        self.custom_kpis = {}
+        self.editable_bases = {}
+        print(f"✅ Anslöt till snapshot {snapshot.version[:12]} med {len(sheets)} flikar")
+        return self
+
+    def get_previous_snapshots(self, directory=None):
+        """Sparade snapshots av andra versioner än den inlästa, nyaste först"""
+        from binary_snapshot import DEFAULT_SNAPSHOT_DIR, list_snapshots
+        
+        return [snapshot for snapshot in list_snapshots(directory or DEFAULT_SNAPSHOT_DIR)
+                if snapshot['version'] != self.snapshot_version]
+
+    def get_snapshot_diff(self, previous_version, directory=None):
+        """
+        Skillnader mot en tidigare snapshot (se snapshot_diff.SnapshotDiff),
+        None om den inte finns. Den tidigare versionen ansluts skrivskyddat.
+        """
+        from binary_snapshot import DEFAULT_SNAPSHOT_DIR, attach_snapshot
+        from snapshot_diff import diff_snapshots
+        
+        key = (self.snapshot_version, previous_version)
+        if key not in self.snapshot_diffs:
+            previous = attach_snapshot(directory or DEFAULT_SNAPSHOT_DIR, previous_version)
+            if previous is None:
+                return None
+            self.snapshot_diffs[key] = diff_snapshots(previous, self)
+        return self.snapshot_diffs[key]
+
+    def freeze(self):
+        """
+        Gör förberäknade arrayer skrivskyddade så att en delad instans kan läsas
+        från flera sessioner samtidigt utan att någon av misstag ändrar den
+        """
+        arrays = list(self.values.values())
+        arrays += [self.cube, self.cube_mask, self.previous_sheet, self.yoy_delta, self.yoy_growth,
+                   self.key_series, self.active_months, self.closed_months,
+                   self.period_cube, self.period_key_series]
+        for tree in self.account_trees.values():
+            arrays += [tree.leaf_values, tree.prefix]
+        for array in arrays:
+            if isinstance(array, np.ndarray):
+                array.setflags(write=False)
+        self.frozen = True
+        return self
+
     def print_data_summary(self):
         """Skriver ut en sammanfattning av inläst data"""
         print(f"\n📊 DATASAMMANFATTNING:")
@@ -148,4 +1147,101 @@ class FinancialAnalyzer:
                 for i, (category, row) in enumerate(df.head(3).iterrows()):
                     print(f"    {category}: {dict(row)}")
                     if i >= 2:
-                        break
\ No newline at end of file
+                        break
+
+
+# Processgemensam analysator: (stat-nyckel, (snapshotversion, konfigurationsfiler), instans).
+# Tupeln byts ut i en enda tilldelning så att läsare alltid ser en hel instans.
+_shared_lock = threading.Lock()
+_shared_state = (None, None, None)
+
+
+def data_version(sha1, consolidation=None, rules=None):
+    """
+    Datasnapshotens version för en arbetsbok: filens SHA1, kombinerad med
+    konsolideringsfilens version när koncernflikar räknas fram. Koncernflikarnas
+    layout följer kontoreglerna, så då ingår även regelfilens version.
+    """
+    if consolidation is None:
+        return sha1
+    rules_version = rules.version if rules is not None else ''
+    return hashlib.sha1(f'{sha1}:{consolidation.version}:{rules_version}'.encode()).hexdigest()
+
+
+def workbook_stat(path):
+    """Billigt fingeravtryck för Excel-filen: sökväg, storlek och ändringstid"""
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def file_stat(path):
+    """Som workbook_stat men för konfigurationsfiler som kan saknas (storlek och tid blir None)"""
+    if not os.path.exists(path):
+        return os.path.abspath(path), None, None
+    return workbook_stat(path)
+
+
+def config_stat(rules_path=None):
+    """Fingeravtryck för regel-, konsoliderings- och nyckeltalsfilerna som påverkar analysatorn"""
+    from account_rules import DEFAULT_RULES_FILE
+    from consolidation import DEFAULT_CONSOLIDATION_FILE
+    from kpi_expressions import DEFAULT_KPI_FILE
+    
+    return file_stat(rules_path or DEFAULT_RULES_FILE) + file_stat(DEFAULT_CONSOLIDATION_FILE) \
+        + file_stat(DEFAULT_KPI_FILE)
+
+
+def get_shared_analyzer(excel_file_path=None, rules_path=None, reload=False, use_snapshot=True):
+    """
+    Returnerar en skrivskyddad FinancialAnalyzer som delas av alla sessioner i
+    processen. Filen läses bara om när dess fingeravtryck eller regel-,
+    konsoliderings- och nyckeltalsfilernas fingeravtryck ändras: först jämförs
+    storlek och ändringstid, därefter innehållets SHA1 så att en ändrad tidsstämpel
+    utan nytt innehåll inte ger en ny inläsning. Bara en tråd läser in åt gången,
+    övriga väntar och får samma instans.
+    
+    Med use_snapshot ansluter processen till en binär snapshot av samma version
+    om en annan process redan har skrivit den, annars läses Excel och snapshoten
+    skrivs. Flera arbetsprocesser delar då talmatriserna via sidcachen. Versionen
+    omfattar regel- och konsolideringsfilernas innehåll, så en ändrad regelfil
+    ansluter aldrig till en snapshot med gamla koncernflikar.
+    """
+    global _shared_state
+    from consolidation import load_consolidation
+    
+    path = excel_file_path or find_financial_file()
+    if not path or not os.path.exists(path):
+        raise Exception(f"Excel-fil hittades inte: {path}")
+    configs = config_stat(rules_path)
+    stat_key = workbook_stat(path) + configs
+    
+    key, version, analyzer = _shared_state
+    if key == stat_key and not reload:
+        return analyzer
+    
+    with _shared_lock:
+        key, version, analyzer = _shared_state
+        if key == stat_key and not reload:
+            return analyzer
+        sha1 = data_version(file_sha1(path), load_consolidation(), get_account_rules(rules_path))
+        if reload or analyzer is None or version != (sha1, configs):
+            analyzer = _load_shared(path, sha1, rules_path, use_snapshot and not reload).freeze()
+        _shared_state = (stat_key, (analyzer.snapshot_version, configs), analyzer)
+        return analyzer
+
+
+def _load_shared(path, sha1, rules_path, use_snapshot):
+    """Ansluter till en befintlig snapshot för filens SHA1, annars läses Excel och snapshoten skrivs"""
+    if not use_snapshot:
+        return FinancialAnalyzer(path, rules_path=rules_path)
+    from binary_snapshot import attach_snapshot
+    
+    snapshot = attach_snapshot(version=sha1)
+    if snapshot is not None:
+        return FinancialAnalyzer(path, rules_path=rules_path, snapshot=snapshot)
+    analyzer = FinancialAnalyzer(path, rules_path=rules_path)
+    try:
+        analyzer.write_snapshot()
+    except OSError as e:
+        print(f"⚠️ Kunde inte skriva snapshot: {e}")
+    return analyzer
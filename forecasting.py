@@ -0,0 +1,73 @@
+"""
+Prognoser - batchade NumPy-prognoser för månader som ännu inte stängts
+"""
+import numpy as np
+
+FORECAST_METHODS = ['Säsongsnaiv', 'Linjär trend', 'Exponentiell utjämning']
+
+
+def closed_month_counts(active_months):
+    """Antal stängda månader per flik = sista månaden med aktivitet"""
+    n_months = active_months.shape[1]
+    last_active = n_months - 1 - np.argmax(active_months[:, ::-1], axis=1)
+    return np.where(active_months.any(axis=1), last_active + 1, 0)
+
+
+def seasonal_naive(values, closed_mask, previous_values=None):
+    """Samma månad föregående år, annars senast stängda månad"""
+    last = _last_closed(values, closed_mask)
+    if previous_values is None:
+        return np.broadcast_to(last[..., None], values.shape).copy()
+    has_previous = ~np.isnan(previous_values).all(axis=-1, keepdims=True)
+    return np.where(has_previous, np.nan_to_num(previous_values), last[..., None])
+
+
+def linear_trend(values, closed_mask):
+    """Minstakvadratlinje över stängda månader, sluten form för alla serier samtidigt"""
+    t = np.arange(values.shape[-1], dtype=float)
+    w = closed_mask[:, None, :].astype(float)
+    n = np.maximum(w.sum(axis=-1, keepdims=True), 1)
+    t_mean = (w * t).sum(axis=-1, keepdims=True) / n
+    y_mean = (w * values).sum(axis=-1, keepdims=True) / n
+    sxx = (w * (t - t_mean) ** 2).sum(axis=-1, keepdims=True)
+    sxy = (w * (t - t_mean) * (values - y_mean)).sum(axis=-1, keepdims=True)
+    slope = np.divide(sxy, sxx, out=np.zeros_like(sxy), where=sxx > 0)
+    return y_mean + slope * (t - t_mean)
+
+
+def exponential_smoothing(values, closed_mask, alpha=0.4):
+    """Enkel exponentiell utjämning - loopar över tidsaxeln, vektoriserat över alla serier"""
+    level = values[..., 0].copy()
+    for month in range(1, values.shape[-1]):
+        update = closed_mask[:, month][:, None]
+        level = np.where(update, alpha * values[..., month] + (1 - alpha) * level, level)
+    return np.broadcast_to(level[..., None], values.shape).copy()
+
+
+def _last_closed(values, closed_mask):
+    """Värdet för sista stängda månaden per serie"""
+    n_closed = closed_mask.sum(axis=1)
+    last = np.maximum(n_closed - 1, 0)
+    return np.take_along_axis(values, last[:, None, None].repeat(values.shape[1], axis=1), axis=-1)[..., 0]
+
+
+def forecast(values, n_closed, method='Säsongsnaiv', previous_values=None):
+    """
+    Prognostiserar öppna månader för en array (flik, serie, månad). Stängda
+    månader och flikar utan stängda månader blir NaN i resultatet.
+    """
+    values = np.nan_to_num(np.asarray(values, dtype=float))
+    n_months = values.shape[-1]
+    closed_mask = np.arange(n_months)[None, :] < np.asarray(n_closed)[:, None]
+
+    if method == 'Säsongsnaiv':
+        result = seasonal_naive(values, closed_mask, previous_values)
+    elif method == 'Linjär trend':
+        result = linear_trend(values, closed_mask)
+    elif method == 'Exponentiell utjämning':
+        result = exponential_smoothing(values, closed_mask)
+    else:
+        raise ValueError(f"Okänd prognosmetod: {method}")
+
+    open_mask = ~closed_mask & (np.asarray(n_closed) > 0)[:, None]
+    return np.where(open_mask[:, None, :], result, np.nan)
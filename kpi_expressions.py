@@ -0,0 +1,269 @@
+"""
+Egna nyckeltal - uttryck över nyckelrader, rapportgrupper och konton som tolkas
+och valideras en gång och räknas för alla flikar och perioder i ett vektoriserat pass
+"""
+import ast
+import json
+import os
+import re
+
+import numpy as np
+
+from financial_analyzer import MONTHS, PERIOD_LEVELS, file_stat, normalize_label
+
+DEFAULT_KPI_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kpi_definitions.json')
+
+# Nyckelrader som namn i uttryck, i samma ordning som analysatorns nyckelserier.
+# Intäkter är alltid positiva, kostnader och resultat behåller sitt tecken.
+KEY_NAMES = ['Intäkter', 'Kostnader', 'Nettoresultat']
+
+# Antal månader i perioden, t.ex. för snitt per månad
+MONTHS_NAME = 'Månader'
+
+BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+    ast.Pow: np.power,
+}
+UNARY_OPERATORS = {ast.USub: np.negative, ast.UAdd: np.positive}
+
+# Funktion -> (antal argument, numpy-funktion). föregående slår upp föregående års flik.
+FUNCTIONS = {
+    'abs': (1, np.abs),
+    'min': (2, np.fmin),
+    'max': (2, np.fmax),
+    'föregående': (1, None),
+}
+
+# Referenser med etikett som sträng, för namn som inte är giltiga identifierare
+REFERENCE_FUNCTIONS = {'grupp': 'group', 'konto': 'account'}
+
+
+class KpiExpressionError(ValueError):
+    """Uttrycket går inte att tolka eller refererar till något som saknas"""
+
+
+def group_identifier(group):
+    """Rapportgruppens namn i uttryck: 'Råvaror och förnödenheter' -> 'Råvaror_och_förnödenheter'"""
+    return re.sub(r'\W+', '_', group).strip('_')
+
+
+def available_names(groups):
+    """Namn som kan användas direkt i uttryck, för hjälptexter"""
+    return KEY_NAMES + [MONTHS_NAME] + [group_identifier(group) for group in groups
+                                        if group_identifier(group) not in KEY_NAMES]
+
+
+class KpiExpression:
+    """
+    Tolkat och validerat uttryck. Syntaxträdet kompileras till en kedja av
+    numpy-operationer som tar emot hela (flik, period)-arrayer, så att ett
+    anrop räknar nyckeltalet för alla flikar och perioder samtidigt.
+
+    Namn: nyckelraderna (Intäkter, Kostnader, Nettoresultat), rapportgrupper
+    med understreck i stället för mellanslag och Månader. Nyckelraderna går
+    före rapportgrupper med samma namn; grupp("Intäkter") ger gruppen och
+    konto("etikett") ett enskilt konto.
+    """
+
+    def __init__(self, text, groups):
+        self.text = str(text).strip()
+        self.names = {group_identifier(group): group for group in groups}
+        self.groups = set(groups)
+        self.references = set()
+        try:
+            tree = ast.parse(self.text, mode='eval')
+        except SyntaxError as e:
+            raise KpiExpressionError(f"Syntaxfel i '{self.text}' vid position {e.offset}: {e.msg}") from None
+        self.function = self._compile(tree.body)
+
+    def _error(self, node, message):
+        return KpiExpressionError(f"{message} vid position {node.col_offset + 1} i '{self.text}'")
+
+    def _reference(self, node, reference):
+        self.references.add(reference)
+        return lambda inputs: inputs.value(reference)
+
+    def _compile(self, node):
+        """Kompilerar en nod till en funktion av KpiInputs"""
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise self._error(node, f"Otillåten konstant {node.value!r}")
+            value = float(node.value)
+            return lambda inputs: value
+
+        if isinstance(node, ast.Name):
+            if node.id in KEY_NAMES:
+                return self._reference(node, ('key', KEY_NAMES.index(node.id)))
+            if node.id == MONTHS_NAME:
+                return self._reference(node, ('months', None))
+            if node.id in self.names:
+                return self._reference(node, ('group', self.names[node.id]))
+            raise self._error(node, f"Okänt namn '{node.id}'")
+
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            operator = BINARY_OPERATORS[type(node.op)]
+            left, right = self._compile(node.left), self._compile(node.right)
+            return lambda inputs: operator(left(inputs), right(inputs))
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            operator = UNARY_OPERATORS[type(node.op)]
+            operand = self._compile(node.operand)
+            return lambda inputs: operator(operand(inputs))
+
+        if isinstance(node, ast.Call):
+            return self._compile_call(node)
+
+        raise self._error(node, f"Otillåtet i uttryck: {type(node).__name__}")
+
+    def _compile_call(self, node):
+        name = node.func.id if isinstance(node.func, ast.Name) else None
+        if node.keywords:
+            raise self._error(node, "Namngivna argument stöds inte")
+
+        if name in REFERENCE_FUNCTIONS:
+            if len(node.args) != 1 or not isinstance(node.args[0], ast.Constant) \
+                    or not isinstance(node.args[0].value, str):
+                raise self._error(node, f'{name}() tar en etikett inom citattecken, t.ex. {name}("...")')
+            label = node.args[0].value.strip()
+            if REFERENCE_FUNCTIONS[name] == 'group':
+                if label not in self.groups:
+                    raise self._error(node, f"Okänd rapportgrupp '{label}'")
+                return self._reference(node, ('group', label))
+            return self._reference(node, ('account', normalize_label(label)))
+
+        if name not in FUNCTIONS:
+            raise self._error(node, f"Okänd funktion '{name or ast.unparse(node.func)}'")
+        n_args, function = FUNCTIONS[name]
+        if len(node.args) != n_args:
+            raise self._error(node, f"{name}() tar {n_args} argument")
+        args = [self._compile(arg) for arg in node.args]
+        if function is None:
+            operand = args[0]
+            return lambda inputs: inputs.previous(operand(inputs))
+        return lambda inputs: function(*(arg(inputs) for arg in args))
+
+    @property
+    def accounts(self):
+        """Normaliserade kontoetiketter som uttrycket refererar till"""
+        return {key for kind, key in self.references if kind == 'account'}
+
+
+class KpiDefinition:
+    """Ett namngivet nyckeltal: uttryck, enhet och beskrivning"""
+
+    def __init__(self, name, expression, groups, unit='', description=''):
+        self.name = str(name).strip()
+        if not self.name:
+            raise KpiExpressionError("Nyckeltalet saknar namn")
+        self.expression = KpiExpression(expression, groups)
+        self.unit = unit or ''
+        self.description = description or ''
+
+    @property
+    def text(self):
+        return self.expression.text
+
+
+_loaded_definitions = {}
+
+
+def load_kpi_definitions(groups, path=None):
+    """
+    Läser och validerar definitionsfilen en gång per process, filversion och
+    regeluppsättning, tom lista om filen saknas. Ett ogiltigt uttryck i filen är ett fel.
+    """
+    path = os.path.abspath(path or DEFAULT_KPI_FILE)
+    cache_key = file_stat(path) + tuple(groups)
+    if cache_key not in _loaded_definitions:
+        definitions = []
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                config = json.load(f)
+            definitions = [KpiDefinition(kpi['name'], kpi['expression'], groups,
+                                         kpi.get('unit', ''), kpi.get('description', ''))
+                           for kpi in config.get('kpis', [])]
+        _loaded_definitions[cache_key] = definitions
+    return _loaded_definitions[cache_key]
+
+
+class KpiInputs:
+    """
+    Allt ett uttryck kan referera till, som (flik, period)-arrayer över hela
+    periodpyramiden: nyckelrader, rapportgrupper (summa av kontoträdens löv)
+    och enskilda konton. Byggs en gång per datasnapshot.
+    """
+
+    def __init__(self, analyzer):
+        self.sheet_positions = analyzer.sheet_positions
+        self.account_positions = analyzer.account_positions
+        self.previous_sheet = np.asarray(analyzer.previous_sheet)
+        self.key_series = analyzer.period_key_series
+        self.period_cube = analyzer.period_cube
+        self.shape = (len(analyzer.sheet_names), self.period_cube.shape[2])
+        self.months = np.concatenate([np.full(len(labels), len(MONTHS) // len(labels), dtype=float)
+                                      for labels in PERIOD_LEVELS.values()])
+
+        # Rapportgrupp per (flik, konto) för lövkonton, -1 för summeringar, saknade konton
+        # och grupper som inte får stå på den sida (intäkter/kostnader) där lövet står
+        rules = analyzer.rules
+        self.groups = list(rules.groups)
+        group_ids = np.full(self.period_cube.shape[:2], -1)
+        for sheet, position in self.sheet_positions.items():
+            tree = analyzer.account_trees[sheet]
+            rows = np.array([tree.rows[node] for node in tree.leaf_nodes], dtype=int)
+            if not len(rows):
+                continue
+            accounts = np.asarray(analyzer.row_accounts[sheet])[rows]
+            row_groups = analyzer.row_groups[sheet]
+            key_rows = analyzer.key_rows.get(sheet, {})
+            sides = tree.node_sides(key_rows.get('revenue'), key_rows.get('expenses'))
+            ids = np.array([self.groups.index(row_groups[row])
+                            if row_groups[row] in self.groups and rules.allows(row_groups[row], sides[node]) else -1
+                            for node, row in zip(tree.leaf_nodes, rows)])
+            valid = accounts >= 0
+            group_ids[position, accounts[valid]] = ids[valid]
+        members = group_ids[:, :, None] == np.arange(len(self.groups))
+        # (flik, grupp, period)
+        self.group_series = np.einsum('sap,sag->sgp', self.period_cube, members.astype(float))
+
+    def value(self, reference):
+        """(flik, period)-array för en referens"""
+        kind, key = reference
+        if kind == 'key':
+            return self.key_series[:, key]
+        if kind == 'group':
+            return self.group_series[:, self.groups.index(key)]
+        if kind == 'months':
+            return self.months
+        if key not in self.account_positions:
+            raise KpiExpressionError(f"Kontot '{key}' finns inte i någon flik")
+        return self.period_cube[:, self.account_positions[key]]
+
+    def previous(self, values):
+        """Samma period föregående år för varje flik, NaN där föregående års flik saknas"""
+        values = np.broadcast_to(values, self.shape)
+        has_previous = self.previous_sheet >= 0
+        return np.where(has_previous[:, None], values[np.where(has_previous, self.previous_sheet, 0)], np.nan)
+
+    def check(self, expression):
+        """Kastar KpiExpressionError om uttrycket refererar till konton som saknas i snapshoten"""
+        missing = sorted(expression.accounts - set(self.account_positions))
+        if missing:
+            raise KpiExpressionError(f"Kontot '{missing[0]}' finns inte i någon flik")
+
+
+def evaluate_kpis(inputs, expressions):
+    """
+    Räknar uttrycken över alla flikar och perioder. Division med noll och
+    andra odefinierade värden blir NaN. Returnerar (uttryck, flik, period).
+    """
+    result = np.empty((len(expressions),) + inputs.shape)
+    with np.errstate(all='ignore'):
+        for i, expression in enumerate(expressions):
+            result[i] = np.broadcast_to(expression.function(inputs), inputs.shape)
+    result[~np.isfinite(result)] = np.nan
+    return result
+
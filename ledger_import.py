@@ -0,0 +1,199 @@
+"""
+Huvudboksimport - läser stora huvudboksexporter (CSV) i block och summerar till konton × månader
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from financial_analyzer import MONTHS, FinancialAnalyzer, build_sheet_layout
+
+DEFAULT_CHUNK_SIZE = 500_000
+
+# Datumformat i exporten. Ett fast format tolkas vektoriserat och lika i alla block;
+# None låter pandas gissa formatet från första raden i varje block.
+DEFAULT_DATE_FORMAT = '%Y-%m-%d'
+
+# Standardnamn på kolumnerna i exporten
+DEFAULT_COLUMNS = {'date': 'date', 'account': 'account', 'amount': 'amount', 'cost_center': 'cost_center'}
+
+# Resultatkonton enligt BAS - balanskonton hör inte till resultaträkningen
+RESULT_ACCOUNTS = (3000, 8999)
+
+
+class LedgerAggregator:
+    """
+    Summerar huvudboksrader till belopp per (år, konto, kostnadsställe) × månad.
+    Varje block faktoriseras till nycklar och summeras med en enda bincount;
+    minnet växer med antalet unika nycklar, inte med antalet rader.
+    """
+
+    def __init__(self, by_cost_center=False, date_format=DEFAULT_DATE_FORMAT):
+        self.by_cost_center = by_cost_center
+        self.date_format = date_format
+        self.keys = {}
+        self.key_list = []
+        self.sums = np.zeros((0, len(MONTHS)))
+        self.n_rows = 0
+        self.n_skipped = 0
+
+    def _key_ids(self, uniques):
+        """Globala nyckel-id:n för ett blocks unika nycklar, nya nycklar läggs till"""
+        ids = np.empty(len(uniques), dtype=np.int64)
+        for i, key in enumerate(uniques):
+            key_id = self.keys.get(key)
+            if key_id is None:
+                key_id = self.keys[key] = len(self.key_list)
+                self.key_list.append(key)
+            ids[i] = key_id
+        if len(self.key_list) > len(self.sums):
+            # Väx med marginal så att nya konton inte kräver omallokering varje block
+            grown = np.zeros((max(len(self.key_list), 2 * len(self.sums)), len(MONTHS)))
+            grown[:len(self.sums)] = self.sums
+            self.sums = grown
+        return ids
+
+    def feed(self, dates, accounts, amounts, cost_centers=None):
+        """Tar emot ett block som kolumnvektorer"""
+        self.n_rows += len(amounts)
+        dates = pd.to_datetime(dates, format=self.date_format, errors='coerce')
+        accounts = pd.to_numeric(accounts, errors='coerce')
+        amounts = pd.to_numeric(amounts, errors='coerce')
+        valid = (dates.notna() & accounts.notna() & amounts.notna()
+                 & (accounts >= RESULT_ACCOUNTS[0]) & (accounts <= RESULT_ACCOUNTS[1]))
+        valid = np.asarray(valid)
+        self.n_skipped += int((~valid).sum())
+        if not valid.any():
+            return
+
+        dates = pd.DatetimeIndex(dates[valid])
+        years = dates.year.to_numpy()
+        months = dates.month.to_numpy() - 1
+        accounts = np.asarray(accounts[valid], dtype=np.int64)
+        amounts = np.asarray(amounts[valid], dtype=float)
+
+        # Heltalsnyckel per rad - faktorisering av heltal är betydligt snabbare än av tupler
+        composite = years * 10_000 + accounts
+        centers = np.array([''], dtype=object)
+        if self.by_cost_center and cost_centers is not None:
+            center_codes, centers = pd.factorize(pd.Series(cost_centers)[valid].fillna('').astype(str))
+            composite = composite * len(centers) + center_codes
+        codes, uniques = pd.factorize(composite)
+        keys = []
+        for unique in uniques.tolist():
+            unique, center = divmod(unique, len(centers))
+            year, account = divmod(unique, 10_000)
+            keys.append((year, account, centers[center]) if self.by_cost_center else (year, account))
+        ids = self._key_ids(keys)[codes]
+
+        # Grupperad scatter-add: en platt bincount över (nyckel, månad)
+        flat = ids * len(MONTHS) + months
+        counts = np.bincount(flat, weights=amounts, minlength=len(self.key_list) * len(MONTHS))
+        self.sums[:len(self.key_list)] += counts.reshape(-1, len(MONTHS))
+
+    def matrices(self):
+        """
+        Returnerar {(år, kostnadsställe): (konton, matris)} där kostnadsställe är
+        None utan uppdelning. Matrisen är i kronor med huvudbokens tecken.
+        """
+        grouped = {}
+        for key_id, key in enumerate(self.key_list):
+            year, account = key[0], key[1]
+            cost_center = key[2] if len(key) > 2 else None
+            grouped.setdefault((year, cost_center), []).append((account, key_id))
+        result = {}
+        for group, members in sorted(grouped.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            members.sort()
+            accounts = [account for account, _ in members]
+            result[group] = (accounts, self.sums[[key_id for _, key_id in members]])
+        return result
+
+
+def read_ledger(path, columns=None, chunk_size=DEFAULT_CHUNK_SIZE, by_cost_center=False,
+                sep=',', decimal='.', encoding='utf-8', date_format=DEFAULT_DATE_FORMAT):
+    """Läser en huvudboksexport blockvis och returnerar aggregatorn"""
+    columns = {**DEFAULT_COLUMNS, **(columns or {})}
+    usecols = [columns['date'], columns['account'], columns['amount']]
+    if by_cost_center:
+        usecols.append(columns['cost_center'])
+
+    aggregator = LedgerAggregator(by_cost_center, date_format)
+    reader = pd.read_csv(path, usecols=usecols, chunksize=chunk_size, sep=sep, decimal=decimal,
+                         encoding=encoding)
+    for chunk in reader:
+        aggregator.feed(
+            chunk[columns['date']],
+            chunk[columns['account']],
+            chunk[columns['amount']],
+            chunk[columns['cost_center']] if by_cost_center else None,
+        )
+    return aggregator
+
+
+def ledger_sheets(aggregator, company, account_names=None, scale=1000.0):
+    """
+    Bygger {fliknamn: (etiketter, matris)} i rapporttecken och tSEK. Med
+    kostnadsställen blir varje ställe ett eget "företag", t.ex. "KLAB KS10 2024".
+    """
+    account_names = account_names or {}
+    sheets = {}
+    for (year, cost_center), (accounts, matrix) in aggregator.matrices().items():
+        name = f'{company} {cost_center} {year}' if cost_center else f'{company} {year}'
+        labels = [f'{account} {account_names.get(account, "")}'.strip() for account in accounts]
+        # Huvudboken har debet positivt - intäkter vänds till positiva som i arbetsboken
+        sheets[name] = (labels, -matrix / scale + 0.0)
+    return sheets
+
+
+def import_ledger(path, company, analyzer=None, account_names=None, **kwargs):
+    """
+    Läser en huvudboksexport och registrerar resultatet som flikar i analysatorn.
+    Returnerar (flikar, aggregator, rader per sekund).
+    """
+    start = time.perf_counter()
+    aggregator = read_ledger(path, **kwargs)
+    elapsed = time.perf_counter() - start
+    rows_per_second = aggregator.n_rows / elapsed if elapsed > 0 else float('inf')
+
+    sheets = ledger_sheets(aggregator, company, account_names)
+    if analyzer is not None and sheets:
+        analyzer.register_sheets({
+            name: build_sheet_layout(labels, matrix, analyzer.rules)
+            for name, (labels, matrix) in sheets.items()
+        })
+    return sheets, aggregator, rows_per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Importera huvudboksexport (CSV) till månadsmatriser')
+    parser.add_argument('path', help='CSV-fil med datum, konto, belopp och ev. kostnadsställe')
+    parser.add_argument('--company', required=True, help='Företagsnamn i fliknamnet')
+    parser.add_argument('--cost-centers', action='store_true', help='En flik per kostnadsställe')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--sep', default=',')
+    parser.add_argument('--decimal', default='.')
+    parser.add_argument('--encoding', default='utf-8')
+    parser.add_argument('--date-format', default=DEFAULT_DATE_FORMAT,
+                        help='strftime-format för datumkolumnen, t.ex. %%d/%%m/%%Y')
+    for key, default in DEFAULT_COLUMNS.items():
+        parser.add_argument(f'--{key.replace("_", "-")}-column', dest=key, default=default)
+    args = parser.parse_args()
+
+    columns = {key: getattr(args, key) for key in DEFAULT_COLUMNS}
+    analyzer = FinancialAnalyzer()
+    sheets, aggregator, rows_per_second = import_ledger(
+        args.path, args.company, analyzer,
+        columns=columns, chunk_size=args.chunk_size, by_cost_center=args.cost_centers,
+        sep=args.sep, decimal=args.decimal, encoding=args.encoding, date_format=args.date_format,
+    )
+    print(f"📥 {aggregator.n_rows:,} rader ({aggregator.n_skipped:,} överhoppade), "
+          f"{len(aggregator.key_list):,} nycklar, {rows_per_second:,.0f} rader/s")
+    for sheet_name in sheets:
+        kpis = analyzer.get_kpis(sheet_name)
+        print(f"  {sheet_name}: intäkter {kpis['Intäkter']:,.1f}, kostnader {kpis['Kostnader']:,.1f}, "
+              f"resultat {kpis['Nettoresultat']:,.1f} tSEK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Lasttest - samtidiga dashboardsessioner via Streamlits testramverk (AppTest): latens, minne och mättnadspunkt
+
+Varje session kör dashboard.main() huvudlöst i en egen AppTest och går igenom
+ett realistiskt flöde: inloggning, lägesbyten, jämförelseval och celländringar.
+Sessionerna körs samtidigt i trådar, på flera nivåer av samtidighet, och varje
+interaktion tidmäts för sig.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Samma ingång som vid driftsättning, den anropar dashboard.main(). Skriptets
+# katalog ligger redan i sys.path, så samtidiga körningar behöver inte ändra den.
+APP_SCRIPT = os.path.join(REPO_DIR, 'streamlit_app.py')
+
+DEFAULT_LEVELS = [1, 2, 4, 8]
+DEFAULT_TIMEOUT = 120
+
+# Lokala standardinloggningen i check_password, kan ersättas via miljön
+DEFAULT_USERNAME = os.environ.get('LOADTEST_USERNAME', 'Admin')
+DEFAULT_PASSWORD = os.environ.get('LOADTEST_PASSWORD', 'Sention1!')
+
+# Mättnad: genomströmningen ökar mindre än så när antalet sessioner fördubblas
+SATURATION_GAIN = 0.10
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def current_rss():
+    """Processens residenta minne i byte (toppvärdet om /proc saknas)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _quiet_streamlit():
+    """
+    Sessionerna körs utan Streamlit-server. Varningar om saknad kontext och
+    utfasningar skulle skrivas vid varje omkörning; AppTest återställer
+    Streamlits loggnivåer per körning, så varningar stängs av för hela processen.
+    Fel loggas fortfarande.
+    """
+    logging.disable(logging.WARNING)
+
+
+class DashboardSession:
+    """
+    En simulerad användare. Varje interaktion ändrar widgetar eller sessionens
+    tillstånd och kör om skriptet; tiden är en hel omkörning som användaren
+    skulle vänta på den.
+    """
+
+    def __init__(self, session_id, username=DEFAULT_USERNAME, password=DEFAULT_PASSWORD,
+                 timeout=DEFAULT_TIMEOUT, seed=0):
+        from streamlit.testing.v1 import AppTest
+
+        self.session_id = session_id
+        self.username = username
+        self.password = password
+        self.rng = random.Random(seed + session_id)
+        self.app = AppTest.from_file(APP_SCRIPT, default_timeout=timeout)
+        self.records = []
+
+    def _timed(self, interaction, action):
+        """Kör en interaktion och sparar (session, interaktion, sekunder, fel)"""
+        start = time.perf_counter()
+        try:
+            action()
+            error = [str(exception.value) for exception in self.app.exception]
+        except Exception as e:
+            error = [f'{type(e).__name__}: {e}']
+        elapsed = time.perf_counter() - start
+        self.records.append((self.session_id, interaction, elapsed, '; '.join(error)))
+
+    def login(self):
+        """Inloggning via check_password: tomt formulär, användarnamn och lösenord"""
+        app = self.app
+        self._timed('Startsida', app.run)
+        app.text_input(key='username_input').input(self.username)
+        self._timed('Inloggning', lambda: app.text_input(key='password_input').input(self.password).run())
+
+    def switch_mode(self, mode):
+        self._timed(f'Läge: {mode}', lambda: self.app.radio(key='analysis_type').set_value(mode).run())
+
+    def pick_sheet(self, key):
+        """Väljer en slumpvis flik i en av sidomenyns flikväljare"""
+        selectbox = self.app.selectbox(key=key) if key else self.app.sidebar.selectbox[0]
+        sheet = self.rng.choice(selectbox.options)
+        self._timed('Välj flik', lambda: selectbox.set_value(sheet).run())
+        return sheet
+
+    def toggle_period(self):
+        level = self.rng.choice(['Kvartal', 'Halvår', 'Månad'])
+        self._timed('Periodnivå', lambda: self.app.radio(key='period_level').set_value(level).run())
+
+    def compare(self):
+        """Väljer två företag i jämförelsen och bekräftar valet"""
+        app = self.app
+        companies = self.rng.sample(app.multiselect(key='compare_companies').options, 2)
+        self._timed('Jämförelseval', lambda: app.multiselect(key='compare_companies').set_value(companies).run())
+        if any(button.key == 'compare_apply' for button in app.button):
+            self._timed('Visa jämförelse', lambda: app.button(key='compare_apply').click().run())
+
+    def edit_cell(self, sheet):
+        """Ändrar en månadscell i sessionens redigeringslager, som data_editor gör"""
+        app = self.app
+        edits = dict(app.session_state[f'edits_{sheet}']) if f'edits_{sheet}' in app.session_state else {}
+        row = self.rng.randrange(5, 40)
+        month = self.rng.choice(['Jan', 'Feb', 'Mar', 'Apr', 'Maj', 'Jun'])
+        edits.setdefault(row, {})[month] = f'{self.rng.uniform(-50, 50):.1f}'.replace('.', ',')
+
+        def apply_edit():
+            app.session_state[f'edits_{sheet}'] = edits
+            app.run()
+        self._timed('Redigera cell', apply_edit)
+
+    def run_flow(self, rounds=1):
+        """Inloggning följt av rounds varv av lägesbyten, jämförelse och redigering"""
+        self.login()
+        for _ in range(rounds):
+            self.switch_mode('Enskilt företag')
+            self.pick_sheet(None)
+            self.toggle_period()
+            self.switch_mode('Jämför företag')
+            self.compare()
+            self.switch_mode('Årsjämförelse')
+            self.switch_mode('Scenarier')
+            self.switch_mode('Rådata & Redigering')
+            sheet = self.pick_sheet('edit_sheet')
+            self.edit_cell(sheet)
+            self.edit_cell(sheet)
+            self.switch_mode('Avvikelser')
+            self.switch_mode('Alla företag')
+        return self.records
+
+
+def run_level(n_sessions, rounds=1, timeout=DEFAULT_TIMEOUT, seed=0, **credentials):
+    """
+    Kör n_sessions samtidiga sessioner och returnerar (poster, sammanfattning).
+    Sessionerna hålls vid liv tills minnet mätts, som öppna flikar hos användare.
+    """
+    gc.collect()
+    rss_before = current_rss()
+    sessions = [DashboardSession(i, timeout=timeout, seed=seed, **credentials) for i in range(n_sessions)]
+    barrier = threading.Barrier(n_sessions)
+
+    def run(session):
+        barrier.wait()
+        return session.run_flow(rounds)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_sessions) as pool:
+        results = list(pool.map(run, sessions))
+    wall = time.perf_counter() - start
+    rss_after = current_rss()
+
+    records = pd.DataFrame([record for result in results for record in result],
+                           columns=['Session', 'Interaktion', 'Sekunder', 'Fel'])
+    records.insert(0, 'Sessioner', n_sessions)
+    summary = {
+        'Sessioner': n_sessions,
+        'Interaktioner': len(records),
+        'Fel': int((records['Fel'] != '').sum()),
+        'Tid (s)': wall,
+        'Interaktioner/s': len(records) / wall if wall > 0 else float('inf'),
+        **{f'p{p} (ms)': np.percentile(records['Sekunder'], p) * 1000 for p in PERCENTILES},
+        'Minne/session (MB)': (rss_after - rss_before) / n_sessions / 2 ** 20,
+    }
+    del sessions, results
+    return records, summary
+
+
+def latency_table(records):
+    """Percentiler per interaktion och samtidighetsnivå i millisekunder"""
+    grouped = records.groupby(['Sessioner', 'Interaktion'])['Sekunder']
+    table = grouped.agg(['count', *[lambda values, p=p: np.percentile(values, p) for p in PERCENTILES], 'max'])
+    table.columns = ['Antal'] + [f'p{p} (ms)' for p in PERCENTILES] + ['max (ms)']
+    table.iloc[:, 1:] *= 1000
+    return table
+
+
+def find_saturation(summary, min_gain=SATURATION_GAIN):
+    """
+    Första nivån där genomströmningen ökar mindre än min_gain (relativt) per
+    fördubbling av antalet sessioner jämfört med föregående nivå. None om
+    genomströmningen fortfarande ökar på högsta nivån.
+    """
+    rows = summary.sort_values('Sessioner').to_dict('records')
+    for previous, current in zip(rows, rows[1:]):
+        doublings = np.log2(current['Sessioner'] / previous['Sessioner'])
+        gain = current['Interaktioner/s'] / previous['Interaktioner/s'] - 1
+        if doublings > 0 and gain < min_gain * doublings:
+            return previous['Sessioner'], previous['Interaktioner/s']
+    return None
+
+
+def run_load_test(levels=DEFAULT_LEVELS, rounds=1, timeout=DEFAULT_TIMEOUT, seed=0, warmup=True, **credentials):
+    """
+    Kör alla samtidighetsnivåer i tur och ordning. En uppvärmningssession först
+    laddar den delade analysatorn så att inläsningen inte räknas som latens.
+    Returnerar (alla poster, sammanfattning per nivå).
+    """
+    _quiet_streamlit()
+    if warmup:
+        DashboardSession(-1, timeout=timeout, seed=seed, **credentials).run_flow(1)
+    all_records, summaries = [], []
+    for n_sessions in levels:
+        records, summary = run_level(n_sessions, rounds, timeout, seed, **credentials)
+        all_records.append(records)
+        summaries.append(summary)
+        print(f"  {n_sessions:>3} sessioner: {summary['Interaktioner/s']:.1f} interaktioner/s, "
+              f"p95 {summary['p95 (ms)']:.0f} ms, {summary['Minne/session (MB)']:.1f} MB/session, "
+              f"{summary['Fel']} fel")
+    return pd.concat(all_records, ignore_index=True), pd.DataFrame(summaries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lasttest av dashboarden med samtidiga AppTest-sessioner')
+    parser.add_argument('--sessions', type=int, nargs='+', default=DEFAULT_LEVELS,
+                        help='Samtidighetsnivåer, t.ex. 1 2 4 8')
+    parser.add_argument('--rounds', type=int, default=1, help='Varv av flödet per session efter inloggning')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='Maxtid per omkörning (s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--username', default=DEFAULT_USERNAME)
+    parser.add_argument('--password', default=DEFAULT_PASSWORD)
+    parser.add_argument('--json', default=None, help='Skriv sammanfattning och percentiler som JSON')
+    args = parser.parse_args()
+
+    # Arbetsboken och regelfilerna letas upp relativt arbetskatalogen
+    os.chdir(REPO_DIR)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    print(f"🚦 Lasttest: {args.sessions} samtidiga sessioner, {args.rounds} varv per session")
+    records, summary = run_load_test(sorted(args.sessions), args.rounds, args.timeout, args.seed,
+                                     username=args.username, password=args.password)
+    latencies = latency_table(records)
+
+    with pd.option_context('display.width', 200, 'display.max_rows', 500, 'display.float_format', '{:,.1f}'.format):
+        print("\n📊 Per nivå:")
+        print(summary.to_string(index=False))
+        print("\n⏱️ Latens per interaktion:")
+        print(latencies.to_string())
+
+    saturation = find_saturation(summary)
+    if saturation is None:
+        print(f"\n📈 Ingen mättnad upp till {summary['Sessioner'].max()} sessioner - prova fler")
+    else:
+        print(f"\n📉 Mättnad vid {saturation[0]} samtidiga sessioner ({saturation[1]:.1f} interaktioner/s)")
+
+    errors = records[records['Fel'] != '']
+    if len(errors):
+        print(f"\n⚠️ {len(errors)} interaktioner gav fel, t.ex.: {errors['Fel'].iloc[0][:200]}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'summary': summary.to_dict('records'),
+                'latency': latencies.reset_index().to_dict('records'),
+                'saturation': None if saturation is None else {'sessions': int(saturation[0]),
+                                                               'throughput': saturation[1]},
+            }, f, ensure_ascii=False, indent=2, default=lambda value: value.item())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Avstämning - vektoriserade kontroller av Totalt-kolumn, SUMMA-rader och beräknat resultat
+"""
+import numpy as np
+import pandas as pd
+
+from financial_analyzer import VALUE_COLUMNS
+
+# Excel-värdena är avrundade till en decimal, varje term kan alltså avvika 0,05
+ROUNDING = 0.05
+
+REPORT_COLUMNS = ['Flik', 'Kontroll', 'Rad', 'Kolumn', 'Cell', 'Förväntat', 'Faktiskt', 'Differens']
+
+
+def excel_column(col_idx):
+    """Returnerar Excel-kolumnbokstav för värdekolumn (Kategori ligger i kolumn A)"""
+    col_idx += 1
+    letters = ''
+    while col_idx >= 0:
+        letters = chr(ord('A') + col_idx % 26) + letters
+        col_idx = col_idx // 26 - 1
+    return letters
+
+
+def _report(analyzer, check, sheet_ids, rows, cols, expected, actual):
+    """Bygger avvikelserapport med cellkoordinater"""
+    sheets = [analyzer.sheet_names[i] for i in sheet_ids]
+    return pd.DataFrame({
+        'Flik': sheets,
+        'Kontroll': check,
+        'Rad': [analyzer.labels[sheet][row] for sheet, row in zip(sheets, rows)],
+        'Kolumn': [VALUE_COLUMNS[col] for col in cols],
+        'Cell': [f'{excel_column(col)}{analyzer.excel_row_offsets.get(sheet, 2) + row}'
+                 for sheet, row, col in zip(sheets, rows, cols)],
+        'Förväntat': expected,
+        'Faktiskt': actual,
+        'Differens': np.asarray(actual) - np.asarray(expected),
+    }, columns=REPORT_COLUMNS)
+
+
+def check_totals(analyzer, tolerance=None):
+    """Totalt-kolumnen ska vara summan av månaderna - en jämförelse över hela portföljen"""
+    n_months = len(VALUE_COLUMNS) - 1
+    matrices = [analyzer.values[sheet] for sheet in analyzer.sheet_names]
+    if not matrices:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    stacked = np.vstack(matrices)
+    sheet_ids = np.repeat(np.arange(len(matrices)), [len(m) for m in matrices])
+    rows = np.concatenate([np.arange(len(m)) for m in matrices])
+
+    months = stacked[:, :n_months]
+    totals = stacked[:, n_months]
+    n_terms = (~np.isnan(months)).sum(axis=1)
+    limit = ROUNDING * (n_terms + 1) if tolerance is None else tolerance
+    expected = np.nansum(months, axis=1)
+    mismatch = (n_terms > 0) & ~np.isnan(totals) & (np.abs(expected - totals) > limit + 1e-9)
+
+    idx = np.flatnonzero(mismatch)
+    return _report(analyzer, 'Totalt = summa månader', sheet_ids[idx], rows[idx],
+                   np.full(len(idx), n_months), expected[idx], totals[idx])
+
+
+def check_subtotals(analyzer, tolerance=None):
+    """Varje SUMMA-rad ska vara summan av kontona i sin grupp"""
+    n_months = len(VALUE_COLUMNS) - 1
+    sheet_ids, rows, expected, actual, n_terms = [], [], [], [], []
+    for sheet_idx, sheet in enumerate(analyzer.sheet_names):
+        tree = analyzer.get_account_tree(sheet)
+        if tree is None:
+            continue
+        nodes = np.array([node for node, row in enumerate(tree.summa_rows) if row is not None], dtype=int)
+        if not len(nodes):
+            continue
+        summa_rows = np.array([tree.summa_rows[node] for node in nodes])
+        sheet_ids.append(np.full(len(nodes), sheet_idx))
+        rows.append(summa_rows)
+        expected.append(tree.monthly_totals()[nodes])
+        actual.append(np.nan_to_num(analyzer.values[sheet][summa_rows, :n_months]))
+        n_terms.append(tree.leaf_end[nodes] - tree.leaf_start[nodes])
+    if not rows:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+
+    sheet_ids, rows = np.concatenate(sheet_ids), np.concatenate(rows)
+    expected, actual = np.vstack(expected), np.vstack(actual)
+    n_terms = np.concatenate(n_terms)
+    limit = ROUNDING * (n_terms + 1) if tolerance is None else np.full(len(n_terms), tolerance)
+    mismatch = np.abs(expected - actual) > limit[:, None] + 1e-9
+
+    idx, cols = np.nonzero(mismatch)
+    return _report(analyzer, 'SUMMA = summa konton', sheet_ids[idx], rows[idx], cols,
+                   expected[idx, cols], actual[idx, cols])
+
+
+def check_net_result(analyzer, tolerance=None):
+    """BERÄKNAT RESULTAT ska vara intäkter + kostnader (+ övriga resultatposter under roten)"""
+    sheet_ids, rows, expected, actual, n_terms = [], [], [], [], []
+    for sheet_idx, sheet in enumerate(analyzer.sheet_names):
+        key_rows = analyzer.key_rows.get(sheet, {})
+        if not all(key in key_rows for key in ('revenue', 'expenses', 'net_result')):
+            continue
+        values = np.nan_to_num(analyzer.values[sheet])
+        total = values[key_rows['revenue']] + values[key_rows['expenses']]
+
+        # Poster utanför intäkts- och kostnadsgruppen, t.ex. bokfört årets resultat
+        tree = analyzer.get_account_tree(sheet)
+        other_leaves = 0
+        if tree is not None:
+            monthly = tree.monthly_totals()
+            other = monthly[0].copy()
+            for key in ('revenue', 'expenses'):
+                if key_rows[key] in tree.summa_rows:
+                    node = tree.summa_rows.index(key_rows[key])
+                    other -= monthly[node]
+                    other_leaves -= tree.leaf_end[node] - tree.leaf_start[node]
+            other_leaves += len(tree.leaf_nodes)
+            total[:len(other)] += other
+            total[len(other)] += other.sum()
+
+        sheet_ids.append(sheet_idx)
+        rows.append(key_rows['net_result'])
+        expected.append(total)
+        actual.append(values[key_rows['net_result']])
+        n_terms.append(other_leaves + 2)
+    if not rows:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+
+    sheet_ids, rows = np.array(sheet_ids), np.array(rows)
+    expected, actual = np.vstack(expected), np.vstack(actual)
+    n_terms = np.array(n_terms)
+    limit = ROUNDING * (n_terms + 1) if tolerance is None else np.full(len(n_terms), tolerance)
+    mismatch = np.abs(expected - actual) > limit[:, None] + 1e-9
+
+    idx, cols = np.nonzero(mismatch)
+    return _report(analyzer, 'Resultat = intäkter + kostnader', sheet_ids[idx], rows[idx], cols,
+                   expected[idx, cols], actual[idx, cols])
+
+
+def reconcile(analyzer, tolerance=None):
+    """Kör alla avstämningskontroller och returnerar samtliga avvikelser"""
+    reports = [
+        check_totals(analyzer, tolerance),
+        check_subtotals(analyzer, tolerance),
+        check_net_result(analyzer, tolerance),
+    ]
+    reports = [report for report in reports if len(report)]
+    if not reports:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    return pd.concat(reports, ignore_index=True)
@@ -0,0 +1,290 @@
+"""
+Rapportgenerator - fristående HTML-rapport per flik och en portföljsida, renderade parallellt
+
+Varje rapport innehåller nyckeltalskort, månadsdiagram och detaljdiagram från
+dashboardens create_*-funktioner med plotly.js inbäddat, så filerna kan öppnas
+utan nätverk. Arbetsprocesserna ansluter till analysatorns binära snapshot i
+stället för att läsa Excel, och flikar vars data inte ändrats sedan förra
+körningen (enligt manifest.json) renderas inte om.
+"""
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from financial_analyzer import MONTHS, FinancialAnalyzer, get_shared_analyzer
+
+# Höjs när rapportens innehåll ändras så att alla flikar renderas om
+REPORT_VERSION = 1
+
+DEFAULT_OUTPUT_DIR = 'rapporter'
+
+MANIFEST_FILE = 'manifest.json'
+
+INDEX_FILE = 'index.html'
+
+REPORT_CSS = """
+body { font-family: -apple-system, 'Segoe UI', Roboto, sans-serif; margin: 2rem; color: #212529; }
+.main-header { font-size: 2rem; font-weight: 700; color: #1f4e79; padding: 1rem;
+               background: linear-gradient(90deg, #f8f9fa 0%, #e9ecef 100%);
+               border-radius: 10px; border-left: 5px solid #1f4e79; }
+.section-header { font-size: 1.4rem; font-weight: 600; color: #1f4e79; margin: 2rem 0 1rem 0;
+                  padding-bottom: 0.5rem; border-bottom: 2px solid #e9ecef; }
+.cards { display: flex; gap: 1rem; flex-wrap: wrap; }
+.metric-card { flex: 1; min-width: 200px; background: white; padding: 1.5rem; border-radius: 10px;
+               box-shadow: 0 2px 4px rgba(0,0,0,0.1); border-left: 4px solid #28a745; }
+.metric-value { font-size: 1.8rem; font-weight: 700; color: #1f4e79; }
+.metric-label { font-size: 0.9rem; color: #6c757d; text-transform: uppercase; font-weight: 500; }
+.charts { display: flex; gap: 1rem; flex-wrap: wrap; }
+.charts > div { flex: 1; min-width: 400px; }
+table { border-collapse: collapse; width: 100%; }
+th, td { padding: 0.4rem 0.8rem; border-bottom: 1px solid #e9ecef; text-align: right; }
+th:first-child, td:first-child { text-align: left; }
+.meta { color: #6c757d; font-size: 0.85rem; }
+"""
+
+# Analysatorn i arbetsprocessen, ansluten till snapshoten en gång per process
+_worker_analyzer = None
+
+
+def report_filename(sheet_name):
+    """Filnamn för en fliks rapport, t.ex. 'KLAB 2024' -> 'KLAB_2024.html'"""
+    return re.sub(r'[^\w-]+', '_', sheet_name).strip('_') + '.html'
+
+
+def sheet_fingerprint(analyzer, sheet_name):
+    """
+    SHA1 över allt som påverkar fliks rapport: etiketter, värden, grupper,
+    nyckelserier och prognosen, som bygger på föregående års flik
+    """
+    from forecasting import FORECAST_METHODS
+
+    sha1 = hashlib.sha1(f'{REPORT_VERSION}|{sheet_name}'.encode())
+    sha1.update(json.dumps(analyzer.labels[sheet_name], ensure_ascii=False).encode())
+    sha1.update(np.ascontiguousarray(analyzer.values[sheet_name]).tobytes())
+    sha1.update(json.dumps(analyzer.get_row_groups(sheet_name), ensure_ascii=False).encode())
+    sha1.update(np.ascontiguousarray(analyzer.key_series[analyzer.get_sheet_position(sheet_name)]).tobytes())
+    sha1.update(str(analyzer.get_closed_months(sheet_name)).encode())
+    sha1.update(np.ascontiguousarray(analyzer.get_forecast(sheet_name, FORECAST_METHODS[0])).tobytes())
+    return sha1.hexdigest()
+
+
+def _page(title, body):
+    """Komplett HTML-sida med rapportens stil"""
+    return (f'<!DOCTYPE html>\n<html lang="sv">\n<head>\n<meta charset="utf-8">\n'
+            f'<title>{html.escape(title)}</title>\n<style>{REPORT_CSS}</style>\n</head>\n'
+            f'<body>\n{body}\n</body>\n</html>\n')
+
+
+class _FigureWriter:
+    """Gör om figurer till HTML - plotly.js bäddas in med den första figuren på sidan"""
+
+    def __init__(self):
+        self.first = True
+
+    def __call__(self, fig):
+        if fig is None:
+            return ''
+        fragment = fig.to_html(full_html=False, include_plotlyjs=self.first, config={'displaylogo': False})
+        self.first = False
+        return fragment
+
+
+def _kpi_cards(kpis):
+    """Nyckeltalskort i samma utseende som dashboardens"""
+    net_color = '#28a745' if kpis['Nettoresultat'] >= 0 else '#dc3545'
+    cards = [
+        (f"{kpis['Intäkter']:,.1f} tSEK", 'Totala Intäkter', ''),
+        (f"{kpis['Kostnader']:,.1f} tSEK", 'Totala Kostnader', ''),
+        (f"{kpis['Nettoresultat']:,.1f} tSEK", 'Nettoresultat', f' style="color: {net_color}"'),
+        (f"{kpis['Vinstmarginal (%)']:.1f}%", 'Vinstmarginal', ''),
+    ]
+    return '<div class="cards">' + ''.join(
+        f'<div class="metric-card"><div class="metric-value"{style}>{value}</div>'
+        f'<div class="metric-label">{label}</div></div>'
+        for value, label, style in cards
+    ) + '</div>'
+
+
+def render_sheet_report(analyzer, sheet_name):
+    """Renderar en fliks rapport som en fristående HTML-sträng"""
+    from dashboard import (create_monthly_line_chart, create_monthly_bar_chart,
+                           create_revenue_detail_chart, create_expense_detail_chart)
+    from forecasting import FORECAST_METHODS
+
+    figure = _FigureWriter()
+    revenue, expenses, net_result = analyzer.get_key_series(sheet_name).tolist()
+    closed_months = analyzer.get_closed_months(sheet_name)
+    forecast = None
+    if 0 < closed_months < len(MONTHS):
+        forecast = analyzer.get_forecast(sheet_name, FORECAST_METHODS[0])
+
+    table_rows = ''.join(
+        f'<tr><td>{month}</td><td>{rev:,.1f}</td><td>{exp:,.1f}</td><td>{net:,.1f}</td></tr>'
+        for month, rev, exp, net in zip(MONTHS, revenue, expenses, net_result)
+    )
+    body = [
+        f'<div class="main-header">📊 {html.escape(sheet_name)}</div>',
+        f'<p class="meta"><a href="{INDEX_FILE}">← Portföljöversikt</a> · '
+        f'{closed_months} stängda månader · data {analyzer.snapshot_version[:12]}</p>',
+        _kpi_cards(analyzer.get_kpis(sheet_name)),
+        '<div class="section-header">📊 Finansiella Diagram</div>',
+        figure(create_monthly_line_chart(revenue, expenses, net_result,
+                                         forecast=forecast, closed_months=closed_months)),
+        figure(create_monthly_bar_chart(revenue, expenses, net_result)),
+        '<div class="charts"><div>', figure(create_revenue_detail_chart(analyzer, sheet_name)),
+        '</div><div>', figure(create_expense_detail_chart(analyzer, sheet_name)), '</div></div>',
+        '<div class="section-header">📋 Månadsdata (tSEK)</div>',
+        '<table><tr><th>Månad</th><th>Intäkter</th><th>Kostnader</th><th>Nettoresultat</th></tr>'
+        f'{table_rows}</table>',
+    ]
+    return _page(f'Rapport {sheet_name}', '\n'.join(body))
+
+
+def render_index(analyzer, files):
+    """Portföljsida med nyckeltal per flik, länkar till rapporterna och portföljheatmap"""
+    from dashboard import create_portfolio_heatmap
+
+    figure = _FigureWriter()
+    kpi_table = analyzer.get_kpi_table()
+    rows = []
+    for sheet in analyzer.sheet_names:
+        kpis = kpi_table.loc[sheet]
+        growth = kpis['Intäkter tillväxt (%)']
+        rows.append(
+            f'<tr><td><a href="{html.escape(files[sheet])}">{html.escape(sheet)}</a></td>'
+            f'<td>{kpis["Intäkter"]:,.1f}</td><td>{kpis["Kostnader"]:,.1f}</td>'
+            f'<td>{kpis["Nettoresultat"]:,.1f}</td><td>{kpis["Vinstmarginal (%)"]:.1f}%</td>'
+            f'<td>{"-" if np.isnan(growth) else f"{growth:.1f}%"}</td>'
+            f'<td>{analyzer.get_closed_months(sheet)}</td></tr>'
+        )
+    body = [
+        '<div class="main-header">📊 Portföljöversikt</div>',
+        f'<p class="meta">Genererad {datetime.now():%Y-%m-%d %H:%M} · data {analyzer.snapshot_version[:12]} · '
+        f'{len(analyzer.sheet_names)} flikar</p>',
+        '<div class="section-header">📋 KPI Sammanfattning</div>',
+        '<table><tr><th>Företag/År</th><th>Intäkter (tSEK)</th><th>Kostnader (tSEK)</th>'
+        '<th>Nettoresultat (tSEK)</th><th>Vinstmarginal</th><th>Intäktstillväxt</th>'
+        '<th>Stängda månader</th></tr>' + ''.join(rows) + '</table>',
+        '<div class="section-header">🗺️ Portföljöversikt</div>',
+        figure(create_portfolio_heatmap(analyzer, analyzer.sheet_names)),
+    ]
+    return _page('Portföljöversikt', '\n'.join(body))
+
+
+def _write_text(path, text):
+    """Skriver via temporärfil så att en halvskriven rapport aldrig syns"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _quiet_streamlit():
+    """Dashboarden importeras utan Streamlit-körning - dölj varningarna om saknad kontext"""
+    os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', 'error')
+    from streamlit.logger import set_log_level
+
+    set_log_level(os.environ['STREAMLIT_LOGGER_LEVEL'])
+
+
+def _init_worker(snapshot_dir, version):
+    """Ansluter arbetsprocessen till snapshoten - matriserna delas, Excel läses inte"""
+    import contextlib
+    import io
+    from binary_snapshot import attach_snapshot
+
+    global _worker_analyzer
+    _quiet_streamlit()
+    with contextlib.redirect_stdout(io.StringIO()):
+        _worker_analyzer = FinancialAnalyzer(snapshot=attach_snapshot(snapshot_dir, version))
+
+
+def _render_worker(sheet_name, output_dir):
+    """Renderar och skriver en rapport i arbetsprocessen"""
+    filename = report_filename(sheet_name)
+    _write_text(os.path.join(output_dir, filename), render_sheet_report(_worker_analyzer, sheet_name))
+    return sheet_name
+
+
+def load_manifest(output_dir):
+    """Förra körningens {flik: {'hash', 'file'}}, tomt om manifest saknas"""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f).get('sheets', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def generate_reports(output_dir=DEFAULT_OUTPUT_DIR, excel_file_path=None, workers=None, force=False,
+                     snapshot_dir=None):
+    """
+    Renderar rapporter för alla flikar vars data ändrats sedan förra körningen och
+    skriver om portföljsidan. Returnerar {'rendered', 'skipped', 'index', 'seconds'}.
+    """
+    from binary_snapshot import DEFAULT_SNAPSHOT_DIR
+
+    start = time.perf_counter()
+    snapshot_dir = snapshot_dir or DEFAULT_SNAPSHOT_DIR
+    _quiet_streamlit()
+    analyzer = get_shared_analyzer(excel_file_path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    previous = load_manifest(output_dir)
+    manifest, pending, skipped = {}, [], []
+    for sheet in analyzer.sheet_names:
+        entry = {'hash': sheet_fingerprint(analyzer, sheet), 'file': report_filename(sheet)}
+        manifest[sheet] = entry
+        unchanged = previous.get(sheet) == entry and os.path.exists(os.path.join(output_dir, entry['file']))
+        if unchanged and not force:
+            skipped.append(sheet)
+        else:
+            pending.append(sheet)
+
+    workers = workers or os.cpu_count() or 1
+    if len(pending) > 1 and workers > 1:
+        analyzer.write_snapshot(snapshot_dir)
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending)), initializer=_init_worker,
+                                 initargs=(snapshot_dir, analyzer.snapshot_version)) as pool:
+            list(pool.map(_render_worker, pending, [output_dir] * len(pending)))
+    else:
+        for sheet in pending:
+            _write_text(os.path.join(output_dir, manifest[sheet]['file']), render_sheet_report(analyzer, sheet))
+
+    # Rapporter för flikar som inte längre finns tas bort
+    for sheet, entry in previous.items():
+        if sheet not in manifest and os.path.exists(os.path.join(output_dir, entry['file'])):
+            os.remove(os.path.join(output_dir, entry['file']))
+
+    index_path = os.path.join(output_dir, INDEX_FILE)
+    _write_text(index_path, render_index(analyzer, {sheet: entry['file'] for sheet, entry in manifest.items()}))
+    _write_text(os.path.join(output_dir, MANIFEST_FILE), json.dumps(
+        {'snapshot_version': analyzer.snapshot_version, 'sheets': manifest}, ensure_ascii=False, indent=2))
+    return {'rendered': pending, 'skipped': skipped, 'index': index_path,
+            'seconds': time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generera HTML-rapporter för alla företag och år')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_DIR, help='Katalog för rapporterna')
+    parser.add_argument('--file', dest='excel_file_path', default=None,
+                        help='Excel-fil (letas upp automatiskt om den utelämnas)')
+    parser.add_argument('--workers', type=int, default=None, help='Antal processer (standard: antal kärnor)')
+    parser.add_argument('--force', action='store_true', help='Rendera om alla flikar')
+    args = parser.parse_args()
+
+    result = generate_reports(args.output, args.excel_file_path, args.workers, args.force)
+    print(f"📄 {len(result['rendered'])} rapporter renderade, {len(result['skipped'])} oförändrade "
+          f"på {result['seconds']:.1f} s")
+    print(f"✅ Portföljsida: {result['index']}")
+
+
+if __name__ == "__main__":
+    main()
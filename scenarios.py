@@ -0,0 +1,103 @@
+"""
+Scenarier - vektoriserad what-if-analys över en scenarioaxel
+"""
+import numpy as np
+import pandas as pd
+
+from financial_analyzer import MONTHS, normalize_label
+
+ADJUSTMENT_TYPES = ['%', 'tSEK/mån']
+BASE_SCENARIO = 'Utfall'
+
+
+def _target_mask(target, leaf_labels, leaf_groups, side_masks=None):
+    """
+    Löv som en justering träffar - 'Grupp: X' eller 'Konto: Y'. Gruppmål
+    begränsas till delträdet under intäkts- eller kostnadssumman som gruppen
+    hör till (side_masks: grupp -> lövmask).
+    """
+    kind, _, name = str(target).partition(':')
+    name = name.strip()
+    if kind.strip().casefold() == 'grupp':
+        mask = np.array([group == name for group in leaf_groups], dtype=bool)
+        if side_masks is not None and name in side_masks:
+            mask &= side_masks[name]
+        return mask
+    key = normalize_label(name)
+    return np.array([normalize_label(label) == key for label in leaf_labels], dtype=bool)
+
+
+def build_adjustments(scenarios, tree, leaf_groups, sign, side_masks=None):
+    """
+    Bygger justeringsmatriser (scenario × löv) för procent och belopp.
+    scenarios är en lista av (namn, [(mål, typ, värde), ...]).
+    Belopp anges i kontots egen riktning och fördelas proportionellt inom målet.
+    """
+    leaf_labels = [tree.labels[node] for node in tree.leaf_nodes]
+    weights_base = np.abs(tree.leaf_values).sum(axis=1)
+    pct = np.zeros((len(scenarios), len(leaf_labels)))
+    amount = np.zeros((len(scenarios), len(leaf_labels)))
+
+    for s, (_, adjustments) in enumerate(scenarios):
+        for target, kind, value in adjustments:
+            if value is None or pd.isna(value):
+                continue
+            mask = _target_mask(target, leaf_labels, leaf_groups, side_masks)
+            if not mask.any():
+                continue
+            if kind == '%':
+                pct[s, mask] += float(value) / 100
+            else:
+                weights = np.where(mask, weights_base, 0)
+                weights = weights / weights.sum() if weights.sum() > 0 else mask / mask.sum()
+                amount[s] += float(value) * weights * sign
+    return pct, amount
+
+
+def evaluate_scenarios(analyzer, sheet_name, scenarios):
+    """
+    Räknar om intäkter, kostnader, BERÄKNAT RESULTAT och marginal för alla
+    scenarier samtidigt. Returnerar (sammanfattning, månadsresultat per scenario).
+    """
+    tree = analyzer.get_account_tree(sheet_name)
+    key_rows = analyzer.key_rows.get(sheet_name, {})
+    if tree is None or not tree.leaf_nodes:
+        return None, None
+
+    values = np.nan_to_num(analyzer.values[sheet_name][:, :len(MONTHS)])
+    base = np.zeros((3, len(MONTHS)))
+    for i, key in enumerate(('revenue', 'expenses', 'net_result')):
+        if key in key_rows:
+            base[i] = values[key_rows[key]]
+
+    row_groups = analyzer.get_row_groups(sheet_name)
+    leaf_groups = [row_groups[tree.rows[node]] for node in tree.leaf_nodes]
+    revenue_mask = tree.subtree_leaf_mask(key_rows.get('revenue'))
+    expense_mask = tree.subtree_leaf_mask(key_rows.get('expenses'))
+    sign = np.where(expense_mask, -1.0, 1.0)
+    masks = {'revenue': revenue_mask, 'expense': expense_mask}
+    side_masks = {group: masks[side] for group, side in analyzer.rules.group_sides.items() if side in masks}
+
+    scenarios = [(BASE_SCENARIO, [])] + list(scenarios)
+    pct, amount = build_adjustments(scenarios, tree, leaf_groups, sign, side_masks)
+
+    # (scenario, löv, månad) via broadcasting - inga kopior av DataFrames
+    delta = tree.leaf_values[None, :, :] * pct[:, :, None] + amount[:, :, None]
+    revenue = base[0] + np.einsum('slm,l->sm', delta, revenue_mask.astype(float))
+    expenses = base[1] + np.einsum('slm,l->sm', delta, expense_mask.astype(float))
+    net_result = base[2] + delta.sum(axis=1)
+
+    totals = np.stack([revenue.sum(axis=1), expenses.sum(axis=1), net_result.sum(axis=1)], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margin = np.where(totals[:, 0] > 0, totals[:, 2] / totals[:, 0] * 100, 0)
+
+    names = [name for name, _ in scenarios]
+    summary = pd.DataFrame({
+        'Intäkter': totals[:, 0],
+        'Kostnader': totals[:, 1],
+        'Nettoresultat': totals[:, 2],
+        'Vinstmarginal (%)': margin,
+        'Förändring resultat': totals[:, 2] - totals[0, 2],
+    }, index=pd.Index(names, name='Scenario'))
+    monthly = pd.DataFrame(net_result, index=summary.index, columns=MONTHS)
+    return summary, monthly
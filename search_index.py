@@ -0,0 +1,184 @@
+"""
+Kontosökning - inverterat index över kontoetiketter i alla flikar med prefix- och felstavningssökning
+"""
+import bisect
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from financial_analyzer import VALUE_COLUMNS
+
+# Svenska bokstäver som inte får tappa sina prickar/ringar vid normalisering
+SWEDISH_LETTERS = set('åäö')
+
+# Nordiska varianter som ska sökas som de svenska motsvarigheterna
+NORDIC_EQUIVALENTS = str.maketrans({'æ': 'ä', 'ø': 'ö'})
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+MATCH_EXACT, MATCH_PREFIX, MATCH_COMPOUND, MATCH_FUZZY = 'Exakt', 'Prefix', 'Sammansatt', 'Ungefärlig'
+
+# Kortaste sökord som matchas som efterled i sammansatta ord (lokal|kostnader)
+MIN_COMPOUND_PART = 4
+
+
+def swedish_fold(text):
+    """
+    Skiftlägesoberoende normalisering som behåller å, ä och ö som egna bokstäver
+    men tar bort övriga diakritiska tecken (é -> e, ü -> u)
+    """
+    text = unicodedata.normalize('NFC', str(text)).casefold().translate(NORDIC_EQUIVALENTS)
+    folded = []
+    for char in text:
+        if char in SWEDISH_LETTERS or char.isascii():
+            folded.append(char)
+        else:
+            folded.append(''.join(c for c in unicodedata.normalize('NFD', char)
+                                  if not unicodedata.combining(c)))
+    return ''.join(folded)
+
+
+def tokenize(text):
+    """Delar upp normaliserad text i ord"""
+    return TOKEN_PATTERN.findall(swedish_fold(text))
+
+
+def edit_distance(a, b, max_distance):
+    """Levenshteinavstånd med tidigt avbrott, max_distance + 1 om gränsen överskrids"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def max_typos(token):
+    """Tillåtna felstavningar beroende på ordlängd"""
+    if len(token) <= 3:
+        return 0
+    return 1 if len(token) <= 6 else 2
+
+
+class AccountSearchIndex:
+    """
+    Inverterat index från ord i kontoetiketter till rader (flik, rad) i alla
+    flikar. Orden hålls sorterade så att prefixsökning blir en binärsökning,
+    och felstavade ord matchas mot ordlistan med begränsat redigeringsavstånd.
+    En andra, baklänges sorterad ordlista hittar efterled i sammansatta ord.
+    """
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        self.sheets = []
+        self.rows = []
+        postings = {}
+        self.sheet_keys = dict(zip(analyzer.sheet_names, analyzer.sheet_index))
+        for sheet in analyzer.sheet_names:
+            for row, label in enumerate(analyzer.labels[sheet]):
+                tokens = set(tokenize(label))
+                if not tokens:
+                    continue
+                entry = len(self.rows)
+                self.sheets.append(sheet)
+                self.rows.append(row)
+                for token in tokens:
+                    postings.setdefault(token, []).append(entry)
+        self.vocabulary = sorted(postings)
+        self.postings = [np.array(postings[token], dtype=int) for token in self.vocabulary]
+        # Baklänges stavade ord - efterled blir prefix i denna lista
+        reversed_tokens = sorted((token[::-1], pos) for pos, token in enumerate(self.vocabulary))
+        self.reversed_vocabulary = [token for token, _ in reversed_tokens]
+        self.reversed_positions = [pos for _, pos in reversed_tokens]
+        # Ord grupperade per längd så att felstavningssökningen kan hoppa över orimliga ord
+        self.by_length = {}
+        for pos, token in enumerate(self.vocabulary):
+            self.by_length.setdefault(len(token), []).append(pos)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @staticmethod
+    def _prefix_range(vocabulary, prefix):
+        """Ordlistans intervall [start, end) för ord som börjar med prefix"""
+        start = bisect.bisect_left(vocabulary, prefix)
+        end = bisect.bisect_left(vocabulary, prefix + '\uffff')
+        return start, end
+
+    def _token_scores(self, query_token, fuzzy=True):
+        """
+        Poäng per indexrad för ett sökord: 0 för exakt ord, 1 för prefix eller
+        efterled och 2 + avstånd för felstavning. Lägsta poängen per rad gäller.
+        """
+        matches = {}
+        if len(query_token) >= MIN_COMPOUND_PART:
+            start, end = self._prefix_range(self.reversed_vocabulary, query_token[::-1])
+            for pos in self.reversed_positions[start:end]:
+                matches[pos] = (1, MATCH_COMPOUND)
+        start, end = self._prefix_range(self.vocabulary, query_token)
+        for pos in range(start, end):
+            matches[pos] = (0, MATCH_EXACT) if self.vocabulary[pos] == query_token else (1, MATCH_PREFIX)
+
+        limit = max_typos(query_token) if fuzzy else 0
+        if limit and not matches:
+            for length in range(len(query_token) - limit, len(query_token) + limit + 1):
+                for pos in self.by_length.get(length, ()):
+                    distance = edit_distance(query_token, self.vocabulary[pos], limit)
+                    if distance <= limit:
+                        matches[pos] = (2 + distance, MATCH_FUZZY)
+
+        scores = {}
+        for pos, (score, kind) in matches.items():
+            for entry in self.postings[pos]:
+                if entry not in scores or score < scores[entry][0]:
+                    scores[entry] = (score, kind)
+        return scores
+
+    def search(self, query, limit=50, fuzzy=True):
+        """
+        Söker konton där alla sökord matchar (exakt, prefix eller ungefärligt).
+        Returnerar en DataFrame med flik, rad, träfftyp och månadsvärden.
+        """
+        query_tokens = tokenize(query)
+        columns = ['Flik', 'Företag', 'År', 'Konto', 'Träff'] + VALUE_COLUMNS
+        if not query_tokens:
+            return pd.DataFrame(columns=columns)
+
+        combined = None
+        for token in query_tokens:
+            scores = self._token_scores(token, fuzzy)
+            if combined is None:
+                combined = scores
+            else:
+                combined = {entry: (combined[entry][0] + score, max(combined[entry][1], kind, key=_match_rank))
+                            for entry, (score, kind) in scores.items() if entry in combined}
+            if not combined:
+                return pd.DataFrame(columns=columns)
+
+        # Bästa träffarna först, därefter arbetsbokens ordning
+        ranked = sorted(combined, key=lambda entry: (combined[entry][0], entry))[:limit]
+        analyzer = self.analyzer
+        sheets = [self.sheets[entry] for entry in ranked]
+        rows = [self.rows[entry] for entry in ranked]
+        values = np.array([analyzer.values[sheet][row] for sheet, row in zip(sheets, rows)]).reshape(-1, len(VALUE_COLUMNS))
+        keys = [self.sheet_keys[sheet] for sheet in sheets]
+        info = pd.DataFrame({
+            'Flik': sheets,
+            'Företag': [company for company, _ in keys],
+            'År': pd.array([year for _, year in keys], dtype='Int64'),
+            'Konto': [analyzer.labels[sheet][row] for sheet, row in zip(sheets, rows)],
+            'Träff': [combined[entry][1] for entry in ranked],
+        })
+        return pd.concat([info, pd.DataFrame(values, columns=VALUE_COLUMNS)], axis=1)
+
+
+def _match_rank(kind):
+    """Sämsta träfftypen bestämmer radens träfftyp"""
+    return [MATCH_EXACT, MATCH_PREFIX, MATCH_COMPOUND, MATCH_FUZZY].index(kind)
@@ -0,0 +1,235 @@
+"""
+SIE4-import - strömmande läsning av SIE-filer till konton × månader per företag och år
+"""
+import argparse
+import re
+from collections import namedtuple
+from datetime import date
+
+import numpy as np
+
+from financial_analyzer import MONTHS, FinancialAnalyzer, build_sheet_layout
+
+SIE_ENCODING = 'cp437'
+
+# Fält: citerad sträng (med \" som escape), objektlista {...} eller ord
+FIELD_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"|(\{[^}]*\})|(\S+)')
+
+# Resultatkonton enligt BAS - balanskonton (1xxx-2xxx) hör inte till resultaträkningen
+RESULT_ACCOUNTS = (3000, 8999)
+
+SieRecord = namedtuple('SieRecord', ['tag', 'fields'])
+
+FiscalYear = namedtuple('FiscalYear', ['start', 'end'])
+
+
+def split_fields(line):
+    """Delar upp en SIE-rad i fält, citattecken och objektlistor hålls ihop"""
+    fields = []
+    for quoted, objects, word in FIELD_PATTERN.findall(line):
+        if objects:
+            fields.append(objects)
+        elif word:
+            fields.append(word)
+        else:
+            fields.append(quoted.replace('\\"', '"'))
+    return fields
+
+
+def read_records(path, encoding=SIE_ENCODING):
+    """
+    Generator över SIE-poster rad för rad. Transaktioner inuti en verifikation
+    ({ ... }) får verifikationens datum som sista fält om eget datum saknas.
+    Filen hålls aldrig i minnet i sin helhet.
+    """
+    voucher_date = None
+    in_voucher = False
+    with open(path, 'r', encoding=encoding, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line == '{':
+                in_voucher = True
+                continue
+            if line == '}':
+                in_voucher = False
+                voucher_date = None
+                continue
+            if not line.startswith('#'):
+                continue
+            fields = split_fields(line)
+            tag, fields = fields[0].upper(), fields[1:]
+            if tag == '#VER':
+                # #VER serie vernr verdatum [vertext] ...
+                voucher_date = fields[2] if len(fields) > 2 else None
+            elif tag == '#TRANS' and in_voucher:
+                # #TRANS kontonr {objektlista} belopp [transdat] [transtext] ...
+                if len(fields) < 4 or not fields[3]:
+                    fields = fields[:3] + [voucher_date]
+            yield SieRecord(tag, fields)
+
+
+def parse_date(text):
+    """SIE-datum (ÅÅÅÅMMDD) till date, None om fältet saknas eller är ogiltigt"""
+    try:
+        return date(int(text[:4]), int(text[4:6]), int(text[6:8]))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_amount(text):
+    """Belopp med punkt eller komma som decimaltecken"""
+    return float(str(text).replace(',', '.'))
+
+
+def is_result_account(account):
+    """True för resultatkonton (klass 3-8)"""
+    return account.isdigit() and RESULT_ACCOUNTS[0] <= int(account) <= RESULT_ACCOUNTS[1]
+
+
+class SieAggregator:
+    """
+    Summerar SIE-poster till belopp per (räkenskapsår, konto) × månad i räkenskapsåret.
+    Minnet växer med antalet konton och år, inte med antalet transaktioner.
+    Månadsbelopp tas från #TRANS; för år utan transaktioner används #PSALDO.
+    #RES sparas som helårsbelopp för avstämning.
+    """
+
+    def __init__(self):
+        self.company = None
+        self.org_number = None
+        self.fiscal_years = {}
+        self._has_rar = False
+        self.account_names = {}
+        self.transactions = {}
+        self.period_balances = {}
+        self.results = {}
+        self.n_records = 0
+        self.n_transactions = 0
+
+    def _year_index(self, day):
+        """Räkenskapsårets index (0 = innevarande, -1 = föregående ...) för ett datum"""
+        for index, year in self.fiscal_years.items():
+            if year.start <= day <= year.end:
+                return index
+        if not self._has_rar:
+            # Utan #RAR antas kalenderår, indexerade på årtalet
+            self.fiscal_years[day.year] = FiscalYear(date(day.year, 1, 1), date(day.year, 12, 31))
+            return day.year
+        return None
+
+    def _add(self, target, index, account, month, amount):
+        key = (index, account)
+        if key not in target:
+            target[key] = np.zeros(len(MONTHS))
+        target[key][month] += amount
+
+    def feed(self, record):
+        """Tar emot en post från read_records"""
+        self.n_records += 1
+        tag, fields = record
+        if tag == '#FNAMN' and fields:
+            self.company = fields[0]
+        elif tag == '#ORGNR' and fields:
+            self.org_number = fields[0]
+        elif tag == '#RAR' and len(fields) >= 3:
+            start, end = parse_date(fields[1]), parse_date(fields[2])
+            if start and end:
+                self.fiscal_years[int(fields[0])] = FiscalYear(start, end)
+                self._has_rar = True
+        elif tag == '#KONTO' and len(fields) >= 2:
+            self.account_names[fields[0]] = fields[1]
+        elif tag == '#TRANS' and len(fields) >= 3 and is_result_account(fields[0]):
+            day = parse_date(fields[3]) if len(fields) > 3 else None
+            index = self._year_index(day) if day else None
+            if index is None:
+                return
+            start = self.fiscal_years[index].start
+            # Förlängda räkenskapsår: månader efter den tolfte läggs i sista kolumnen
+            month = min((day.year - start.year) * 12 + day.month - start.month, len(MONTHS) - 1)
+            self._add(self.transactions, index, fields[0], month, parse_amount(fields[2]))
+            self.n_transactions += 1
+        elif tag == '#PSALDO' and len(fields) >= 5 and is_result_account(fields[2]):
+            # Bara totalen per konto - poster med objekt är uppdelningar av samma belopp
+            if fields[3].strip('{} '):
+                return
+            index, period = int(fields[0]), fields[1]
+            year = self.fiscal_years.get(index)
+            if year is None or len(period) != 6:
+                return
+            month = (int(period[:4]) - year.start.year) * 12 + int(period[4:]) - year.start.month
+            if 0 <= month < len(MONTHS):
+                self._add(self.period_balances, index, fields[2], month, parse_amount(fields[4]))
+        elif tag == '#RES' and len(fields) >= 3 and is_result_account(fields[1]):
+            self.results[(int(fields[0]), fields[1])] = parse_amount(fields[2])
+
+    def sheets(self, company=None, scale=1000.0):
+        """
+        Returnerar {fliknamn: (etiketter, matris)} med en flik per räkenskapsår.
+        Belopp vänds till rapporttecken (intäkter positiva) och räknas om till tSEK.
+        """
+        company = company or self.company or 'SIE'
+        result = {}
+        for index, year in sorted(self.fiscal_years.items()):
+            source = self.transactions
+            if not any(key[0] == index for key in source):
+                source = self.period_balances
+            accounts = sorted(account for (i, account) in source if i == index)
+            if not accounts:
+                continue
+            labels = [f'{account} {self.account_names.get(account, "")}'.strip() for account in accounts]
+            # + 0.0 ger 0 i stället för -0 för tomma månader
+            matrix = -np.array([source[(index, account)] for account in accounts]) / scale + 0.0
+            result[f'{company} {year.start.year}'] = (labels, matrix)
+        return result
+
+    def result_differences(self, tolerance=0.5):
+        """Konton där summan av månaderna avviker från #RES (i kronor)"""
+        differences = []
+        for (index, account), expected in self.results.items():
+            monthly = self.transactions.get((index, account), self.period_balances.get((index, account)))
+            actual = monthly.sum() if monthly is not None else 0.0
+            if abs(actual - expected) > tolerance:
+                differences.append((index, account, expected, actual))
+        return differences
+
+
+def import_sie(path, analyzer=None, company=None, encoding=SIE_ENCODING):
+    """
+    Läser en SIE4-fil strömmande och returnerar {fliknamn: (etiketter, matris)}.
+    Om en analysator anges registreras flikarna i den i arbetsbokens layout.
+    """
+    aggregator = SieAggregator()
+    for record in read_records(path, encoding):
+        aggregator.feed(record)
+    sheets = aggregator.sheets(company)
+    if analyzer is not None and sheets:
+        analyzer.register_sheets({
+            name: build_sheet_layout(labels, matrix, analyzer.rules)
+            for name, (labels, matrix) in sheets.items()
+        })
+    return sheets, aggregator
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Importera SIE4-fil till månadsmatriser')
+    parser.add_argument('path', help='SIE-fil (.se/.si)')
+    parser.add_argument('--company', default=None, help='Företagsnamn i fliknamnet (standard: #FNAMN)')
+    parser.add_argument('--encoding', default=SIE_ENCODING)
+    args = parser.parse_args()
+
+    analyzer = FinancialAnalyzer()
+    sheets, aggregator = import_sie(args.path, analyzer, args.company, args.encoding)
+    print(f"📥 {aggregator.n_records} poster, {aggregator.n_transactions} transaktioner, "
+          f"{len(aggregator.account_names)} konton")
+    for sheet_name in sheets:
+        kpis = analyzer.get_kpis(sheet_name)
+        print(f"  {sheet_name}: intäkter {kpis['Intäkter']:,.1f}, kostnader {kpis['Kostnader']:,.1f}, "
+              f"resultat {kpis['Nettoresultat']:,.1f} tSEK")
+    for index, account, expected, actual in aggregator.result_differences():
+        print(f"  ⚠️ #RES {index} {account}: {expected:,.2f} men månaderna summerar till {actual:,.2f}")
+
+
+if __name__ == "__main__":
+    main()
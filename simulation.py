@@ -0,0 +1,155 @@
+"""
+Monte Carlo - simulerad fördelning av årets resultat utifrån företagets historik
+"""
+import numpy as np
+import pandas as pd
+
+from financial_analyzer import MONTHS
+
+DEFAULT_DRAWS = 10000
+DEFAULT_SEED = 42
+PERCENTILES = [5, 25, 50, 75, 95]
+
+# Max antal slumptal per block (dragning × konto × månad) - håller minnet begränsat
+CHUNK_ELEMENTS = 4_000_000
+
+
+def company_history(analyzer, company):
+    """
+    Samlar företagets intäkts- och kostnadskonton över alla år som (år, konto, månad)
+    tillsammans med en mask för stängda månader.
+    """
+    positions = [idx for _, idx in analyzer.get_company_positions(company)]
+    leaf_accounts = set()
+    for idx in positions:
+        sheet = analyzer.sheet_names[idx]
+        tree = analyzer.get_account_tree(sheet)
+        if tree is None:
+            continue
+        key_rows = analyzer.key_rows.get(sheet, {})
+        accounts = analyzer.row_accounts[sheet]
+        for key in ('revenue', 'expenses'):
+            mask = tree.subtree_leaf_mask(key_rows.get(key))
+            for node in np.asarray(tree.leaf_nodes)[mask]:
+                account = accounts[tree.rows[node]]
+                if account >= 0:
+                    leaf_accounts.add(account)
+
+    accounts = np.array(sorted(leaf_accounts), dtype=int)
+    history = analyzer.cube[np.ix_(positions, accounts, np.arange(len(MONTHS)))]
+    closed = np.arange(len(MONTHS))[None, :] < analyzer.closed_months[positions][:, None]
+    return positions, accounts, history, closed
+
+
+def fit_accounts(history, closed):
+    """
+    Anpassar en normalfördelning per konto och månad: säsongsmedel över åren och
+    en gemensam residualspridning per konto. Konton utan stängda månader tas bort.
+    Returnerar (medel konto × månad, spridning per konto, nedre gräns, övre gräns, urval).
+    """
+    w = np.broadcast_to(closed[:, None, :], history.shape).astype(float)
+    n_obs = w.sum(axis=(0, 2))
+    month_obs = w.sum(axis=0)
+
+    overall_mean = (w * history).sum(axis=(0, 2)) / np.maximum(n_obs, 1)
+    month_mean = (w * history).sum(axis=0) / np.maximum(month_obs, 1)
+    mean = np.where(month_obs > 0, month_mean, overall_mean[:, None])
+
+    # Residualer mot säsongsmedel, frihetsgrader = observationer - skattade månadsmedel
+    residual_ss = (w * (history - mean[None]) ** 2).sum(axis=(0, 2))
+    dof = n_obs - (month_obs > 0).sum(axis=1)
+    overall_ss = (w * (history - overall_mean[None, :, None]) ** 2).sum(axis=(0, 2))
+    std = np.where(dof >= 2,
+                   np.sqrt(residual_ss / np.maximum(dof, 1)),
+                   np.sqrt(overall_ss / np.maximum(n_obs - 1, 1)))
+
+    # Tecknet hålls inom det som observerats historiskt
+    observed = w.astype(bool)
+    low = np.where((np.where(observed, history, 0) >= 0).all(axis=(0, 2)), 0.0, -np.inf)
+    high = np.where((np.where(observed, history, 0) <= 0).all(axis=(0, 2)), 0.0, np.inf)
+    keep = n_obs > 0
+    return mean[keep], std[keep], low[keep], high[keep], keep
+
+
+def simulate_net(mean, std, low, high, n_draws=DEFAULT_DRAWS, seed=DEFAULT_SEED):
+    """
+    Drar månadsvärden per konto och summerar till resultat per dragning och månad.
+    Dragningarna görs i block så att minnet inte växer med antalet dragningar.
+    """
+    rng = np.random.default_rng(seed)
+    n_accounts, n_months = mean.shape
+    net = np.zeros((n_draws, n_months))
+    chunk = max(1, CHUNK_ELEMENTS // max(n_accounts * n_months, 1))
+    for start in range(0, n_draws, chunk):
+        size = min(chunk, n_draws - start)
+        # float32 räcker för dragningarna, summan per månad görs i float64
+        draws = rng.standard_normal((size, n_accounts, n_months), dtype=np.float32)
+        draws *= std[:, None].astype(np.float32)
+        draws += mean.astype(np.float32)
+        np.clip(draws, low[:, None], high[:, None], out=draws)
+        net[start:start + size] = draws.sum(axis=1, dtype=float)
+    return net
+
+
+def simulate_sheet(analyzer, sheet_name, n_draws=DEFAULT_DRAWS, seed=DEFAULT_SEED):
+    """
+    Simulerar årets resultat för en flik. Stängda månader behåller sitt utfall och
+    övriga månader dras från fördelningar anpassade till företagets samtliga år.
+    För avslutade år simuleras hela året som ett nytt år med samma historik.
+    """
+    if sheet_name not in analyzer.sheet_positions:
+        return None
+    position = analyzer.sheet_positions[sheet_name]
+    company = analyzer.sheet_index[position][0]
+    _, _, history, closed = company_history(analyzer, company)
+    mean, std, low, high, _ = fit_accounts(history, closed)
+    if not len(mean):
+        return None
+
+    n_closed = int(analyzer.closed_months[position])
+    if n_closed >= len(MONTHS):
+        n_closed = 0
+    actual = analyzer.key_series[position, 2, :n_closed]
+
+    monthly = np.empty((n_draws, len(MONTHS)))
+    monthly[:, :n_closed] = actual
+    monthly[:, n_closed:] = simulate_net(mean[:, n_closed:], std, low, high, n_draws, seed)
+    cumulative = monthly.cumsum(axis=1)
+    yearly = cumulative[:, -1]
+
+    fan = pd.DataFrame(np.percentile(cumulative, PERCENTILES, axis=0),
+                       index=[f'P{p}' for p in PERCENTILES], columns=MONTHS)
+    return {
+        'sheet': sheet_name,
+        'company': company,
+        'closed_months': n_closed,
+        'n_draws': n_draws,
+        'seed': seed,
+        'yearly_net': yearly,
+        'loss_probability': float((yearly < 0).mean()),
+        'fan': fan,
+    }
+
+
+def simulate_portfolio(analyzer, n_draws=DEFAULT_DRAWS, seed=DEFAULT_SEED):
+    """Sammanfattar simuleringen för varje företags senaste flik"""
+    rows = []
+    for company in analyzer.get_companies():
+        positions = analyzer.get_company_positions(company)
+        if not positions:
+            continue
+        sheet = analyzer.sheet_names[positions[-1][1]]
+        result = analyzer.get_simulation(sheet, n_draws, seed)
+        if result is None:
+            continue
+        p5, p50, p95 = np.percentile(result['yearly_net'], [5, 50, 95])
+        rows.append({
+            'Företag': company,
+            'Flik': sheet,
+            'Stängda månader': result['closed_months'],
+            'P(förlust) (%)': result['loss_probability'] * 100,
+            'P5': p5,
+            'Median': p50,
+            'P95': p95,
+        })
+    return pd.DataFrame(rows)
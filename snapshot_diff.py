@@ -0,0 +1,171 @@
+"""
+Versionsjämförelse - skillnader mellan två datasnapshots via innehållshashar per flik och rad
+"""
+import hashlib
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from financial_analyzer import VALUE_COLUMNS, normalize_label
+
+# FNV-1a-konstanter för 64-bitars radhashar
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+# Skillnader mindre än så räknas som lika (flyttalsbrus från omräkningar)
+TOLERANCE = 1e-9
+
+CHANGE_COLUMNS = ['Flik', 'Ändring', 'Konto', 'Kolumn', 'Tidigare', 'Nu', 'Differens']
+SUMMARY_COLUMNS = ['Flik', 'Status', 'Ändrade celler', 'Nya konton', 'Borttagna konton']
+
+CHANGED_CELL, ADDED_ACCOUNT, REMOVED_ACCOUNT = 'Ändrat värde', 'Nytt konto', 'Borttaget konto'
+ADDED_SHEET, REMOVED_SHEET = 'Ny flik', 'Borttagen flik'
+
+
+def row_hashes(labels, matrix):
+    """
+    64-bitars hash per rad över etikett och alla värden. NaN och -0 normaliseras
+    så att samma innehåll alltid ger samma hash oavsett hur talen räknats fram.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    words = np.ascontiguousarray(np.where(np.isnan(matrix), np.nan, matrix + 0.0)).view(np.uint64)
+    hashes = np.full(len(matrix), FNV_OFFSET, dtype=np.uint64)
+    for column in range(words.shape[1]):
+        hashes = (hashes ^ words[:, column]) * FNV_PRIME
+    label_hashes = np.fromiter((zlib.crc32(str(label).encode('utf-8')) for label in labels),
+                               dtype=np.uint64, count=len(labels))
+    return (hashes ^ label_hashes) * FNV_PRIME
+
+
+def sheet_hash(hashes):
+    """Flikens hash över radhasharna i ordning"""
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+
+def _sheet_names(source):
+    """Flikar i en FinancialAnalyzer eller BinarySnapshot"""
+    names = getattr(source, 'sheet_names', None)
+    return list(names if names is not None else source.sheets)
+
+
+def _row_keys(labels):
+    """Konto-nyckel per rad: normaliserad etikett plus löpnummer för dubbletter, None för tomma rader"""
+    seen = {}
+    keys = []
+    for label in labels:
+        if not label:
+            keys.append(None)
+            continue
+        key = normalize_label(label)
+        keys.append((key, seen.get(key, 0)))
+        seen[key] = seen.get(key, 0) + 1
+    return keys
+
+
+def _account_records(sheet, kind, labels, matrix, rows):
+    """En rad per tillkommet eller borttaget konto med helårsbeloppet"""
+    total = len(VALUE_COLUMNS) - 1
+    added = kind in (ADDED_ACCOUNT, ADDED_SHEET)
+    records = []
+    for row in rows:
+        value = matrix[row, total]
+        old, new = (None, value) if added else (value, None)
+        records.append((sheet, kind, labels[row], VALUE_COLUMNS[total], old, new, value if added else -value))
+    return records
+
+
+def diff_sheet(sheet, old_labels, old_matrix, new_labels, new_matrix, old_hashes=None, new_hashes=None):
+    """
+    Jämför en flik mellan två versioner. Rader paras ihop på kontonyckel och
+    rader med samma hash hoppas över; bara ändrade radpar jämförs cell för cell.
+    Returnerar (ändringsposter, sammanfattningsrad).
+    """
+    old_hashes = row_hashes(old_labels, old_matrix) if old_hashes is None else old_hashes
+    new_hashes = row_hashes(new_labels, new_matrix) if new_hashes is None else new_hashes
+    old_keys = {key: row for row, key in enumerate(_row_keys(old_labels)) if key is not None}
+    new_keys = {key: row for row, key in enumerate(_row_keys(new_labels)) if key is not None}
+
+    pairs = [(old_keys[key], row) for key, row in new_keys.items()
+             if key in old_keys and old_hashes[old_keys[key]] != new_hashes[row]]
+    added = [row for key, row in new_keys.items() if key not in old_keys]
+    removed = [row for key, row in old_keys.items() if key not in new_keys]
+
+    records = []
+    n_cells = 0
+    if pairs:
+        old_rows, new_rows = (np.array(rows) for rows in zip(*pairs))
+        old_values = np.asarray(old_matrix, dtype=float)[old_rows]
+        new_values = np.asarray(new_matrix, dtype=float)[new_rows]
+        old_nan, new_nan = np.isnan(old_values), np.isnan(new_values)
+        close = np.abs(np.nan_to_num(old_values) - np.nan_to_num(new_values)) <= TOLERANCE
+        same = (old_nan & new_nan) | (~old_nan & ~new_nan & close)
+        for i, column in zip(*np.nonzero(~same)):
+            old, new = old_values[i, column], new_values[i, column]
+            records.append((sheet, CHANGED_CELL, new_labels[new_rows[i]], VALUE_COLUMNS[column],
+                            None if np.isnan(old) else old, None if np.isnan(new) else new,
+                            np.nan_to_num(new) - np.nan_to_num(old)))
+        n_cells = len(records)
+    records += _account_records(sheet, ADDED_ACCOUNT, new_labels, np.asarray(new_matrix), added)
+    records += _account_records(sheet, REMOVED_ACCOUNT, old_labels, np.asarray(old_matrix), removed)
+
+    status = 'Ändrad' if records else 'Omsorterad'
+    return records, (sheet, status, n_cells, len(added), len(removed))
+
+
+class SnapshotDiff:
+    """
+    Skillnader mellan en tidigare och en ny datasnapshot. Flikar med samma
+    flikhash jämförs inte alls; i övriga flikar jämförs bara rader vars hash
+    skiljer sig. Källorna kan vara FinancialAnalyzer eller BinarySnapshot.
+    """
+
+    def __init__(self, old, new):
+        self.old_version = getattr(old, 'snapshot_version', None) or getattr(old, 'version', None)
+        self.new_version = getattr(new, 'snapshot_version', None) or getattr(new, 'version', None)
+        old_sheets, new_sheets = _sheet_names(old), _sheet_names(new)
+
+        records, summary = [], []
+        for sheet in new_sheets:
+            new_labels, new_matrix = new.labels[sheet], new.values[sheet]
+            if sheet not in old.labels:
+                records += _account_records(sheet, ADDED_SHEET, new_labels, np.asarray(new_matrix),
+                                            [row for row, label in enumerate(new_labels) if label])
+                summary.append((sheet, ADDED_SHEET, 0, sum(1 for label in new_labels if label), 0))
+                continue
+            old_labels, old_matrix = old.labels[sheet], old.values[sheet]
+            old_hashes, new_hashes = row_hashes(old_labels, old_matrix), row_hashes(new_labels, new_matrix)
+            if sheet_hash(old_hashes) == sheet_hash(new_hashes):
+                summary.append((sheet, 'Oförändrad', 0, 0, 0))
+                continue
+            sheet_records, sheet_summary = diff_sheet(sheet, old_labels, old_matrix, new_labels, new_matrix,
+                                                      old_hashes, new_hashes)
+            records += sheet_records
+            summary.append(sheet_summary)
+        for sheet in old_sheets:
+            if sheet not in new.labels:
+                old_labels = old.labels[sheet]
+                records += _account_records(sheet, REMOVED_SHEET, old_labels, np.asarray(old.values[sheet]),
+                                            [row for row, label in enumerate(old_labels) if label])
+                summary.append((sheet, REMOVED_SHEET, 0, 0, sum(1 for label in old_labels if label)))
+
+        self.changes = pd.DataFrame(records, columns=CHANGE_COLUMNS)
+        self.summary = pd.DataFrame(summary, columns=SUMMARY_COLUMNS)
+
+    @property
+    def changed_sheets(self):
+        """Flikar med någon skillnad"""
+        return self.summary.loc[self.summary['Status'] != 'Oförändrad', 'Flik'].tolist()
+
+    def counts(self):
+        """Antal poster per ändringstyp"""
+        return self.changes['Ändring'].value_counts().to_dict()
+
+    def for_sheet(self, sheet_name):
+        """Ändringsposter för en flik"""
+        return self.changes[self.changes['Flik'] == sheet_name]
+
+
+def diff_snapshots(old, new):
+    """Jämför två snapshots, se SnapshotDiff"""
+    return SnapshotDiff(old, new)